@@ -0,0 +1,148 @@
+#
+# Lookup table of the APD90 of the AP-CS model against the hERG conductance.
+#
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import modelling
+
+
+class APDTable(object):
+    """
+    The steady-state APD90s of the AP-CS model, i.e. the AP model of
+    ``AP_model`` (a :class:`modelling.BindingKinetics`) with only the hERG
+    conductance scaled, as a function of the conductance scale in [0, 1].
+
+    The APD90 of each of the ``save_signal`` pulses run after
+    ``steady_state_pulse`` pulses, tracked during the simulation (see
+    :class:`modelling.BiomarkerTracker`), is tabulated and interpolated
+    linearly, which preserves monotonicity and keeps the effect of each
+    point local.
+    Starting from ``initial_points`` evenly spaced scales, intervals are
+    bisected while the APD90 simulated at their midpoint differs by more
+    than ``APD_tol`` from the interpolated one, down to a width of
+    ``min_width``, so that points concentrate around the onset of EADs.
+
+    If a ``directory`` is given, tables are stored there under a hash of the
+    model, the protocol, the simulation settings and the version of the
+    biomarker definitions, and loaded instead of being computed again.
+    """
+
+    def __init__(self, AP_model, steady_state_pulse=1000, save_signal=2,
+                 abs_tol=1e-7, rel_tol=1e-8, directory=None,
+                 initial_points=11, APD_tol=1, min_width=1e-3):
+        super(APDTable, self).__init__()
+
+        self.AP_model = AP_model
+        self.settings = dict(
+            steady_state_pulse=steady_state_pulse, save_signal=save_signal,
+            abs_tol=abs_tol, rel_tol=rel_tol)
+        self.directory = directory
+        self.initial_points = initial_points
+        self.APD_tol = APD_tol
+        self.min_width = min_width
+
+        self.scales = None
+        self.APD90s = None
+
+    def key(self):
+        """
+        Returns the hash identifying the table of the model, protocol,
+        simulation settings and version of the biomarker definitions (see
+        :class:`modelling.BiomarkerTracker`).
+        """
+        h = hashlib.sha256()
+        h.update(self.AP_model.model.code().encode())
+        h.update(self.AP_model.protocol.code().encode())
+        settings = dict(self.settings,
+                        method=self.AP_model.steady_state_method,
+                        biomarkers=modelling.BiomarkerTracker.version)
+        h.update(json.dumps(settings, sort_keys=True).encode())
+
+        return h.hexdigest()
+
+    def _simulate(self, scale):
+        """
+        Returns the APD90 of each saved pulse of the AP-CS model with the
+        hERG conductance scaled by ``scale``.
+        """
+        base_conductance = self.AP_model.original_constants['gKr']
+        biomarkers = self.AP_model.conductance_simulation(
+            base_conductance * scale, self.settings['steady_state_pulse'],
+            save_signal=self.settings['save_signal'],
+            abs_tol=self.settings['abs_tol'],
+            rel_tol=self.settings['rel_tol'], biomarkers=True)
+
+        return list(biomarkers['APD90'])
+
+    def _set_table(self, scales, APD90s):
+        order = np.argsort(scales)
+        self.scales = np.array(scales, dtype=float)[order]
+        self.APD90s = np.array(APD90s, dtype=float)[order]
+
+    def build(self):
+        """
+        Loads the table from ``directory`` or computes it.
+        """
+        path = None
+        if self.directory is not None:
+            path = os.path.join(self.directory, self.key() + '.csv')
+            if os.path.isfile(path):
+                table = pd.read_csv(path, index_col=[0])
+                self._set_table(table['scale'].values,
+                                table.drop(columns=['scale']).values)
+                return
+
+        table = {}
+        for scale in np.linspace(0, 1, self.initial_points):
+            table[scale] = self._simulate(scale)
+        self._set_table(list(table.keys()), list(table.values()))
+
+        intervals = list(zip(self.scales[:-1], self.scales[1:]))
+        while intervals:
+            lower, upper = intervals.pop()
+            if upper - lower < 2 * self.min_width:
+                continue
+            scale = (lower + upper) / 2
+            predicted = self(scale)
+            table[scale] = self._simulate(scale)
+            self._set_table(list(table.keys()), list(table.values()))
+            if np.max(np.abs(table[scale] - predicted)) > self.APD_tol:
+                intervals += [(lower, scale), (scale, upper)]
+
+        if path is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            table = pd.DataFrame(
+                self.APD90s, columns=['pulse ' + str(i) for i in
+                                      range(self.APD90s.shape[1])])
+            table.insert(0, 'scale', self.scales)
+            # Write to a temporary file first, so that other processes never
+            # read a partly written table
+            fd, temp_path = tempfile.mkstemp(suffix='.csv',
+                                             dir=self.directory)
+            os.close(fd)
+            table.to_csv(temp_path)
+            os.replace(temp_path, path)
+
+    def __call__(self, scale):
+        """
+        Returns the APD90 of each saved pulse at the conductance scale(s)
+        ``scale``.
+        """
+        if self.scales is None:
+            self.build()
+
+        return np.stack([np.interp(scale, self.scales, APD90s)
+                         for APD90s in self.APD90s.T], axis=-1)
+
+    def APD90(self, scale):
+        """
+        Returns the largest APD90 over the saved pulses at the conductance
+        scale(s) ``scale``, as used by :meth:`ModelComparison.APD_sim`.
+        """
+        return np.max(self(scale), axis=-1)
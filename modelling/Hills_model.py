@@ -39,20 +39,27 @@ class HillsModelOpt(object):
 
         self.model = model
 
-    def optimise(self, drug_conc, inhibit_metric, parallel=True):
-
-        if not any([i == 0 for i in drug_conc]):
-            raise ValueError("Must have drug concentration = 0")
-
-        # normalise metric
-        metric_min = min(inhibit_metric)
-        metric_max = max(inhibit_metric)
-        inhibit_metric = (
-            inhibit_metric - metric_min) / (metric_max - metric_min)
-
-        zero_drug_conc = drug_conc.index(0)
-        drug_conc = np.delete(drug_conc, zero_drug_conc)
-        inhibit_metric = np.delete(inhibit_metric, zero_drug_conc)
+    def optimise(self, drug_conc, inhibit_metric, parallel=True,
+                 method='cmaes'):
+        """
+        Fits the Hill curve to the inhibition metric at each drug
+        concentration, which must include concentration 0. Returns the best
+        parameters (Hill coefficient and IC50) and their mean squared error.
+
+        ``method`` is either 'cmaes' for the global search with
+        :class:`pints.CMAES` or 'least_squares' for the deterministic fit of
+        :meth:`optimise_batch`.
+        """
+        if method not in ['cmaes', 'least_squares']:
+            raise ValueError(
+                "Method must be either 'cmaes' or 'least_squares'")
+
+        if method == 'least_squares':
+            params, scores = self.optimise_batch([drug_conc],
+                                                 [inhibit_metric])
+            return params[0], scores[0]
+
+        drug_conc, inhibit_metric = self._prepare(drug_conc, inhibit_metric)
 
         IC50_predict = drug_conc[min(range(len(inhibit_metric)),
                                  key=lambda i: abs(inhibit_metric[i] - 0.5))]
@@ -75,3 +82,155 @@ class HillsModelOpt(object):
         param_best, score_best = optimiser.run()
 
         return param_best, score_best
+
+    def _prepare(self, drug_conc, inhibit_metric):
+        # Normalises the metric and removes drug concentration 0
+        drug_conc = list(drug_conc)
+        if not any([i == 0 for i in drug_conc]):
+            raise ValueError("Must have drug concentration = 0")
+
+        # normalise metric
+        inhibit_metric = np.asarray(inhibit_metric, dtype=float)
+        metric_min = min(inhibit_metric)
+        metric_max = max(inhibit_metric)
+        inhibit_metric = (
+            inhibit_metric - metric_min) / (metric_max - metric_min)
+
+        zero_drug_conc = drug_conc.index(0)
+        drug_conc = np.delete(drug_conc, zero_drug_conc)
+        inhibit_metric = np.delete(inhibit_metric, zero_drug_conc)
+
+        return drug_conc, inhibit_metric
+
+    def optimise_batch(self, drug_conc, inhibit_metrics, max_iterations=100,
+                       restart_threshold=1e-3):
+        """
+        Fits Hill curves to many dose-response curves at once, given a list
+        of drug concentrations and a list of inhibition metrics for each
+        curve (curves may have different numbers of points). Returns arrays
+        with the best parameters (Hill coefficient and IC50) and the mean
+        squared error of each curve.
+
+        The parameters are fitted in log space by Levenberg-Marquardt
+        iterations with the analytic Jacobian, all curves together, starting
+        from a linear regression of the logit of the response against the
+        log concentration. Curves whose mean squared error remains above
+        ``restart_threshold`` are fitted again from several starting points,
+        keeping the best fit.
+        """
+        data = [self._prepare(c, m) for c, m in zip(drug_conc,
+                                                    inhibit_metrics)]
+        n_points = max(len(c) for c, _ in data)
+        log_conc = np.zeros((len(data), n_points))
+        response = np.zeros((len(data), n_points))
+        weights = np.zeros((len(data), n_points))
+        for i, (c, m) in enumerate(data):
+            log_conc[i, :len(c)] = np.log(c)
+            response[i, :len(c)] = m
+            weights[i, :len(c)] = 1
+
+        theta = self._initial_guess(log_conc, response, weights)
+        theta, scores = self._levenberg_marquardt(
+            theta, log_conc, response, weights, max_iterations)
+
+        # Multi-start for the poorly fitted curves, with the midpoint of the
+        # curve spread over the concentration range
+        poor = np.where(scores > restart_threshold)[0]
+        if len(poor):
+            lower = np.array([np.min(np.log(data[i][0])) for i in poor])
+            upper = np.array([np.max(np.log(data[i][0])) for i in poor])
+            starts = []
+            for Hill_coef in [0.3, 1, 3]:
+                for f in [0.25, 0.5, 0.75]:
+                    midpoint = lower + f * (upper - lower)
+                    starts.append(np.stack(
+                        [np.full(len(poor), np.log(Hill_coef)),
+                         Hill_coef * midpoint], axis=1))
+            n_starts = len(starts)
+            theta_starts, scores_starts = self._levenberg_marquardt(
+                np.concatenate(starts), np.tile(log_conc[poor], (n_starts, 1)),
+                np.tile(response[poor], (n_starts, 1)),
+                np.tile(weights[poor], (n_starts, 1)), max_iterations)
+            theta_starts = theta_starts.reshape(n_starts, len(poor), 2)
+            scores_starts = scores_starts.reshape(n_starts, len(poor))
+            best = np.argmin(scores_starts, axis=0)
+            for j, i in enumerate(poor):
+                if scores_starts[best[j], j] < scores[i]:
+                    theta[i] = theta_starts[best[j], j]
+                    scores[i] = scores_starts[best[j], j]
+
+        return np.exp(theta), scores
+
+    def _initial_guess(self, log_conc, response, weights):
+        # Linear regression of log((1 - y) / y) = n * log(c) - log(IC50),
+        # using the points away from the plateaus if there are enough
+        y = np.clip(response, 1e-3, 1 - 1e-3)
+        logit = np.log((1 - y) / y)
+        w = weights * (response > 0.02) * (response < 0.98)
+        w = np.where(np.sum(w, axis=1, keepdims=True) >= 2, w, weights)
+
+        sw = np.sum(w, axis=1)
+        mean_x = np.sum(w * log_conc, axis=1) / sw
+        mean_z = np.sum(w * logit, axis=1) / sw
+        dx = log_conc - mean_x[:, None]
+        var_x = np.sum(w * dx**2, axis=1)
+        slope = np.sum(w * dx * (logit - mean_z[:, None]), axis=1) / \
+            np.where(var_x > 0, var_x, 1)
+        Hill_coef = np.where(slope > 0.05, slope, 1)
+        log_IC50 = Hill_coef * mean_x - mean_z
+
+        return np.stack([np.log(Hill_coef), log_IC50], axis=1)
+
+    def _residuals(self, theta, log_conc, response, weights):
+        # Residuals of the Hill curve with parameters log(n) and log(IC50),
+        # and their Jacobian
+        Hill_coef = np.exp(theta[:, 0])[:, None]
+        z = np.clip(Hill_coef * log_conc - theta[:, 1][:, None], -700, 700)
+        curve = 1 / (1 + np.exp(z))
+        residuals = (curve - response) * weights
+
+        dcurve = -curve * (1 - curve) * weights
+        jacobian = np.stack([dcurve * Hill_coef * log_conc, -dcurve],
+                            axis=2)
+
+        return residuals, jacobian
+
+    def _levenberg_marquardt(self, theta, log_conc, response, weights,
+                             max_iterations, tol=1e-12):
+        # Vectorised Levenberg-Marquardt iterations, with a damping factor
+        # for each curve
+        theta = np.array(theta, dtype=float)
+        n_points = np.sum(weights, axis=1)
+        damping = np.full(len(theta), 1e-3)
+        active = np.ones(len(theta), dtype=bool)
+
+        r, J = self._residuals(theta, log_conc, response, weights)
+        sse = np.sum(r**2, axis=1)
+        for _ in range(max_iterations):
+            if not np.any(active):
+                break
+            JtJ = np.einsum('bmi,bmj->bij', J, J)
+            gradient = np.einsum('bmi,bm->bi', J, r)
+            A = JtJ + damping[:, None, None] * (
+                JtJ * np.eye(2) + 1e-12 * np.eye(2))
+            step = -np.linalg.solve(A, gradient[:, :, None])[:, :, 0]
+            step[~active] = 0
+
+            theta_new = theta + step
+            theta_new[:, 0] = np.clip(theta_new[:, 0], -10, 10)
+            r_new, J_new = self._residuals(
+                theta_new, log_conc, response, weights)
+            sse_new = np.sum(r_new**2, axis=1)
+
+            better = active & (sse_new < sse)
+            improvement = np.where(better, sse - sse_new, 0)
+            theta[better] = theta_new[better]
+            r[better], J[better] = r_new[better], J_new[better]
+            sse[better] = sse_new[better]
+            damping = np.where(better, damping / 3, damping * 4)
+
+            small_step = np.max(np.abs(step), axis=1) < 1e-8
+            small_change = better & (improvement <= tol * (sse + tol))
+            active &= ~(small_step | small_change | (damping > 1e16))
+
+        return theta, sse / n_points
@@ -1,5 +1,15 @@
 from .binding_kinetics import BindingKinetics
 
+from .APD_table import APDTable
+
+from .biomarkers import (
+    BiomarkerTracker,
+    beat_biomarkers,
+    pulse_array
+)
+
+from .expm_simulation import ExpmSimulation
+
 from .lib_binding_kinetics import (
     BindingParameters,
     ProtocolParameters,
@@ -19,10 +29,31 @@ from .Hills_model import (
     HillsModelOpt
 )
 
+from .model_cache import ModelCache
+
 from .model_comparison import (
     ModelComparison
 )
 
+from .multiion_surrogate import (
+    MultiIonSurrogate
+)
+
+from .parameter_sampler import ParameterSampler
+
+from .results_store import ResultsStore
+
 from .sensitivity_analysis import (
     SensitivityAnalysis
 )
+
+from .simulation_pool import SimulationPool
+
+from .steady_state import (
+    PeriodicSteadyState,
+    SteadyStateCache
+)
+
+from .sweep_executor import SweepExecutor
+
+from .trace_store import TraceStore
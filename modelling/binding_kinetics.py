@@ -19,12 +19,54 @@ class BindingKinetics(object):
     (ref. Table 2)
     """
 
-    def __init__(self, model, protocol=None, current_head=None):
+    def __init__(self, model, protocol=None, current_head=None,
+                 engine='cvode', steady_state_method='pacing',
+                 model_cache=None):
         super(BindingKinetics, self).__init__()
 
+        # Simulation backend: 'cvode' uses myokit.Simulation, 'expm' uses
+        # the exact matrix-exponential solver for the IKr-only model under
+        # voltage clamp
+        if engine not in ['cvode', 'expm']:
+            raise ValueError("Choice of engine must be either 'cvode' or "
+                             "'expm'")
+        self.engine = engine
+
+        # Pre-pacing: 'pacing' runs all the requested repeats, 'converge'
+        # stops pacing once the beats repeat, and 'shooting' solves for the
+        # limit cycle and paces only if that fails
+        if steady_state_method not in ['pacing', 'converge', 'shooting']:
+            raise ValueError("Choice of steady_state_method must be one of "
+                             "'pacing', 'converge' or 'shooting'")
+        self.steady_state_method = steady_state_method
+        # Variable (e.g. 'membrane.V' or 'ikr.IKr') whose trace must also
+        # repeat for the 'converge' method
+        self.convergence_log_var = None
+        self.prepace_beats = None
+        self.start_state = None
+        self.prepace_state = None
+        # Optional SteadyStateCache consulted before pre-pacing
+        self.steady_state_cache = None
+        # Number of repeats replaced by the exact steady state when
+        # ``repeats=None``, which sets the phase of the protocol the steady
+        # state is taken at
+        self.steady_state_repeats = 1000
+        # Time units of membrane potential passed to the biomarker tracker
+        # at once, when simulating with ``biomarkers=True``
+        self.biomarker_chunk = 100
+        # Integrals computed by the solver over each logged pulse, as a
+        # dictionary mapping names to expressions (e.g. 'ikr.IKr'), and
+        # their values in the last simulation
+        self.accumulators = {}
+        self.accumulated = None
+        self._accumulator_model = None
+
         self.model = model
         self.protocol = protocol
-        self.sim = myokit.Simulation(self.model, self.protocol)
+        # Compiled simulations reused between runs, loaded from the
+        # ModelCache if given
+        self.simulation_pool = modelling.SimulationPool(model_cache)
+        self.sim = self.simulation()
         # self.sim.set_default_state(self.sim.state())
         self.initial_state = self.sim.state()
 
@@ -42,10 +84,275 @@ class BindingKinetics(object):
             "Kt": self.model.get(self.current_head.var('Kt')).eval(),
             "gKr": self.model.get(self.current_head.var('gKr')).eval(), }
 
+    def simulation(self, constants=None, protocol=None, abs_tol=1e-6,
+                   rel_tol=1e-4):
+        """
+        Returns a simulation of the model and protocol from the simulation
+        pool, using the chosen simulation engine, reset to the model's
+        initial state with the given ``constants`` applied.
+        """
+        if protocol is None:
+            protocol = self.protocol
+
+        return self.simulation_pool.simulation(
+            self.model, protocol, constants, abs_tol=abs_tol,
+            rel_tol=rel_tol, engine=self.engine)
+
+    def _drug_constants(self, Vhalf, Kmax, Ku, N, EC50):
+        """
+        Returns the constants of the model for a drug with the given binding
+        parameters.
+        """
+        head = self.current_head
+
+        return {
+            head.var('Vhalf').qname(): Vhalf,
+            head.var('Kmax').qname(): Kmax,
+            head.var('Ku').qname(): Ku,
+            head.var('n').qname(): N,
+            head.var('halfmax').qname(): EC50,
+            head.var('Kt').qname(): 3.5e-5,
+            head.var('gKr').qname(): self.original_constants["gKr"], }
+
+    def _ion_constants(self, ion_scale):
+        """
+        Returns the conductances of the ion channels other than hERG, scaled
+        by ``ion_scale``. If ``ion_scale`` has a scale for ``'IKr'``, the
+        hERG conductance is scaled too, on top of the block by the drug.
+        """
+        conductances = {
+            'INaL': 'inal.gNaL', 'ICaL': 'ical.base', 'INa': 'ina.gNa',
+            'Ito': 'ito.gto', 'IK1': 'ik1.gK1', 'IKs': 'iks.gKs'}
+
+        constants = {var: self.model.get(var).eval() * ion_scale[current]
+                     for current, var in conductances.items()}
+        if 'IKr' in ion_scale:
+            constants[self.current_head.var('gKr').qname()] = \
+                self.original_constants["gKr"] * ion_scale['IKr']
+
+        return constants
+
+    def _pre_pace(self, t_max, repeats, save_signal, abs_tol, rel_tol):
+        """
+        Brings the simulation to the start of the logged pulses by pacing
+        ``repeats - save_signal`` pulses of duration ``t_max``, by pacing
+        until the pulses repeat or by solving for the periodic steady state
+        directly, to the same tolerances as the simulation. ``repeats=None``
+        (expm engine only) starts from the exact steady state that pacing
+        ``steady_state_repeats - save_signal`` pulses converges to, at the
+        same phase of the protocol. The number of pulses used is stored in
+        ``prepace_beats`` (with ``repeats=None``, the number pacing needs to
+        get within tolerance of the steady state, or
+        ``steady_state_repeats - save_signal`` if it never does), and the
+        states before and after pre-pacing in ``start_state`` and
+        ``prepace_state``. If a ``steady_state_cache`` is set, the pre-paced
+        state is looked up there first and stored there otherwise.
+
+        The 'converge' and 'shooting' methods pace ``t_max`` at a time, so
+        ``t_max`` has to be the period of the protocol.
+        """
+        names = [v.qname() for v in self.model.states()]
+        self.start_state = dict(zip(names, self.sim.state()))
+
+        key = cached = None
+        if self.steady_state_cache is not None:
+            settings = dict(
+                engine=self.engine, method=self.steady_state_method,
+                log_var=self.convergence_log_var, t_max=t_max,
+                repeats=repeats, save_signal=save_signal, abs_tol=abs_tol,
+                rel_tol=rel_tol, start_state=self.sim.state(),
+                constants=self.sim_constants)
+            if repeats is None:
+                settings['steady_state_repeats'] = self.steady_state_repeats
+            key = self.steady_state_cache.key(self.model, self.protocol,
+                                              **settings)
+            cached = self.steady_state_cache.get(key)
+
+        if cached is not None:
+            state, beats = cached
+            self.sim.set_state(state)
+            self.sim.set_default_state(state)
+        elif repeats is None:
+            state, beats = self.sim.periodic_steady_state(
+                pre=t_max * (self.steady_state_repeats - save_signal))
+            self.sim.set_state(state)
+            # If pacing does not get within tolerance of the steady state,
+            # count the pulses it would have been paced for instead
+            if not np.isfinite(beats):
+                beats = self.steady_state_repeats - save_signal
+        elif self.steady_state_method == 'converge':
+            beats = modelling.PeriodicSteadyState(self.sim, t_max).converge(
+                max_beats=repeats - save_signal, rtol=rel_tol, atol=abs_tol,
+                log_var=self.convergence_log_var)
+        elif self.steady_state_method == 'shooting':
+            beats = modelling.PeriodicSteadyState(self.sim, t_max).shooting(
+                max_beats=repeats - save_signal, rtol=rel_tol, atol=abs_tol)
+        else:
+            beats = repeats - save_signal
+            self.sim.pre(t_max * beats)
+        if key is not None and cached is None:
+            self.steady_state_cache.set(key, self.sim.state(), beats)
+        self.prepace_beats = beats
+        self.prepace_state = dict(zip(names, self.sim.state()))
+
+    def _augmented_model(self):
+        """
+        Returns a clone of the model with an extra state for each of the
+        ``accumulators``, whose derivative is its expression, and the
+        indices of these states.
+        """
+        key = sorted(self.accumulators.items())
+        if self._accumulator_model is None or \
+                self._accumulator_model[0] != key:
+            model = self.model.clone()
+            component = model.add_component_allow_renaming('accumulators')
+            variables = []
+            for name, expression in key:
+                var = component.add_variable(name)
+                var.promote(0)
+                var.set_rhs(expression)
+                variables.append(var)
+            model.validate()
+            indices = {var.name(): var.index() for var in variables}
+            self._accumulator_model = (key, model, indices)
+
+        return self._accumulator_model[1:]
+
+    def _run(self, t_max, save_signal, log_var, timestep, biomarkers,
+             abs_tol, rel_tol):
+        """
+        Runs the ``save_signal`` pulses of duration ``t_max`` after
+        pre-pacing, returning their log (folded if there are several pulses)
+        or, with ``biomarkers``, their biomarkers (see
+        :meth:`_run_biomarkers`).
+
+        If ``accumulators`` are set, the pulses are run with the model
+        augmented by their states (see :meth:`_augmented_model`), which are
+        set to zero at the start of each pulse, and the integrals over each
+        pulse are stored in ``accumulated``. Reading them from the final
+        state is more accurate than integrating a logged trace and needs no
+        log at all.
+        """
+        sim = self.sim
+        if self.accumulators:
+            if self.engine != 'cvode':
+                raise ValueError("Accumulators require the 'cvode' engine")
+            model, indices = self._augmented_model()
+            state = [0] * model.count_states()
+            for var, value in zip(self.model.states(), sim.state()):
+                state[model.get(var.qname()).index()] = value
+            self.sim = self.simulation_pool.simulation(
+                model, self.protocol, self.sim_constants, abs_tol=abs_tol,
+                rel_tol=rel_tol, engine=self.engine)
+            self.sim.set_state(state)
+            self.sim.set_time(sim.time())
+            self.accumulated = {name: [] for name in indices}
+
+        try:
+            if biomarkers:
+                return self._run_biomarkers(t_max, save_signal)
+            if self.accumulators:
+                log = log_var
+                for pulse in range(save_signal):
+                    self._start_pulse()
+                    log = self.sim.run(t_max, log=log, log_interval=timestep)
+                    self._end_pulse()
+            else:
+                log = self.sim.run(t_max * save_signal, log=log_var,
+                                   log_interval=timestep)
+            d2 = log.npview()
+            if save_signal > 1:
+                d2 = d2.fold(t_max)
+
+            return d2
+        finally:
+            if self.accumulators:
+                self.accumulated = {
+                    name: np.array(values)
+                    for name, values in self.accumulated.items()}
+                self.sim = sim
+
+    def _start_pulse(self):
+        # Starts integrating the accumulators from zero
+        if self.accumulators:
+            state = self.sim.state()
+            for index in self._accumulator_model[2].values():
+                state[index] = 0
+            self.sim.set_state(state)
+
+    def _end_pulse(self):
+        # Records the integrals of the accumulators over the pulse
+        if self.accumulators:
+            state = self.sim.state()
+            for name, index in self._accumulator_model[2].items():
+                self.accumulated[name].append(state[index])
+
+    def _stimulus_time(self, t_max):
+        """
+        Returns the start of the first stimulus of the protocol within a
+        pulse of duration ``t_max``.
+        """
+        events = self.protocol.events() if self.protocol is not None else []
+
+        return events[0].start() % t_max if events else 0
+
+    def _run_biomarkers(self, t_max, save_signal):
+        """
+        Runs ``save_signal`` pulses of duration ``t_max`` and returns a
+        :class:`myokit.DataLog` with the resting potential, the peak and the
+        APD30, APD50 and APD90 of each pulse (see
+        :class:`modelling.BiomarkerTracker`), with APDs measured from the
+        stimulus. The membrane potential is logged at the solver's own steps
+        for ``biomarker_chunk`` time units at a time and only passed to the
+        tracker, so no trace is stored and the APDs do not depend on a log
+        interval.
+        """
+        time_var = self.model.time().qname()
+        tracker = modelling.BiomarkerTracker(self._stimulus_time(t_max))
+
+        d = myokit.DataLog()
+        for pulse in range(save_signal):
+            start = self.sim.time()
+            tracker.reset(start)
+            self._start_pulse()
+            chunks = int(np.ceil(t_max / self.biomarker_chunk - 1e-9))
+            for k in range(chunks):
+                duration = min(self.biomarker_chunk,
+                               t_max - k * self.biomarker_chunk)
+                log = self.sim.run(duration, log=[time_var, 'membrane.V'])
+                tracker.update(log[time_var], log['membrane.V'])
+            self._end_pulse()
+            for name, value in tracker.biomarkers(start + t_max).items():
+                d[name] = np.append(d.get(name, []), value)
+
+        return d
+
+    def _new_simulation(self, abs_tol, rel_tol, constants, drug_conc=None):
+        """
+        Sets ``self.sim`` to a reset simulation with the given tolerances and
+        constants, starting at the drug concentration ``drug_conc`` if given.
+        """
+        self.sim = self.simulation(constants, abs_tol=abs_tol,
+                                   rel_tol=rel_tol)
+        self.sim_constants = {k: float(v) for k, v in constants.items()}
+        if drug_conc is not None:
+            self._set_state(self.sim.state(), drug_conc)
+
+    def _set_state(self, state, drug_conc=None):
+        """
+        Sets the simulation state from a list or a dictionary such as a
+        :class:`myokit.DataLog`, with the drug concentration replaced by
+        ``drug_conc`` if given.
+        """
+        state = self.model.map_to_state(state)
+        if drug_conc is not None:
+            state[self.model.get('ikr.D').index()] = drug_conc
+        self.sim.set_state(state)
+
     def drug_simulation(self, drug, drug_conc, repeats,
                         timestep=0.1, save_signal=1, log_var=None,
                         set_state=None, abs_tol=1e-6, rel_tol=1e-4,
-                        protocol_period=None):
+                        protocol_period=None, biomarkers=False):
         param_lib = modelling.BindingParameters()
 
         Vhalf = param_lib.binding_parameters[drug]['Vhalf']
@@ -60,109 +367,141 @@ class BindingKinetics(object):
             t_max = protocol_period
         # print(t_max)
 
-        concentration = self.model.get('ikr.D')
-        concentration.set_state_value(drug_conc)
-
-        self.sim = myokit.Simulation(self.model, self.protocol)
-        self.sim.reset()
-        self.sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
+        self._new_simulation(abs_tol, rel_tol,
+                             self._drug_constants(Vhalf, Kmax, Ku, N, EC50),
+                             drug_conc)
         if set_state:
-            set_state['ikr.D'][-1] = drug_conc
-            self.sim.set_state(set_state)
+            self._set_state(set_state, drug_conc)
         # self.sim.set_state(self.initial_state)
 
-        self.sim.set_constant(self.current_head.var('Vhalf'), Vhalf)
-        self.sim.set_constant(self.current_head.var('Kmax'), Kmax)
-        self.sim.set_constant(self.current_head.var('Ku'), Ku)
-        self.sim.set_constant(self.current_head.var('n'), N)
-        self.sim.set_constant(self.current_head.var('halfmax'), EC50)
-        self.sim.set_constant(self.current_head.var('Kt'), 3.5e-5)
-        self.sim.set_constant(self.current_head.var('gKr'),
-                              self.original_constants["gKr"])
-
-        self.sim.pre(t_max * (repeats - save_signal))
-        log = self.sim.run(t_max * save_signal, log=log_var,
-                           log_interval=timestep)
-        d2 = log.npview()
-        if save_signal > 1:
-            d2 = d2.fold(t_max)
-
-        # self.sim.reset()
+        self._pre_pace(t_max, repeats, save_signal, abs_tol, rel_tol)
 
-        return d2
+        return self._run(t_max, save_signal, log_var, timestep, biomarkers,
+                         abs_tol, rel_tol)
 
     def custom_simulation(self, param_values, drug_conc, repeats,
                           timestep=0.1, save_signal=1, log_var=None,
-                          abs_tol=1e-6, rel_tol=1e-4):
+                          abs_tol=1e-6, rel_tol=1e-4, set_state=None,
+                          biomarkers=False, ion_scale=None):
 
         t_max = self.protocol.characteristic_time()
 
-        concentration = self.model.get('ikr.D')
-        concentration.set_state_value(drug_conc)
+        constants = self._drug_constants(
+            param_values['Vhalf'].values[0], param_values['Kmax'].values[0],
+            param_values['Ku'].values[0], param_values['N'].values[0],
+            param_values['EC50'].values[0])
+        if ion_scale is not None:
+            # Scale conductance of the other ion channels
+            constants.update(self._ion_constants(ion_scale))
+        self._new_simulation(abs_tol, rel_tol, constants, drug_conc)
+        if set_state:
+            self._set_state(set_state, drug_conc)
+
+        self._pre_pace(t_max, repeats, save_signal, abs_tol, rel_tol)
+
+        return self._run(t_max, save_signal, log_var, timestep, biomarkers,
+                         abs_tol, rel_tol)
+
+    def steady_state(self, drug_params, drug_conc, protocol=None, tol=1e-8):
+        """
+        Returns the periodic steady state of the model under a voltage clamp
+        protocol, and the number of protocol repeats needed to reach it
+        within ``tol`` from the model's initial state. Requires the 'expm'
+        engine.
+
+        ``drug_params`` is either the name of a drug in
+        :class:`modelling.BindingParameters` or a dataframe with the
+        parameters Vhalf, Kmax, Ku, N and EC50.
+        """
+        if self.engine != 'expm':
+            raise ValueError("Steady state solver requires the 'expm' "
+                             "engine")
+
+        if isinstance(drug_params, str):
+            param_lib = modelling.BindingParameters()
+            drug_params = param_lib.binding_parameters[drug_params]
+        else:
+            drug_params = {k: drug_params[k].values[0]
+                           for k in ['Vhalf', 'Kmax', 'Ku', 'N', 'EC50']}
+
+        if protocol is None:
+            protocol = self.protocol
+
+        sim = self.simulation(self._drug_constants(
+            drug_params['Vhalf'], drug_params['Kmax'], drug_params['Ku'],
+            drug_params['N'], drug_params['EC50']), protocol=protocol)
+        state = sim.state()
+        state[self.model.get('ikr.D').index()] = drug_conc
+        sim.set_state(state)
+
+        state, beats = sim.periodic_steady_state(tol=tol)
+
+        return state, beats
+
+    def custom_peaks(self, param_values, drug_conc, repeats, timestep=0.1,
+                     current_name='ikr.IKr'):
+        """
+        Returns the peak current in the last protocol repeat of
+        :meth:`custom_simulation`, for a batch of virtual drugs and
+        concentrations at once. Requires the 'expm' engine. ``repeats=None``
+        starts from the exact steady state, at the phase of the protocol
+        reached after ``steady_state_repeats`` repeats.
+
+        ``param_values`` is a dataframe with one row per drug and columns
+        Vhalf, Kmax, Ku, N and EC50. ``drug_conc`` is either a list of
+        concentrations used for every drug, or an array with one row per
+        drug. Returns an array of shape ``(n_drugs, n_concentrations)``.
+        """
+        if self.engine != 'expm':
+            raise ValueError("Batched simulation requires the 'expm' engine")
 
-        self.sim = myokit.Simulation(self.model, self.protocol)
-        self.sim.reset()
-        self.sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
+        t_max = self.protocol.characteristic_time()
 
-        self.sim.set_constant(self.current_head.var('Vhalf'),
-                              param_values['Vhalf'].values[0])
-        self.sim.set_constant(self.current_head.var('Kmax'),
-                              param_values['Kmax'].values[0])
-        self.sim.set_constant(self.current_head.var('Ku'),
-                              param_values['Ku'].values[0])
-        self.sim.set_constant(self.current_head.var('n'),
-                              param_values['N'].values[0])
-        self.sim.set_constant(self.current_head.var('halfmax'),
-                              param_values['EC50'].values[0])
-        self.sim.set_constant(self.current_head.var('Kt'), 3.5e-5)
-        self.sim.set_constant(self.current_head.var('gKr'),
-                              self.original_constants["gKr"])
+        def values(param):
+            return np.array(param_values[param].values, dtype=float)[:, None]
 
-        self.sim.pre(t_max * (repeats - save_signal))
-        log = self.sim.run(t_max * save_signal, log=log_var,
-                           log_interval=timestep)
-        d2 = log.npview()
-        if save_signal > 1:
-            d2 = d2.fold(t_max)
+        constants = self._drug_constants(
+            values('Vhalf'), values('Kmax'), values('Ku'), values('N'),
+            values('EC50'))
 
-        # self.sim.reset()
+        sim = self.simulation()
+        drug_conc = np.array(drug_conc, dtype=float)
+        if drug_conc.ndim == 1:
+            drug_conc = drug_conc[None, :]
 
-        return d2
+        if repeats is None:
+            peaks = sim.peaks(current_name, constants, {'ikr.D': drug_conc},
+                              pre=t_max * (self.steady_state_repeats - 1),
+                              duration=t_max, log_interval=timestep,
+                              steady_state=True)
+        else:
+            peaks = sim.peaks(current_name, constants, {'ikr.D': drug_conc},
+                              pre=t_max * (repeats - 1), duration=t_max,
+                              log_interval=timestep)
+
+        return peaks
 
     def conductance_simulation(self, conductance, repeats,
                                timestep=0.1, save_signal=1, log_var=None,
-                               abs_tol=1e-6, rel_tol=1e-4, set_state=None):
-        self.sim = myokit.Simulation(self.model, self.protocol)
-        self.sim.reset()
+                               abs_tol=1e-6, rel_tol=1e-4, set_state=None,
+                               biomarkers=False):
+        constants = self._drug_constants(
+            self.original_constants["Vhalf"], self.original_constants["Kmax"],
+            self.original_constants["Ku"], self.original_constants["n"],
+            self.original_constants["EC50"])
+        constants[self.current_head.var('Kt').qname()] = \
+            self.original_constants["Kt"]
+        constants[self.current_head.var('gKr').qname()] = conductance
+        self._new_simulation(abs_tol, rel_tol, constants)
         if set_state:
-            self.sim.set_state(set_state)
-        self.sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
+            self._set_state(set_state)
 
-        self.sim.set_constant(self.current_head.var('Vhalf'),
-                              self.original_constants["Vhalf"])
-        self.sim.set_constant(self.current_head.var('Kmax'),
-                              self.original_constants["Kmax"])
-        self.sim.set_constant(self.current_head.var('Ku'),
-                              self.original_constants["Ku"])
-        self.sim.set_constant(self.current_head.var('n'),
-                              self.original_constants["n"])
-        self.sim.set_constant(self.current_head.var('halfmax'),
-                              self.original_constants["EC50"])
-        self.sim.set_constant(self.current_head.var('Kt'),
-                              self.original_constants["Kt"])
-        self.sim.set_constant(self.current_head.var('gKr'), conductance)
         t_max = self.protocol.characteristic_time()
 
-        self.sim.pre(t_max * (repeats - save_signal))
-        log = self.sim.run(t_max * save_signal, log=log_var,
-                           log_interval=timestep)
-        d2 = log.npview()
-        if save_signal > 1:
-            d2 = d2.fold(t_max)
+        self._pre_pace(t_max, repeats, save_signal, abs_tol, rel_tol)
 
-        # self.sim.reset()
-
-        return d2
+        return self._run(t_max, save_signal, log_var, timestep, biomarkers,
+                         abs_tol, rel_tol)
 
     def state_occupancy_plot(self, ax, signal_log, pulse=None, legend=True):
 
@@ -200,14 +539,8 @@ class BindingKinetics(object):
         return ax
 
     def extract_peak(self, signal_log, current_name):
-        peaks = []
-        pulses = len(signal_log.keys_like(current_name))
-
-        if pulses == 0:
-            peaks.append(np.max(signal_log[current_name]))
-
-        for i in range(pulses):
-            peaks.append(np.max(signal_log[current_name, i]))
+        peaks = list(np.max(
+            modelling.pulse_array(signal_log, current_name), axis=1))
 
         if peaks[0] == 0:
             peak_reduction = 0
@@ -217,14 +550,16 @@ class BindingKinetics(object):
         return peaks, peak_reduction
 
     def APD90(self, signal, offset, timestep):
-        APA = max(signal) - min(signal)
-        APD90_v = min(signal) + 0.1 * APA
-        index = np.abs(np.array(signal) - APD90_v).argmin()
-        APD90 = index * timestep - offset
-        if APD90 < 1:
-            APD90 = len(signal) * timestep
+        """
+        Returns the APD90 of a pulse of the membrane potential sampled every
+        ``timestep``, measured from the stimulus at ``offset``, or an array
+        of APD90s for a 2-D array of pulses (see
+        :func:`modelling.beat_biomarkers`). Pulses that do not repolarise
+        give the pulse duration.
+        """
+        APD90 = modelling.beat_biomarkers(signal, timestep, offset)['APD90']
 
-        return APD90
+        return APD90 if np.ndim(signal) > 1 else float(APD90[0])
 
     def drug_APclamp(self, drug, drug_conc, times, voltages, t_max, repeats,
                      timestep=0.1, save_signal=1, log_var=None, abs_tol=1e-6,
@@ -237,12 +572,10 @@ class BindingKinetics(object):
         N = param_lib.binding_parameters[drug]['N']
         EC50 = param_lib.binding_parameters[drug]['EC50']
 
-        concentration = self.model.get('ikr.D')
-        concentration.set_state_value(drug_conc)
-
         self.sim = myokit.Simulation(self.model)
         self.sim.set_fixed_form_protocol(times, voltages)
         self.sim.reset()
+        self._set_state(self.sim.state(), drug_conc)
         # self.sim.set_state(self.initial_state)
 
         self.sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
@@ -273,7 +606,8 @@ class BindingKinetics(object):
 
     def drug_multiion_simulation(self, drug, drug_conc, ion_scale, repeats,
                                  timestep=0.1, save_signal=1, log_var=None,
-                                 set_state=None, abs_tol=1e-6, rel_tol=1e-4):
+                                 set_state=None, abs_tol=1e-6, rel_tol=1e-4,
+                                 biomarkers=False):
         param_lib = modelling.BindingParameters()
 
         Vhalf = param_lib.binding_parameters[drug]['Vhalf']
@@ -284,65 +618,21 @@ class BindingKinetics(object):
 
         t_max = self.protocol.characteristic_time()
 
-        concentration = self.model.get('ikr.D')
-        concentration.set_state_value(drug_conc)
-
-        self.sim = myokit.Simulation(self.model, self.protocol)
-        self.sim.reset()
-        self.sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
-        if set_state:
-            set_state['ikr.D'][-1] = drug_conc
-            self.sim.set_state(set_state)
-
-        self.sim.set_constant(self.current_head.var('Vhalf'), Vhalf)
-        self.sim.set_constant(self.current_head.var('Kmax'), Kmax)
-        self.sim.set_constant(self.current_head.var('Ku'), Ku)
-        self.sim.set_constant(self.current_head.var('n'), N)
-        self.sim.set_constant(self.current_head.var('halfmax'), EC50)
-        self.sim.set_constant(self.current_head.var('Kt'), 3.5e-5)
-        self.sim.set_constant(self.current_head.var('gKr'),
-                              self.original_constants["gKr"])
-
         # Scale conductace of ion channels other than hERG
-        base_conductance = self.model.get(self.model.get('inal').var(
-            'gNaL')).eval()
-        self.sim.set_constant(self.model.get('inal').var('gNaL'),
-                              base_conductance * ion_scale['INaL'])
-        base_conductance = self.model.get(self.model.get('ical').var(
-            'base')).eval()
-        self.sim.set_constant(self.model.get('ical').var('base'),
-                              base_conductance * ion_scale['ICaL'])
-        base_conductance = self.model.get(self.model.get('ina').var(
-            'gNa')).eval()
-        self.sim.set_constant(self.model.get('ina').var('gNa'),
-                              base_conductance * ion_scale['INa'])
-        base_conductance = self.model.get(self.model.get('ito').var(
-            'gto')).eval()
-        self.sim.set_constant(self.model.get('ito').var('gto'),
-                              base_conductance * ion_scale['Ito'])
-        base_conductance = self.model.get(self.model.get('ik1').var(
-            'gK1')).eval()
-        self.sim.set_constant(self.model.get('ik1').var('gK1'),
-                              base_conductance * ion_scale['IK1'])
-        base_conductance = self.model.get(self.model.get('iks').var(
-            'gKs')).eval()
-        self.sim.set_constant(self.model.get('iks').var('gKs'),
-                              base_conductance * ion_scale['IKs'])
-
-        self.sim.pre(t_max * (repeats - save_signal))
-        log = self.sim.run(t_max * save_signal, log=log_var,
-                           log_interval=timestep)
-        d2 = log.npview()
-        if save_signal > 1:
-            d2 = d2.fold(t_max)
+        constants = self._drug_constants(Vhalf, Kmax, Ku, N, EC50)
+        constants.update(self._ion_constants(ion_scale))
+        self._new_simulation(abs_tol, rel_tol, constants, drug_conc)
+        if set_state:
+            self._set_state(set_state, drug_conc)
 
-        # self.sim.reset()
+        self._pre_pace(t_max, repeats, save_signal, abs_tol, rel_tol)
 
-        return d2
+        return self._run(t_max, save_signal, log_var, timestep, biomarkers,
+                         abs_tol, rel_tol)
 
     def drug_multiion_CS_sim(self, ion_scale, repeats,
                              timestep=0.1, save_signal=1, log_var=None,
-                             abs_tol=1e-6, rel_tol=1e-4):
+                             abs_tol=1e-6, rel_tol=1e-4, biomarkers=False):
         # param_lib = modelling.BindingParameters()
 
         # Vhalf = param_lib.binding_parameters[drug]['Vhalf']
@@ -356,9 +646,11 @@ class BindingKinetics(object):
         # concentration = self.model.get('ikr.D')
         # concentration.set_state_value(drug_conc)
 
-        self.sim = myokit.Simulation(self.model, self.protocol)
-        self.sim.reset()
-        self.sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
+        # Scale conductace of ion channels other than hERG
+        constants = self._ion_constants(ion_scale)
+        constants[self.model.get('ikr').var('gKr').qname()] = \
+            self.original_constants["gKr"] * ion_scale['IKr']
+        self._new_simulation(abs_tol, rel_tol, constants)
         # if set_state:
         #     set_state['ikr.D'][-1] = drug_conc
         #     self.sim.set_state(set_state)
@@ -372,42 +664,7 @@ class BindingKinetics(object):
         # self.sim.set_constant(self.current_head.var('gKr'),
         #                       self.original_constants["gKr"])
 
-        # Scale conductace of ion channels other than hERG
-        self.sim.set_constant(
-            self.model.get('ikr').var('gKr'),
-            self.original_constants["gKr"] * ion_scale['IKr'])
-        base_conductance = self.model.get(self.model.get('inal').var(
-            'gNaL')).eval()
-        self.sim.set_constant(self.model.get('inal').var('gNaL'),
-                              base_conductance * ion_scale['INaL'])
-        base_conductance = self.model.get(self.model.get('ical').var(
-            'base')).eval()
-        self.sim.set_constant(self.model.get('ical').var('base'),
-                              base_conductance * ion_scale['ICaL'])
-        base_conductance = self.model.get(self.model.get('ina').var(
-            'gNa')).eval()
-        self.sim.set_constant(self.model.get('ina').var('gNa'),
-                              base_conductance * ion_scale['INa'])
-        base_conductance = self.model.get(self.model.get('ito').var(
-            'gto')).eval()
-        self.sim.set_constant(self.model.get('ito').var('gto'),
-                              base_conductance * ion_scale['Ito'])
-        base_conductance = self.model.get(self.model.get('ik1').var(
-            'gK1')).eval()
-        self.sim.set_constant(self.model.get('ik1').var('gK1'),
-                              base_conductance * ion_scale['IK1'])
-        base_conductance = self.model.get(self.model.get('iks').var(
-            'gKs')).eval()
-        self.sim.set_constant(self.model.get('iks').var('gKs'),
-                              base_conductance * ion_scale['IKs'])
-
-        self.sim.pre(t_max * (repeats - save_signal))
-        log = self.sim.run(t_max * save_signal, log=log_var,
-                           log_interval=timestep)
-        d2 = log.npview()
-        if save_signal > 1:
-            d2 = d2.fold(t_max)
+        self._pre_pace(t_max, repeats, save_signal, abs_tol, rel_tol)
 
-        # self.sim.reset()
-
-        return d2
+        return self._run(t_max, save_signal, log_var, timestep, biomarkers,
+                         abs_tol, rel_tol)
@@ -0,0 +1,191 @@
+#
+# Action potential biomarkers of streamed or logged voltage traces.
+#
+import numpy as np
+
+
+class BiomarkerTracker(object):
+    """
+    Tracks the biomarkers of an action potential from consecutive chunks of
+    its voltage trace, so that the trace itself never has to be stored.
+
+    The resting potential is the voltage at the start of the pulse and the
+    peak is the highest voltage reached. The APD at each of the ``levels``
+    (in % repolarisation) is the time from the stimulus, ``offset`` time
+    units after the start of the pulse, to the last downward crossing of
+    ``peak - level / 100 * (peak - rest)`` after the peak, interpolated
+    linearly between samples. Crossings before the peak, such as those of
+    repolarisation notches followed by a higher peak, are ignored. If the
+    voltage ends the pulse above a level, the APD is the pulse duration.
+    """
+
+    # Version of the definition of the biomarkers, increased whenever it
+    # changes, so that results computed with different definitions are not
+    # mixed (see :class:`modelling.ResultsStore`). Version 1 took the minimum
+    # of the pulse as the resting potential and the logged sample closest to
+    # the APD90 level anywhere in the pulse as the end of the APD90.
+    version = 2
+
+    def __init__(self, offset=0, levels=(30, 50, 90)):
+        super(BiomarkerTracker, self).__init__()
+
+        self.offset = offset
+        self.levels = list(levels)
+        self.reset()
+
+    def reset(self, start=0):
+        """
+        Starts tracking a new pulse starting at time ``start``.
+        """
+        self.start = start
+        self.rest = None
+        self.peak = -np.inf
+        self.peak_time = None
+        # Last sample, and time of the last downward crossing of each level
+        # while the voltage stays below it
+        self._last = None
+        self._crossings = [None] * len(self.levels)
+
+    def update(self, time, voltage):
+        """
+        Adds the next chunk of samples of the voltage trace.
+        """
+        time = np.asarray(time, dtype=float)
+        voltage = np.asarray(voltage, dtype=float)
+        if len(time) == 0:
+            return
+        if self._last is not None:
+            time = np.concatenate([[self._last[0]], time])
+            voltage = np.concatenate([[self._last[1]], voltage])
+        elif self.rest is None:
+            self.rest = voltage[0]
+        self._last = (time[-1], voltage[-1])
+
+        # Only the samples after the peak are searched for crossings
+        i = np.argmax(voltage)
+        if voltage[i] > self.peak:
+            self.peak, self.peak_time = voltage[i], time[i]
+            self._crossings = [None] * len(self.levels)
+            time, voltage = time[i:], voltage[i:]
+        if len(time) < 2:
+            return
+
+        for k, level in enumerate(self.levels):
+            threshold = self.peak - level / 100 * (self.peak - self.rest)
+            above = voltage >= threshold
+            changes = np.flatnonzero(above[1:] != above[:-1])
+            if len(changes) == 0:
+                continue
+            if above[-1]:
+                self._crossings[k] = None
+            else:
+                j = changes[-1]
+                self._crossings[k] = time[j] + (
+                    threshold - voltage[j]) / (voltage[j + 1] - voltage[j]) \
+                    * (time[j + 1] - time[j])
+
+    def biomarkers(self, end):
+        """
+        Returns a dictionary with the resting potential ``'rest'``, the peak
+        ``'peak'`` and the APD at each level (e.g. ``'APD90'``) of the pulse
+        ending at time ``end``.
+        """
+        biomarkers = {'rest': self.rest, 'peak': self.peak}
+        for level, crossing in zip(self.levels, self._crossings):
+            if crossing is None:
+                APD = end - self.start
+            else:
+                APD = crossing - self.start - self.offset
+            biomarkers['APD' + str(level)] = APD
+
+        return biomarkers
+
+
+def pulse_array(log, var, period=None):
+    """
+    Returns the values of ``var`` in a :class:`myokit.DataLog` as a 2-D
+    array with one row per pulse.
+
+    The pulses of a log folded with :meth:`myokit.DataLog.fold` are stacked
+    into a new array. An unfolded log with equally spaced samples is
+    reshaped into pulses of duration ``period`` as a view of the logged
+    array, without copying it, or gives a single row if ``period`` is
+    ``None``.
+    """
+    pulses = len(log.keys_like(var))
+    if pulses:
+        return np.stack([log[var, i] for i in range(pulses)])
+
+    values = np.asarray(log[var])
+    if period is None:
+        return values[None]
+    time = log.time()
+    samples = int(round(period / (time[1] - time[0])))
+    pulses = len(values) // samples
+
+    return values[:pulses * samples].reshape(pulses, samples)
+
+
+def beat_biomarkers(signal, timestep, offset=0, currents=None, levels=(90,),
+                    EAD_threshold=5, EAD_delay=50):
+    """
+    Returns a dictionary with the biomarkers of every pulse of the membrane
+    potential ``signal``, an array with one row of samples every
+    ``timestep`` per pulse (see :func:`pulse_array`), computed for all
+    pulses at once.
+
+    As for :class:`BiomarkerTracker`, the resting potential ``'rest'`` is
+    the first sample, the peak ``'peak'`` the highest, and the APD at each
+    of the ``levels`` (e.g. ``'APD90'``) runs from the stimulus at
+    ``offset`` to the last downward crossing of the level after the peak,
+    interpolated linearly, or is the pulse duration if the pulse ends above
+    the level. ``'alternans'`` is the change in the APD at the last of the
+    ``levels`` from the previous pulse (NaN for the first pulse), and
+    ``'EAD'`` flags pulses that depolarise again by more than
+    ``EAD_threshold`` between ``EAD_delay`` after the peak (past any notch
+    and dome) and that crossing, or that do not repolarise past the
+    level. The peak of each of the ``currents``, a dictionary of
+    arrays shaped like ``signal``, is given as ``'peak '`` and its name.
+    """
+    signal = np.atleast_2d(np.asarray(signal, dtype=float))
+    pulses, samples = signal.shape
+    rows = np.arange(pulses)
+
+    peak_index = np.argmax(signal, axis=1)
+    rest, peak = signal[:, 0], signal[rows, peak_index]
+    after_peak = np.arange(samples)[None, :] >= peak_index[:, None]
+
+    biomarkers = {'rest': rest, 'peak': peak}
+    for level in levels:
+        threshold = (peak - level / 100 * (peak - rest))[:, None]
+        above = signal >= threshold
+        down = above[:, :-1] & ~above[:, 1:] & after_peak[:, :-1]
+        # Index of the last downward crossing, valid if the pulse ends below
+        # the level
+        last = samples - 2 - np.argmax(down[:, ::-1], axis=1)
+        repolarised = ~above[:, -1]
+        V0, V1 = signal[rows, last], signal[rows, last + 1]
+        fraction = (threshold[:, 0] - V0) / np.where(repolarised, V1 - V0, 1)
+        biomarkers['APD' + str(level)] = np.where(
+            repolarised, (last + fraction) * timestep - offset,
+            samples * timestep)
+
+    biomarkers['alternans'] = np.abs(np.diff(
+        biomarkers['APD' + str(levels[-1])], prepend=np.nan))
+
+    # Rise above the lowest potential since the notch, up to repolarisation
+    index = np.arange(samples)[None, :]
+    start = peak_index + int(round(EAD_delay / timestep))
+    end = np.where(repolarised, last, samples - 1)
+    window = (index >= start[:, None]) & (index <= end[:, None])
+    lowest = np.minimum.accumulate(np.where(window, signal, np.inf), axis=1)
+    rise = np.where(window, signal - lowest, 0)
+    biomarkers['EAD'] = (np.max(rise, axis=1) > EAD_threshold) | \
+        ~repolarised
+
+    if currents is not None:
+        for name, current in currents.items():
+            biomarkers['peak ' + name] = np.max(
+                np.atleast_2d(current), axis=1)
+
+    return biomarkers
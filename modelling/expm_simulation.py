@@ -0,0 +1,777 @@
+#
+# Exact simulation of linear ion channel models under voltage clamp.
+#
+# With the membrane potential clamped to a piecewise-constant protocol and
+# the drug concentration held constant, the hERG binding model is a linear
+# ODE dx/dt = A(V) x. Each protocol step can therefore be propagated exactly
+# with a single matrix exponential, instead of integrating with CVODE.
+#
+import myokit
+import myokit.formats.python
+import numpy as np
+import scipy.linalg
+
+
+def _fixed_point(M, x0, tol=1e-8, max_doublings=60):
+    """
+    Returns the fixed points of ``x -> M x`` with ``sum(x) = sum(x0)``, for a
+    (stack of) matrices ``M`` with shape ``(..., n, n)`` and states ``x0``
+    with shape ``(..., n)``.
+
+    The fixed point is the solution of ``(I - M) x = 0`` with the last row
+    replaced by the conservation of total occupancy. Where this system is
+    singular, the limit of ``M^k x0`` is found by repeated squaring instead,
+    stopping early if the powers of ``M`` grow (see :func:`_doubling`).
+    """
+    n = x0.shape[-1]
+    A = np.eye(n) - M
+    A[..., -1, :] = 1
+    b = np.zeros(x0.shape)
+    b[..., -1] = np.sum(x0, axis=-1)
+    try:
+        x = np.linalg.solve(A, b[..., None])[..., 0]
+        bad = np.any(np.abs(_dot(M, x) - x) > tol, axis=-1)
+    except np.linalg.LinAlgError:
+        x = np.zeros(x0.shape)
+        bad = np.ones(x0.shape[:-1], dtype=bool)
+
+    if np.any(bad):
+        P = M[bad]
+        for _ in range(max_doublings):
+            P_next = _doubling(P, tol)
+            if P_next is None:
+                break
+            converged = np.allclose(P_next, P, rtol=0, atol=tol * 1e-3)
+            P = P_next
+            if converged:
+                break
+        x[bad] = _dot(P, x0[bad])
+
+    return x
+
+
+def _doubling(P, tol):
+    """
+    Returns the squares of a (stack of) matrices ``P``, or ``None`` if any
+    square is not finite or has a larger 1-norm than ``P`` (by more than a
+    relative ``tol``), i.e. if repeated squaring would diverge.
+    """
+    with np.errstate(over='ignore', invalid='ignore'):
+        P_next = np.matmul(P, P)
+        norm = np.max(np.sum(np.abs(P), axis=-2), axis=-1)
+        norm_next = np.max(np.sum(np.abs(P_next), axis=-2), axis=-1)
+    if not np.all(np.isfinite(P_next)) or \
+            np.any(norm_next > norm * (1 + tol)):
+        return None
+
+    return P_next
+
+
+def _expm(A):
+    """
+    Returns the matrix exponentials of a stack of matrices with shape
+    ``(..., n, n)``, using scaling and squaring with a (13, 13) Pade
+    approximant [Higham 2005], with the scaling chosen per matrix.
+    """
+    b = [64764752532480000., 32382376266240000., 7771770303897600.,
+         1187353796428800., 129060195264000., 10559470521600.,
+         670442572800., 33522128640., 1323241920., 40840800., 960960.,
+         16380., 182., 1.]
+    theta = 5.371920351148152
+
+    norm = np.max(np.sum(np.abs(A), axis=-2), axis=-1)
+    with np.errstate(divide='ignore'):
+        s = np.maximum(0, np.ceil(np.log2(norm / theta))).astype(int)
+    A = A / (2.0**s)[..., None, None]
+
+    eye = np.broadcast_to(np.eye(A.shape[-1]), A.shape)
+    A2 = np.matmul(A, A)
+    A4 = np.matmul(A2, A2)
+    A6 = np.matmul(A4, A2)
+    U = np.matmul(A, np.matmul(A6, b[13] * A6 + b[11] * A4 + b[9] * A2)
+                  + b[7] * A6 + b[5] * A4 + b[3] * A2 + b[1] * eye)
+    V = np.matmul(A6, b[12] * A6 + b[10] * A4 + b[8] * A2) \
+        + b[6] * A6 + b[4] * A4 + b[2] * A2 + b[0] * eye
+    E = np.linalg.solve(V - U, V + U)
+
+    for k in range(np.max(s, initial=0)):
+        square = s > k
+        E[square] = np.matmul(E[square], E[square])
+
+    return E
+
+
+def _dot(M, x):
+    """
+    Multiplies a (stack of) matrices with a (stack of) vectors.
+    """
+    return np.matmul(M, x[..., None])[..., 0]
+
+
+def _conserve(E, A):
+    """
+    Returns the propagators ``E = expm(A)`` of a (stack of) matrices ``A``
+    with their columns scaled to sum to one where ``A`` conserves the total
+    occupancy (its columns sum to zero), so that the rounding errors of the
+    matrix exponential do not compound over many steps.
+    """
+    scale = np.max(np.abs(A), axis=(-2, -1))
+    conserved = np.all(np.abs(np.sum(A, axis=-2)) <= 1e-12 * np.maximum(
+        scale, 1)[..., None], axis=-1)
+    if not np.any(conserved):
+        return E
+
+    E = np.array(E)
+    E[conserved] /= np.sum(E[conserved], axis=-2, keepdims=True)
+
+    return E
+
+
+class ExpmSimulation(object):
+    """
+    Simulates a model that is linear in its states under a piecewise-constant
+    protocol, using one matrix exponential per protocol step.
+
+    The class mirrors the parts of :class:`myokit.Simulation` used by
+    :class:`modelling.BindingKinetics` (``reset``, ``set_constant``,
+    ``set_state``, ``pre``, ``run``, ...), so that it can be used as a drop-in
+    simulation backend for the IKr-only model.
+
+    States with a zero derivative (e.g. the drug concentration ``ikr.D``) are
+    treated as constants during a simulation. A ``ValueError`` is raised if
+    the remaining states do not form a linear system.
+    """
+
+    def __init__(self, model, protocol=None):
+        super(ExpmSimulation, self).__init__()
+
+        self._model = model.clone()
+        self._protocol = None if protocol is None else protocol.clone()
+
+        self._time_var = self._model.time()
+        self._pace_var = self._model.binding('pace')
+        if self._pace_var is None:
+            raise ValueError('Model must have a variable bound to pace.')
+
+        # Split states into dynamic ones and ones held constant
+        self._states = list(self._model.states())
+        self._free = []
+        self._fixed = []
+        for k, state in enumerate(self._states):
+            rhs = state.rhs()
+            if rhs.is_literal() and rhs.eval() == 0:
+                self._fixed.append(k)
+            else:
+                self._free.append(k)
+
+        # Literal constants that can be changed with set_constant()
+        self._constants = {}
+        for var in self._model.variables(const=True, deep=True):
+            if var.is_literal() and var.binding() is None:
+                self._constants[var.qname()] = float(var.eval())
+
+        # Function inputs: all states, all literal constants and the pace
+        self._inputs = self._states + [
+            self._model.get(name) for name in self._constants] + [
+            self._pace_var]
+        self._input_names = {}
+        for k, var in enumerate(self._inputs):
+            self._input_names[var] = 'x' + str(k)
+
+        writer = myokit.formats.python.NumPyExpressionWriter()
+        writer.set_lhs_function(lambda lhs: self._input_names[lhs.var()])
+        self._writer = writer
+
+        # Derivatives of the dynamic states
+        self._derivatives = self._function(
+            [self._states[k].rhs() for k in self._free])
+        self._check_linear()
+
+        self._functions = {}
+        self._default_state = np.array(self._model.initial_values(True))
+        self.reset()
+
+    def _function(self, expressions):
+        """
+        Creates a NumPy function of all inputs that evaluates the given
+        expressions, with all intermediary variables inlined.
+        """
+        expressions = [e.clone(expand=True, retain=self._inputs)
+                       for e in expressions]
+        for e in expressions:
+            if e.depends_on(self._time_var.lhs()):
+                raise ValueError(
+                    'Expressions may not depend on time: ' + str(e))
+
+        args = [self._input_names[var] for var in self._inputs]
+        code = 'def f(' + ', '.join(args) + '):\n'
+        code += '    return (' + ', '.join(
+            [self._writer.ex(e) for e in expressions]) + ',)'
+        local = {}
+        exec(code, {'numpy': np}, local)
+
+        return local['f']
+
+    def _evaluate(self, function, states, pace, constants=None):
+        if constants is None:
+            constants = self._constants
+        with np.errstate(divide='ignore'):
+            return function(*states, *constants.values(), pace)
+
+    def _check_linear(self):
+        """
+        Checks that the derivatives are linear in the dynamic states.
+        """
+        fixed = self._default_fixed_values()
+        rng = np.random.default_rng(1)
+        a, b = rng.random(len(self._free)), rng.random(len(self._free))
+        for pace in (-80, 0, 40):
+            fa = np.array(self._evaluate(
+                self._derivatives, self._full(a, fixed), pace))
+            fb = np.array(self._evaluate(
+                self._derivatives, self._full(b, fixed), pace))
+            fab = np.array(self._evaluate(
+                self._derivatives, self._full(a + 2 * b, fixed), pace))
+            if not np.allclose(fab, fa + 2 * fb, rtol=1e-8, atol=1e-12):
+                raise ValueError(
+                    'Model is not linear in its states under voltage clamp.')
+
+    def _default_fixed_values(self):
+        x = np.array(self._model.initial_values(True))
+        return x[self._fixed]
+
+    def _full(self, free, fixed):
+        """
+        Returns a list of all states, given the dynamic and fixed states.
+        """
+        x = [None] * len(self._states)
+        for k, v in zip(self._free, free):
+            x[k] = v
+        for k, v in zip(self._fixed, fixed):
+            x[k] = v
+        return x
+
+    def matrix(self, pace, constants=None, fixed=None):
+        """
+        Returns the matrix ``A`` such that ``dot(x) = A x`` for the dynamic
+        states at the given pacing level.
+
+        If any of the ``constants`` or ``fixed`` state values are arrays, a
+        stack of matrices with shape ``(..., n, n)`` is returned.
+        """
+        if fixed is None:
+            fixed = self._state[self._fixed]
+        n = len(self._free)
+        columns = []
+        for k in range(n):
+            unit = np.zeros(n)
+            unit[k] = 1
+            column = self._evaluate(
+                self._derivatives, self._full(unit, fixed), pace, constants)
+            columns.append(np.stack(np.broadcast_arrays(*column), axis=-1))
+        columns = np.broadcast_arrays(*columns)
+
+        return np.stack(columns, axis=-1)
+
+    def _propagator(self, pace, duration):
+        """
+        Returns (and caches) ``expm(A * duration)`` at the given pace, with
+        the total occupancy conserved (see :func:`_conserve`).
+        """
+        key = (float(pace), float(duration))
+        if key not in self._expm_cache:
+            if key[0] not in self._matrix_cache:
+                self._matrix_cache[key[0]] = self.matrix(pace)
+            A = self._matrix_cache[key[0]] * duration
+            self._expm_cache[key] = _conserve(scipy.linalg.expm(A), A)
+        return self._expm_cache[key]
+
+    def _clear_cache(self):
+        self._matrix_cache = {}
+        self._expm_cache = {}
+
+    def _segments(self, time, duration):
+        """
+        Yields tuples ``(start, end, pace)`` of the protocol steps between
+        ``time`` and ``time + duration``.
+        """
+        end = time + duration
+        if self._protocol is None:
+            yield time, end, 0
+            return
+        pacing = myokit.PacingSystem(self._protocol)
+        pacing.advance(time)
+        t = time
+        while t < end:
+            t_next = min(pacing.next_time(), end)
+            yield t, t_next, pacing.pace()
+            pacing.advance(t_next)
+            t = t_next
+
+    def _advance(self, x, time, duration, log_times=None):
+        """
+        Advances the dynamic states ``x`` from ``time`` for ``duration``.
+
+        If ``log_times`` is given, the states and pacing level at those times
+        are returned as well.
+        """
+        if log_times is None:
+            for start, end, pace in self._segments(time, duration):
+                x = self._propagator(pace, end - start).dot(x)
+            return x
+
+        n = len(log_times)
+        xs = np.zeros((n, len(x)))
+        paces = np.zeros(n)
+        i = 0
+        for start, end, pace in self._segments(time, duration):
+            j = np.searchsorted(log_times, end, side='left')
+            if j > i:
+                xs[i:j] = self._sample(x, pace, log_times[i:j] - start)
+                paces[i:j] = pace
+                i = j
+            x = self._propagator(pace, end - start).dot(x)
+        return x, xs, paces
+
+    def _sample(self, x, pace, offsets, block=500):
+        """
+        Returns the states at the given (uniformly spaced) ``offsets`` from
+        the start of a protocol step with initial state ``x``.
+        """
+        x = self._propagator(pace, offsets[0]).dot(x)
+        if len(offsets) == 1:
+            return x[None, :]
+        dt = offsets[1] - offsets[0]
+        step = self._propagator(pace, dt)
+        block = min(block, len(offsets))
+
+        # Powers step^0, ..., step^(block - 1)
+        powers = np.zeros((block, len(x), len(x)))
+        powers[0] = np.eye(len(x))
+        for k in range(1, block):
+            powers[k] = step.dot(powers[k - 1])
+        jump = step.dot(powers[-1])
+
+        xs = np.zeros((len(offsets), len(x)))
+        for i in range(0, len(offsets), block):
+            j = min(i + block, len(offsets))
+            xs[i:j] = powers[:j - i].dot(x)
+            x = jump.dot(x)
+        return xs
+
+    def default_state(self):
+        """
+        Returns the default state.
+        """
+        return [float(x) for x in self._default_state]
+
+    def period_map(self, period):
+        """
+        Returns the matrix ``M`` such that ``x(t + period) = M x(t)`` for the
+        dynamic states, starting from the current simulation time.
+        """
+        M = np.eye(len(self._free))
+        for start, end, pace in self._segments(self._time, period):
+            M = self._propagator(pace, end - start).dot(M)
+        return M
+
+    def protocol_period(self):
+        """
+        Returns the period of the protocol if all its events repeat with the
+        same period, or its characteristic time otherwise.
+        """
+        period = self._period()
+        if period is None:
+            return self._protocol.characteristic_time()
+        return period
+
+    def _period(self):
+        """
+        Returns the common period of all protocol events, or ``None`` if the
+        protocol is not periodic.
+        """
+        if self._protocol is None:
+            return None
+        periods = set([e.period() for e in self._protocol.events()])
+        if len(periods) == 1 and 0 not in periods:
+            return periods.pop()
+        return None
+
+    def periodic_steady_state(self, period=None, tol=1e-8,
+                              max_doublings=60, pre=0):
+        """
+        Returns the periodic steady state reached from the current state when
+        the protocol is repeated with the given ``period`` (by default the
+        :meth:`protocol_period`), and the number of periods needed to get
+        within ``tol`` of it (``np.inf`` if this takes more than
+        ``2**max_doublings`` periods, or if the powers of the period map
+        grow, so that pacing would drift away from it).
+
+        The state returned is that of the steady state ``pre`` time units
+        (modulo ``period``) after the current time, i.e. the state that
+        :meth:`pre` converges to for a duration of ``pre`` plus many periods.
+
+        The steady state is the solution of ``(I - M) x = 0`` with the total
+        occupancy of the dynamic states conserved, where ``M`` is the map
+        returned by :meth:`period_map`. If this system is singular, the limit
+        of ``M^k`` is computed by repeated squaring instead.
+        """
+        if period is None:
+            period = self.protocol_period()
+        M = self.period_map(period)
+        x0 = self._state[self._free]
+
+        x = _fixed_point(M, x0, tol, max_doublings)
+
+        # Number of periods needed, found by doubling and bisection
+        powers = [M]
+        while np.max(np.abs(powers[-1].dot(x0) - x)) > tol:
+            P = _doubling(powers[-1], tol) \
+                if len(powers) <= max_doublings else None
+            if P is None:
+                beats = np.inf
+                break
+            powers.append(P)
+        else:
+            beats = 0
+            y = x0
+            for j in reversed(range(len(powers))):
+                y_next = powers[j].dot(y)
+                if np.max(np.abs(y_next - x)) > tol:
+                    y = y_next
+                    beats += 2**j
+            if np.max(np.abs(y - x)) > tol:
+                beats += 1
+
+        remainder = pre % period
+        if remainder > 0:
+            x = self._advance(x, self._time, remainder)
+
+        state = np.array(self._state)
+        state[self._free] = x
+
+        return list(state), beats
+
+    def peaks(self, variable, constants=None, states=None, pre=0,
+              duration=None, log_interval=0.1, steady_state=False,
+              chunk_size=512):
+        """
+        Returns the maximum of ``variable`` over the logged times of a run,
+        for a whole batch of constant values and initial states at once.
+
+        This is equivalent to calling :meth:`pre` with ``pre``, followed by
+        :meth:`run` with ``duration`` and ``log_interval`` and taking the
+        maximum of the logged ``variable``, for every entry of the batch.
+
+        ``constants`` and ``states`` are dicts mapping variable names to
+        values, which are broadcast against each other to give the batch
+        shape of the returned array. For example, to compute peak currents
+        for ``n`` drugs at ``m`` concentrations, use arrays with shape
+        ``(n, 1)`` for the drug parameters and ``(1, m)`` (or ``(n, m)``) for
+        the concentration.
+
+        If ``steady_state`` is ``True``, the run starts from the periodic
+        steady state ``pre`` time units (modulo the :meth:`protocol_period`)
+        after the current time, i.e. the limit of pre-pacing ``pre`` plus
+        many periods (see :meth:`periodic_steady_state`).
+
+        The ``variable`` must be an affine function of the states. Its
+        maximum is found on a coarse subset of the logged times, then refined
+        on the full logging grid around the coarse maximum. The batch is
+        processed in chunks of ``chunk_size`` entries.
+        """
+        if isinstance(variable, myokit.Variable):
+            variable = variable.qname()
+        variable = self._model.get(variable)
+        if duration is None:
+            duration = self._protocol.characteristic_time()
+        constants = {} if constants is None else dict(constants)
+        states = {} if states is None else dict(states)
+        for name in constants:
+            if name not in self._constants:
+                raise ValueError('Not a literal constant: ' + str(name))
+
+        shape = np.broadcast_shapes(
+            *[np.shape(v) for v in constants.values()],
+            *[np.shape(v) for v in states.values()])
+        n = int(np.prod(shape))
+
+        # Flatten the batch
+        batch_constants = dict(self._constants)
+        for name, value in constants.items():
+            batch_constants[name] = np.broadcast_to(value, shape).ravel()
+        x0 = np.tile(self._state, (n, 1))
+        for name, value in states.items():
+            k = self._states.index(self._model.get(name))
+            x0[:, k] = np.broadcast_to(value, shape).ravel()
+
+        function = self._function([variable.lhs()])
+        peaks = np.zeros(n)
+        for i in range(0, n, chunk_size):
+            c = {}
+            for name, value in batch_constants.items():
+                c[name] = value[i:i + chunk_size] if np.ndim(value) else value
+            peaks[i:i + chunk_size] = self._chunk_peaks(
+                function, c, x0[i:i + chunk_size], pre, duration,
+                log_interval, steady_state)
+
+        return peaks.reshape(shape)
+
+    def _chunk_peaks(self, function, constants, x0, pre, duration,
+                     log_interval, steady_state):
+        """
+        Computes the peaks of a single chunk of a batch, see :meth:`peaks`.
+        """
+        n_free = len(self._free)
+        fixed = list(x0[:, self._fixed].T)
+
+        # Batched matrices, propagators and output coefficients
+        matrices = {}
+        propagators = {}
+
+        def propagator(pace, duration):
+            key = (float(pace), float(duration))
+            if key not in propagators:
+                if key[0] not in matrices:
+                    matrices[key[0]] = np.broadcast_to(self.matrix(
+                        pace, constants, fixed), (len(x0), n_free, n_free))
+                half = (key[0], key[1] / 2)
+                A = matrices[key[0]] * duration
+                if half in propagators:
+                    E = np.matmul(propagators[half], propagators[half])
+                else:
+                    E = _expm(A)
+                propagators[key] = _conserve(E, A)
+            return propagators[key]
+
+        def coefficients(pace):
+            # Writes the variable as y = b . x + y0
+            zero = self._full(np.zeros(n_free), fixed)
+            y0 = self._evaluate(function, zero, pace, constants)[0]
+            b = []
+            for k in range(n_free):
+                unit = np.zeros(n_free)
+                unit[k] = 1
+                b.append(self._evaluate(function, self._full(
+                    unit, fixed), pace, constants)[0] - y0)
+            b = np.stack(np.broadcast_arrays(*b, np.zeros(len(x0))), -1)
+            return b[:, :n_free], np.broadcast_to(y0, (len(x0),))
+
+        def period_map(period):
+            M = np.broadcast_to(np.eye(n_free), (len(x0), n_free, n_free))
+            for start, end, pace in self._segments(self._time, period):
+                M = np.matmul(propagator(pace, end - start), M)
+            return M
+
+        # Pre-pacing
+        x = x0[:, self._free]
+        period = self._period()
+        remainder = pre
+        if steady_state:
+            x = _fixed_point(period_map(self.protocol_period()), x)
+            remainder = pre % self.protocol_period()
+        elif period is not None and pre > 0:
+            repeats = int(pre // period)
+            remainder = pre - repeats * period
+            if repeats > 0:
+                x = _dot(np.linalg.matrix_power(
+                    period_map(period), repeats), x)
+        if remainder > 0:
+            for start, end, pace in self._segments(self._time, remainder):
+                x = _dot(propagator(pace, end - start), x)
+
+        # Logged run
+        peaks = np.full(len(x0), -np.inf)
+        n_log = int(np.ceil(duration / log_interval - 1e-9))
+        for start, end, pace in self._segments(self._time, duration):
+            k0 = int(np.ceil((start - self._time) / log_interval - 1e-9))
+            k1 = min(n_log, int(np.ceil(
+                (end - self._time) / log_interval - 1e-9)))
+            if k1 > k0:
+                first = self._time + k0 * log_interval - start
+                peak = self._segment_peak(
+                    _dot(propagator(pace, first), x), k1 - k0,
+                    coefficients(pace),
+                    lambda k: propagator(pace, k * log_interval))
+                peaks = np.maximum(peaks, peak)
+            x = _dot(propagator(pace, end - start), x)
+
+        return peaks
+
+    def _segment_peak(self, x, n, coefficients, propagator, level_size=64):
+        """
+        Returns the maximum of ``y = b . x + y0`` over ``n`` logged points
+        within a protocol step, starting from states ``x`` at the first point.
+
+        ``propagator(k)`` must return the batched propagators over ``k``
+        logging intervals. The maximum is first located on a coarse grid with
+        steps doubling every ``level_size`` points, and then refined with a
+        ternary search on the full grid between the coarse neighbours.
+        """
+        b, y0 = coefficients
+
+        # Coarse grid
+        offsets = []
+        j, step = 0, 1
+        while j < n:
+            offsets.append(j)
+            if len(offsets) % level_size == 0:
+                step *= 2
+            j += step
+        if offsets[-1] != n - 1:
+            offsets.append(n - 1)
+
+        xs = np.zeros((len(offsets),) + x.shape)
+        xs[0] = x
+        for i in range(1, len(offsets)):
+            xs[i] = _dot(propagator(offsets[i] - offsets[i - 1]), xs[i - 1])
+        ys = np.einsum('tbi,bi->tb', xs, b) + y0
+        best = np.argmax(ys, axis=0)
+        peak = ys[best, np.arange(len(y0))]
+
+        # Refine between the coarse neighbours of the maximum
+        offsets = np.array(offsets)
+        left = np.maximum(best - 1, 0)
+        right = np.minimum(best + 1, len(offsets) - 1)
+        x_left = xs[left, np.arange(len(y0))]
+        lo = np.zeros(len(y0), dtype=int)
+        hi = offsets[right] - offsets[left]
+
+        def evaluate(k):
+            # Values at k points to the right of the left neighbour
+            x = np.array(x_left)
+            bit = 0
+            while np.any(k >> bit):
+                mask = ((k >> bit) & 1).astype(bool)
+                if np.any(mask):
+                    x[mask] = _dot(propagator(2**bit)[mask], x[mask])
+                bit += 1
+            return np.einsum('bi,bi->b', x, b) + y0
+
+        while np.any(hi - lo > 2):
+            third = (hi - lo) // 3
+            m1, m2 = lo + third, hi - third
+            y1, y2 = evaluate(m1), evaluate(m2)
+            active = hi - lo > 2
+            lo = np.where(active & (y1 < y2), m1, lo)
+            hi = np.where(active & (y1 >= y2), m2, hi)
+        for k in range(3):
+            peak = np.maximum(peak, evaluate(np.minimum(lo + k, hi)))
+
+        return peak
+
+    def pre(self, duration):
+        """
+        Performs an unlogged simulation for ``duration`` time units and uses
+        the final state as the new default state. The simulation time is not
+        affected.
+        """
+        x = self._advance(self._state[self._free], self._time, duration)
+        self._state[self._free] = x
+        self._default_state = np.array(self._state)
+
+    def reset(self):
+        """
+        Resets the time to zero and the state to the default state.
+        """
+        self._time = 0
+        self._state = np.array(self._default_state)
+        self._clear_cache()
+
+    def run(self, duration, log=None, log_interval=None):
+        """
+        Runs a simulation for ``duration`` time units and returns a
+        :class:`myokit.DataLog` with the variables in ``log``, evaluated
+        every ``log_interval`` time units.
+
+        Similar to :meth:`myokit.Simulation.run`, ``log`` can be a list of
+        variables or variable names, ``myokit.LOG_NONE``, or ``None`` to log
+        the time, the pacing and all states.
+        """
+        duration = float(duration)
+        time = self._time
+        if log_interval is None:
+            log_interval = 1
+
+        if log is None:
+            log = [self._time_var, self._pace_var] + self._states
+        elif log == myokit.LOG_NONE:
+            log = []
+        log = [self._model.get(v) if isinstance(v, str)
+               else self._model.get(v.qname()) for v in log]
+
+        n_times = int(np.ceil(duration / log_interval - 1e-9))
+        log_times = time + log_interval * np.arange(n_times)
+        x, xs, paces = self._advance(
+            self._state[self._free], time, duration, log_times)
+
+        d = myokit.DataLog()
+        d.set_time_key(self._time_var.qname())
+        variables = [v for v in log if v != self._time_var]
+        if variables:
+            key = tuple(variables)
+            if key not in self._functions:
+                self._functions[key] = self._function(
+                    [v.lhs() for v in variables])
+            states = self._full(xs.T, self._state[self._fixed])
+            values = self._evaluate(self._functions[key], states, paces)
+        else:
+            values = []
+        d[self._time_var.qname()] = log_times
+        for var, value in zip(variables, values):
+            d[var.qname()] = np.broadcast_to(value, log_times.shape).copy()
+
+        self._state[self._free] = x
+        self._time = time + duration
+
+        return d
+
+    def set_constant(self, var, value):
+        """
+        Changes the value of a literal constant.
+        """
+        if isinstance(var, myokit.Variable):
+            var = var.qname()
+        if var not in self._constants:
+            raise ValueError('Not a literal constant: ' + str(var))
+        self._constants[var] = float(value)
+        self._clear_cache()
+
+    def set_default_state(self, state):
+        """
+        Changes the default state.
+        """
+        self._default_state = np.array(self._model.map_to_state(state))
+
+    def set_state(self, state):
+        """
+        Changes the current state.
+        """
+        self._state = np.array(self._model.map_to_state(state))
+        self._clear_cache()
+
+    def set_time(self, time=0):
+        """
+        Sets the current simulation time.
+        """
+        self._time = float(time)
+
+    def set_tolerance(self, abs_tol=1e-6, rel_tol=1e-4):
+        """
+        Has no effect: each step is propagated exactly up to rounding
+        errors, which are kept from drifting the total occupancy over long
+        runs by renormalising the propagators.
+        """
+        pass
+
+    def state(self):
+        """
+        Returns the current state.
+        """
+        return [float(x) for x in self._state]
+
+    def time(self):
+        """
+        Returns the current simulation time.
+        """
+        return self._time
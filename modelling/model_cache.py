@@ -0,0 +1,105 @@
+#
+# Cache of parsed models and compiled simulations, shared between processes.
+#
+import hashlib
+import os
+import platform
+import sys
+import tempfile
+
+import myokit
+
+
+class ModelCache(object):
+    """
+    A cache of compiled :class:`myokit.Simulation` modules, shared by all
+    processes on a machine and across runs.
+
+    Compiled simulations are stored in ``directory``, in a subdirectory for
+    the current Myokit version, Python version and platform, under a hash of
+    the model code. Workers that find a model already compiled load it
+    instead of compiling it again. Models are also parsed only once per
+    process by :meth:`load`.
+    """
+
+    def __init__(self, directory=None):
+        super(ModelCache, self).__init__()
+
+        if directory is None:
+            directory = os.path.join(
+                os.path.expanduser('~'), '.cache', 'modelling')
+        version = 'myokit-%s-py%d%d-%s' % (
+            myokit.__version__, sys.version_info[0], sys.version_info[1],
+            platform.machine())
+        self.directory = os.path.join(directory, version)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._models = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model):
+        """
+        Returns the hash of a :class:`myokit.Model` identifying its compiled
+        simulation.
+        """
+        return hashlib.sha256(model.code().encode()).hexdigest()
+
+    def load(self, filename):
+        """
+        Loads a model from an ``.mmt`` file, parsing each file content only
+        once per process. Returns a clone of the parsed model.
+        """
+        with open(filename, 'rb') as f:
+            key = hashlib.sha256(f.read()).hexdigest()
+        if key not in self._models:
+            model, _, _ = myokit.load(filename)
+            model.validate()
+            self._models[key] = model
+
+        return self._models[key].clone()
+
+    def simulation(self, model, protocol=None):
+        """
+        Returns a :class:`myokit.Simulation` of ``model`` and ``protocol``,
+        loading the compiled model from the cache if available and storing
+        it otherwise.
+        """
+        path = os.path.join(self.directory, self.key(model) + '.zip')
+        if os.path.isfile(path):
+            try:
+                sim = myokit.Simulation.from_path(path)
+            except Exception:
+                # Incomplete or incompatible build: compile again below
+                sim = None
+            if sim is not None:
+                self.hits += 1
+                sim.set_protocol(protocol)
+                return sim
+
+        # Compile to a temporary file first, so that other processes never
+        # see a partly written build
+        self.misses += 1
+        fd, temp_path = tempfile.mkstemp(
+            suffix='.zip', dir=self.directory)
+        os.close(fd)
+        try:
+            sim = myokit.Simulation(model, protocol, path=temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+        return sim
+
+    def prepare(self, *models):
+        """
+        Compiles the given models (or ``.mmt`` filenames) into the cache if
+        they are not in it yet, e.g. before starting worker processes.
+        """
+        for model in models:
+            if isinstance(model, str):
+                model = self.load(model)
+            path = os.path.join(self.directory, self.key(model) + '.zip')
+            if not os.path.isfile(path):
+                self.simulation(model)
@@ -1,8 +1,26 @@
+import myokit
 import numpy as np
+import pints
 
 import modelling
 
 
+def _peak(drug_conc, comparison, BKmodel, steady_state_pulse, continuation):
+    # Returns the peak IKr at a single concentration, for the evaluators
+    return comparison.peak_currents(BKmodel, [drug_conc], steady_state_pulse,
+                                    continuation=continuation)[0]
+
+
+def _APD90(task, comparison, AP_model, Hill_curve_coefs, settings):
+    # Returns the APD90 of a (model, drug_conc) task, or None if the
+    # simulation fails, for the evaluators
+    try:
+        return comparison._APD90(AP_model, Hill_curve_coefs, *task,
+                                 **settings)
+    except myokit.SimulationError:
+        return None
+
+
 class ModelComparison(object):
     """
     To create a class to run the model comparison.
@@ -22,23 +40,60 @@ class ModelComparison(object):
         self.Hill_model = modelling.HillsModel()
         self.optimiser = modelling.HillsModelOpt(self.Hill_model)
 
+        # States before and after pre-pacing at each concentration of the
+        # last sweeps run with continuation
+        self.start_states = {}
+        self.steady_states = {}
+
     def compute_Hill(self, BKmodel, drug_conc=None, steady_state_pulse=1000,
                      Hill_upper_thres=0.9, Hill_lower_thres=0.05,
-                     norm_constant=1, parallel=True):
+                     norm_constant=1, parallel=True, continuation=False,
+                     Hill_method='cmaes', refinement='sequential',
+                     n_candidates=4):
+        """
+        Simulates the peak IKr of the drug at each concentration and fits a
+        Hill curve to it, after extending the concentrations until at least
+        3 normalised peaks lie above ``Hill_upper_thres`` and 3 below
+        ``Hill_lower_thres``.
+
+        With ``refinement='sequential'`` the concentrations are extended one
+        simulation at a time. With ``refinement='adaptive'`` up to
+        ``n_candidates`` head and tail concentrations are simulated together
+        in each round (on a process pool if ``parallel``), keeping only
+        those that the sequential extension would have added.
+        """
+        if refinement not in ['sequential', 'adaptive']:
+            raise ValueError(
+                "Refinement must be either 'sequential' or 'adaptive'")
 
         if drug_conc is None:
             drug_conc = list(np.append(0, 10**np.linspace(-1, 1, 5)))
 
         drug_conc = [i / norm_constant for i in drug_conc]
-
-        peaks = []
-        for i in range(len(drug_conc)):
-            log = BKmodel.custom_simulation(
-                self.drug_param_values, drug_conc[i], steady_state_pulse,
-                log_var=['engine.time', 'ikr.IKr'],
-                abs_tol=1e-7, rel_tol=1e-8)
-            peak, _ = BKmodel.extract_peak(log, 'ikr.IKr')
-            peaks.append(peak[-1])
+        if continuation:
+            drug_conc = sorted(drug_conc)
+            self._new_sweep('Hill')
+
+        peaks = self.peak_currents(BKmodel, drug_conc, steady_state_pulse,
+                                   continuation=continuation)
+
+        if refinement == 'adaptive':
+            simulated = {}
+            while True:
+                drug_conc_ext, peaks_ext, formed, candidates = \
+                    self._extend_concentrations(
+                        drug_conc, peaks, simulated, Hill_upper_thres,
+                        Hill_lower_thres, n_candidates)
+                if not candidates:
+                    break
+                simulated.update(zip(candidates, self._evaluate_peaks(
+                    BKmodel, candidates, steady_state_pulse, continuation,
+                    parallel)))
+            # The sequential extension below has nothing left to add
+            drug_conc, peaks = drug_conc_ext, peaks_ext
+            if not formed:
+                peaks_norm = (peaks - min(peaks)) / (max(peaks) - min(peaks))
+                return 'Hill curve did not form.', drug_conc, peaks_norm
 
         peaks_norm = (peaks - min(peaks)) / (max(peaks) - min(peaks))
 
@@ -48,12 +103,10 @@ class ModelComparison(object):
         counter = 0
         while sum(data_pt_checker) < 3 and counter < 20:
             drug_conc.insert(1, drug_conc[1] / np.sqrt(10))
-            log = BKmodel.custom_simulation(
-                self.drug_param_values, drug_conc[1], steady_state_pulse,
-                log_var=['engine.time', 'ikr.IKr'],
-                abs_tol=1e-7, rel_tol=1e-8)
-            peak, _ = BKmodel.extract_peak(log, 'ikr.IKr')
-            peaks.insert(1, peak[-1])
+            peak = self.peak_currents(BKmodel, [drug_conc[1]],
+                                      steady_state_pulse,
+                                      continuation=continuation)
+            peaks.insert(1, peak[0])
             peaks_norm = (peaks - min(peaks)) / (max(peaks) - min(peaks))
             data_pt_checker = [True if i > Hill_upper_thres else False
                                for i in peaks_norm]
@@ -68,12 +121,10 @@ class ModelComparison(object):
         counter = 0
         while sum(data_pt_checker) < 3 and counter < 20:
             drug_conc = drug_conc + [max(drug_conc) * np.sqrt(10)]
-            log = BKmodel.custom_simulation(
-                self.drug_param_values, drug_conc[-1], steady_state_pulse,
-                log_var=['engine.time', 'ikr.IKr'],
-                abs_tol=1e-7, rel_tol=1e-8)
-            peak, _ = BKmodel.extract_peak(log, 'ikr.IKr')
-            peaks.append(peak[-1])
+            peak = self.peak_currents(BKmodel, [drug_conc[-1]],
+                                      steady_state_pulse,
+                                      continuation=continuation)
+            peaks.append(peak[0])
             peaks_norm = (peaks - min(peaks)) / (max(peaks) - min(peaks))
             data_pt_checker = [True if i < Hill_lower_thres else False
                                for i in peaks_norm]
@@ -85,53 +136,226 @@ class ModelComparison(object):
         # return 0, drug_conc, peaks_norm
         # Fit Hill curve
         Hill_curve, _ = self.optimiser.optimise(drug_conc, peaks_norm,
-                                                parallel=parallel)
+                                                parallel=parallel,
+                                                method=Hill_method)
 
         return Hill_curve[:2], drug_conc, peaks_norm
 
+    def _extend_concentrations(self, drug_conc, peaks, simulated,
+                               Hill_upper_thres, Hill_lower_thres,
+                               n_candidates):
+        """
+        Extends the concentrations as the sequential refinement of
+        :meth:`compute_Hill` does, using the peaks already ``simulated``
+        (a dictionary from concentration to peak).
+
+        Returns the extended concentrations and peaks, whether the Hill
+        curve formed, and the candidate concentrations to simulate next: the
+        next ``n_candidates`` head concentrations once one is missing, and
+        the next tail concentrations if the tail is short of data points
+        too. The list of candidates is empty once the extension is done.
+        """
+        drug_conc, peaks = list(drug_conc), list(peaks)
+
+        def coverage(peaks):
+            peaks_norm = (np.array(peaks) - min(peaks)) / \
+                (max(peaks) - min(peaks))
+            return (sum(peaks_norm > Hill_upper_thres),
+                    sum(peaks_norm < Hill_lower_thres))
+
+        def tail_candidates(counter):
+            candidates = [max(drug_conc) * np.sqrt(10)]
+            while len(candidates) < min(n_candidates, 20 - counter):
+                candidates.append(candidates[-1] * np.sqrt(10))
+            return [c for c in candidates if c not in simulated]
+
+        # Head of the Hill curve
+        counter = 0
+        while coverage(peaks)[0] < 3 and counter < 20:
+            conc = drug_conc[1] / np.sqrt(10)
+            if conc not in simulated:
+                candidates = [conc]
+                while len(candidates) < min(n_candidates, 20 - counter):
+                    candidates.append(candidates[-1] / np.sqrt(10))
+                # Speculate on the tail while the head is simulated
+                if coverage(peaks)[1] < 3:
+                    candidates += tail_candidates(0)
+                return drug_conc, peaks, False, candidates
+            drug_conc.insert(1, conc)
+            peaks.insert(1, simulated[conc])
+            counter += 1
+        if counter == 20:
+            return drug_conc, peaks, False, []
+
+        # Tail of the Hill curve
+        counter = 0
+        while coverage(peaks)[1] < 3 and counter < 20:
+            conc = max(drug_conc) * np.sqrt(10)
+            if conc not in simulated:
+                return drug_conc, peaks, False, tail_candidates(counter)
+            drug_conc.append(conc)
+            peaks.append(simulated[conc])
+            counter += 1
+        if counter == 20:
+            return drug_conc, peaks, False, []
+
+        return drug_conc, peaks, True, []
+
+    def _evaluate_peaks(self, BKmodel, drug_conc, steady_state_pulse,
+                        continuation, parallel):
+        """
+        Returns the peak IKr at each of the given concentrations, simulating
+        the concentrations on a process pool if ``parallel`` (the 'expm'
+        engine simulates them in a single batch instead).
+        """
+        if BKmodel.engine == 'expm' or len(drug_conc) == 1:
+            return self.peak_currents(BKmodel, drug_conc, steady_state_pulse,
+                                      continuation=continuation)
+
+        args = [self, BKmodel, steady_state_pulse, continuation]
+        if parallel:
+            n_workers = min(len(drug_conc),
+                            pints.ParallelEvaluator.cpu_count())
+            evaluator = pints.ParallelEvaluator(_peak, n_workers=n_workers,
+                                                args=args)
+        else:
+            evaluator = pints.SequentialEvaluator(_peak, args=args)
+
+        return evaluator.evaluate(drug_conc)
+
+    def _new_sweep(self, sweep):
+        self.start_states[sweep] = {}
+        self.steady_states[sweep] = {}
+
+    def _warm_start(self, sweep, drug_conc):
+        """
+        Returns the steady state reached in the sweep at the highest
+        concentration not above ``drug_conc``, or ``None``.
+        """
+        lower = [c for c in self.steady_states[sweep] if c <= drug_conc]
+        if not lower:
+            return None
+
+        return self.steady_states[sweep][max(lower)]
+
+    def _record(self, sweep, drug_conc, model):
+        self.start_states[sweep][drug_conc] = model.start_state
+        self.steady_states[sweep][drug_conc] = model.prepace_state
+
+    def peak_currents(self, BKmodel, drug_conc, steady_state_pulse,
+                      continuation=False):
+        """
+        Returns the peak IKr of the drug at each of the given concentrations.
+        With the 'expm' engine, all concentrations are simulated in a single
+        batch. With ``continuation``, each concentration starts from the
+        steady state of the closest lower concentration of the sweep.
+
+        Like the rest of the class, this simulates a single drug (the first
+        row of ``drug_param_values``), so the batch only spans the
+        concentrations. To simulate many virtual drugs in one batch, call
+        :meth:`modelling.BindingKinetics.custom_peaks` with all of them.
+        """
+        if BKmodel.engine == 'expm':
+            peaks = BKmodel.custom_peaks(self.drug_param_values.iloc[[0]],
+                                         drug_conc, steady_state_pulse)
+            return list(peaks[0])
+
+        peaks = []
+        for i in range(len(drug_conc)):
+            set_state = None
+            if continuation:
+                set_state = self._warm_start('Hill', drug_conc[i])
+            log = BKmodel.custom_simulation(
+                self.drug_param_values, drug_conc[i], steady_state_pulse,
+                log_var=['engine.time', 'ikr.IKr'],
+                abs_tol=1e-7, rel_tol=1e-8, set_state=set_state)
+            if continuation:
+                self._record('Hill', drug_conc[i], BKmodel)
+            peak, _ = BKmodel.extract_peak(log, 'ikr.IKr')
+            peaks.append(peak[-1])
+
+        return peaks
+
     def APD_sim(self, AP_model, Hill_curve_coefs, drug_conc=None,
-                steady_state_pulse=1000, save_signal=2, offset=50,
+                steady_state_pulse=1000, save_signal=2,
                 data_points=20, EAD=False, norm_constant=1,
-                abs_tol=1e-7, rel_tol=1e-8):
+                abs_tol=1e-7, rel_tol=1e-8, continuation=False,
+                parallel=False, n_candidates=4, APD_table=None):
+        """
+        Returns the APD90s of the AP-SD model and the AP-CS model at each
+        drug concentration, and the concentrations. With ``EAD``, higher
+        concentrations are added until both models show EADs (APD90 of at
+        least 1000 ms) at 2 concentrations or more.
+
+        With ``parallel``, the simulations of both models at all
+        concentrations are run together on a process pool, and the EAD
+        extension simulates ``n_candidates`` concentrations per round,
+        keeping those that the sequential extension would have added.
+        ``parallel`` cannot be combined with ``continuation``.
+
+        If a :class:`modelling.APDTable` of ``AP_model`` with the same
+        settings is given as ``APD_table``, the APD90s of the AP-CS model are
+        interpolated from it instead of simulated.
+        """
+        if parallel and continuation:
+            raise ValueError(
+                'Continuation requires the concentrations to be simulated in '
+                'sequence')
+
+        settings = dict(
+            steady_state_pulse=steady_state_pulse, save_signal=save_signal,
+            abs_tol=abs_tol, rel_tol=rel_tol)
+        if APD_table is not None:
+            if APD_table.settings != settings:
+                raise ValueError(
+                    'The APD table was computed with different settings')
+            if APD_table.scales is None:
+                APD_table.build()
+        settings['APD_table'] = APD_table
 
-        base_conductance = AP_model.original_constants['gKr']
-        APD_trapping = []
-        APD_conductance = []
         if drug_conc is None:
             drug_conc = 10**np.linspace(-1, 5, data_points)
         drug_conc = list(drug_conc)
+        if continuation:
+            # Ascending sweep, each concentration starting from the steady
+            # state of the previous one
+            drug_conc = sorted(drug_conc)
+            self._new_sweep('AP-SD')
+            self._new_sweep('AP-CS')
+        set_state_SD = set_state_CS = None
+
+        if parallel:
+            APD90s = self._APD90_batch(
+                AP_model, Hill_curve_coefs,
+                [('SD', c) for c in drug_conc] +
+                [('CS', c * norm_constant) for c in drug_conc], settings)
+            if None in APD90s:
+                raise myokit.SimulationError(
+                    'Simulation failed at drug concentration ' +
+                    str(drug_conc[APD90s.index(None) % len(drug_conc)]))
+            APD_trapping = APD90s[:len(drug_conc)]
+            APD_conductance = APD90s[len(drug_conc):]
+        else:
+            APD_trapping = []
+            APD_conductance = []
+            for i in range(len(drug_conc)):
+                # Run simulation for trapping model
+                APD_trapping.append(self._APD90(
+                    AP_model, Hill_curve_coefs, 'SD', drug_conc[i],
+                    set_state=set_state_SD, **settings))
+                if continuation:
+                    self._record('AP-SD', drug_conc[i], AP_model)
+                    set_state_SD = AP_model.prepace_state
 
-        for i in range(len(drug_conc)):
-            # Run simulation for trapping model
-            log = AP_model.custom_simulation(
-                self.drug_param_values, drug_conc[i], steady_state_pulse,
-                timestep=0.1, save_signal=save_signal, abs_tol=abs_tol,
-                rel_tol=rel_tol, log_var=['engine.time', 'membrane.V'])
-
-            # Compute APD90
-            APD_trapping_pulse = []
-            for pulse in range(save_signal):
-                apd90 = AP_model.APD90(log['membrane.V', pulse], offset, 0.1)
-                APD_trapping_pulse.append(apd90)
-            APD_trapping.append(APD_trapping_pulse)
+                # Run simulation for conductance model
+                APD_conductance.append(self._APD90(
+                    AP_model, Hill_curve_coefs, 'CS',
+                    drug_conc[i] * norm_constant,
+                    set_state=set_state_CS, **settings))
+                if continuation:
+                    self._record('AP-CS', drug_conc[i], AP_model)
+                    set_state_CS = AP_model.prepace_state
 
-            # Run simulation for conductance model
-            reduction_scale = self.Hill_model.simulate(
-                Hill_curve_coefs, drug_conc[i] * norm_constant)
-            d2 = AP_model.conductance_simulation(
-                base_conductance * reduction_scale, steady_state_pulse,
-                timestep=0.1, save_signal=save_signal, abs_tol=abs_tol,
-                rel_tol=rel_tol, log_var=['engine.time', 'membrane.V'])
-
-            # Compute APD90
-            APD_conductance_pulse = []
-            for pulse in range(save_signal):
-                apd90 = AP_model.APD90(d2['membrane.V', pulse], offset, 0.1)
-                APD_conductance_pulse.append(apd90)
-            APD_conductance.append(APD_conductance_pulse)
-
-        APD_trapping = [max(i) for i in APD_trapping]
-        APD_conductance = [max(i) for i in APD_conductance]
         if EAD:
             checker_trapping = [True if i >= 1000 else False
                                 for i in APD_trapping]
@@ -140,36 +364,42 @@ class ModelComparison(object):
             checker_count = min(sum(checker_trapping),
                                 sum(checker_conductance))
             counter = 0
+            candidates = []
             while checker_count < 2 and counter < 10:
                 drug_conc = drug_conc + [max(drug_conc) * np.sqrt(10)]
-                log = AP_model.custom_simulation(
-                    self.drug_param_values, drug_conc[-1], steady_state_pulse,
-                    timestep=0.1, save_signal=save_signal, abs_tol=abs_tol,
-                    rel_tol=rel_tol, log_var=['engine.time', 'membrane.V'])
-
-                # Compute APD90
-                APD_trapping_pulse = []
-                for pulse in range(save_signal):
-                    apd90 = AP_model.APD90(log['membrane.V', pulse],
-                                           offset, 0.1)
-                    APD_trapping_pulse.append(apd90)
-                APD_trapping.append(max(APD_trapping_pulse))
-
-                # Run simulation for conductance model
-                reduction_scale = self.Hill_model.simulate(
-                    Hill_curve_coefs, drug_conc[-1])
-                d2 = AP_model.conductance_simulation(
-                    base_conductance * reduction_scale, steady_state_pulse,
-                    timestep=0.1, save_signal=save_signal, abs_tol=abs_tol,
-                    rel_tol=rel_tol, log_var=['engine.time', 'membrane.V'])
-
-                # Compute APD90
-                APD_conductance_pulse = []
-                for pulse in range(save_signal):
-                    apd90 = AP_model.APD90(d2['membrane.V', pulse],
-                                           offset, 0.1)
-                    APD_conductance_pulse.append(apd90)
-                APD_conductance.append(max(APD_conductance_pulse))
+                if parallel:
+                    # Simulate the next concentrations speculatively
+                    if not candidates:
+                        conc = [drug_conc[-1]]
+                        while len(conc) < min(n_candidates, 10 - counter):
+                            conc.append(conc[-1] * np.sqrt(10))
+                        APD90s = self._APD90_batch(
+                            AP_model, Hill_curve_coefs,
+                            [('SD', c) for c in conc] +
+                            [('CS', c) for c in conc], settings)
+                        candidates = list(zip(APD90s[:len(conc)],
+                                              APD90s[len(conc):]))
+                    APD90_SD, APD90_CS = candidates.pop(0)
+                    if APD90_SD is None or APD90_CS is None:
+                        raise myokit.SimulationError(
+                            'Simulation failed at drug concentration ' +
+                            str(drug_conc[-1]))
+                else:
+                    APD90_SD = self._APD90(
+                        AP_model, Hill_curve_coefs, 'SD', drug_conc[-1],
+                        set_state=set_state_SD, **settings)
+                    if continuation:
+                        self._record('AP-SD', drug_conc[-1], AP_model)
+                        set_state_SD = AP_model.prepace_state
+
+                    APD90_CS = self._APD90(
+                        AP_model, Hill_curve_coefs, 'CS', drug_conc[-1],
+                        set_state=set_state_CS, **settings)
+                    if continuation:
+                        self._record('AP-CS', drug_conc[-1], AP_model)
+                        set_state_CS = AP_model.prepace_state
+                APD_trapping.append(APD90_SD)
+                APD_conductance.append(APD90_CS)
 
                 checker_trapping = [True if i >= 1000 else False
                                     for i in APD_trapping]
@@ -182,6 +412,62 @@ class ModelComparison(object):
 
         return APD_trapping, APD_conductance, drug_conc
 
+    def _APD90(self, AP_model, Hill_curve_coefs, model, drug_conc,
+               steady_state_pulse, save_signal, abs_tol, rel_tol,
+               set_state=None, APD_table=None):
+        """
+        Returns the largest APD90 over the saved pulses of the AP-SD model
+        (``model='SD'``) or the AP-CS model (``model='CS'``) at the drug
+        concentration. The conductance of the AP-CS model is reduced by the
+        Hill curve at ``drug_conc``, and its APD90 read from ``APD_table``
+        if given. APD90s are tracked during the simulation, from the
+        stimulus of the protocol (see :class:`modelling.BiomarkerTracker`).
+        """
+        if model == 'SD':
+            biomarkers = AP_model.custom_simulation(
+                self.drug_param_values, drug_conc, steady_state_pulse,
+                save_signal=save_signal, abs_tol=abs_tol, rel_tol=rel_tol,
+                set_state=set_state, biomarkers=True)
+        else:
+            base_conductance = AP_model.original_constants['gKr']
+            reduction_scale = self.Hill_model.simulate(
+                Hill_curve_coefs, drug_conc)
+            if APD_table is not None:
+                return float(APD_table.APD90(reduction_scale))
+            biomarkers = AP_model.conductance_simulation(
+                base_conductance * reduction_scale, steady_state_pulse,
+                save_signal=save_signal, abs_tol=abs_tol, rel_tol=rel_tol,
+                set_state=set_state, biomarkers=True)
+
+        return float(max(biomarkers['APD90']))
+
+    def _APD90_batch(self, AP_model, Hill_curve_coefs, tasks, settings):
+        """
+        Returns the APD90 of each ``(model, drug_conc)`` task (see
+        :meth:`_APD90`), running the tasks on a process pool. Tasks that
+        fail with a simulation error return ``None``. AP-CS tasks read from
+        an APD table are evaluated directly.
+        """
+        args = [self, AP_model, Hill_curve_coefs, settings]
+        APD90s = [None] * len(tasks)
+        simulated = []
+        for i, task in enumerate(tasks):
+            if task[0] == 'CS' and settings['APD_table'] is not None:
+                APD90s[i] = _APD90(task, *args)
+            else:
+                simulated.append(i)
+
+        if simulated:
+            n_workers = min(len(simulated),
+                            pints.ParallelEvaluator.cpu_count())
+            evaluator = pints.ParallelEvaluator(_APD90, n_workers=n_workers,
+                                                args=args)
+            results = evaluator.evaluate([tasks[i] for i in simulated])
+            for i, value in zip(simulated, results):
+                APD90s[i] = value
+
+        return APD90s
+
     def compute_RMSE(self, APD_trapping, APD_conductance):
 
         square_sum = 0
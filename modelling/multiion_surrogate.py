@@ -0,0 +1,439 @@
+#
+# Sparse-grid surrogate of the AP-CS model with several ion channels scaled.
+#
+import hashlib
+import json
+import os
+import tempfile
+
+import myokit
+import numpy as np
+import pints
+
+import modelling
+
+
+def _simulate(scales, surrogate):
+    # Simulates the scales with the surrogate's AP model, returning NaN for
+    # failed simulations, for the evaluators
+    try:
+        return surrogate.simulate(scales)
+    except myokit.SimulationError:
+        return [float('nan')] * len(surrogate.outputs)
+
+
+class MultiIonSurrogate(object):
+    """
+    An adaptive sparse-grid surrogate of the steady-state APD90 and qNet of
+    the AP model of ``AP_model`` (a :class:`modelling.BindingKinetics`), as
+    a function of the conductance scales of IKr, INaL, ICaL, INa, Ito, IK1
+    and IKs (see :meth:`BindingKinetics.drug_multiion_CS_sim`).
+
+    The surrogate interpolates in a hierarchical basis of piecewise linear
+    functions on a sparse grid over ``bounds``, extrapolating linearly
+    towards the boundaries so that no simulations are placed on them.
+    Starting from the grid of level 2, points whose hierarchical surplus
+    exceeds ``APD_tol`` (ms) or ``qNet_tol`` (C/F) are refined, up to level
+    ``max_level`` in each dimension and ``max_points`` points in total. The
+    simulations of each refinement round are run on a process pool if
+    ``parallel``.
+
+    Once no point needs refining, the surrogate is compared with
+    ``n_validation`` simulations at random points of its resolved region.
+    Features the surpluses missed, such as the onset of EADs between grid
+    points, show up as validation points off by more than the tolerance;
+    the finest unrefined points whose basis functions cover them are then
+    flagged for refinement, for up to ``validation_rounds`` rounds of
+    refinement and validation.
+
+    Points whose surplus exceeds the tolerance (or that were flagged) but
+    could not be refined, or whose simulation failed, mark the region where
+    the surrogate is not resolved. Queries there or outside ``bounds`` are
+    simulated instead (see :meth:`__call__`).
+
+    If a ``directory`` is given, surrogates are stored there under a hash of
+    the model, the protocol and the settings, and loaded instead of being
+    built again.
+    """
+
+    currents = ['IKr', 'INaL', 'ICaL', 'INa', 'Ito', 'IK1', 'IKs']
+    outputs = ['APD90', 'qNet']
+    qNet_currents = ['inal.INaL', 'ical.ICaL', 'ikr.IKr', 'iks.IKs',
+                     'ik1.IK1', 'ito.Ito']
+
+    def __init__(self, AP_model, repeats=1000, save_signal=1, abs_tol=1e-7,
+                 rel_tol=1e-8, bounds=(0, 1), APD_tol=5, qNet_tol=0.005,
+                 max_level=5, max_points=2000, n_validation=50,
+                 validation_rounds=10, parallel=True, directory=None):
+        super(MultiIonSurrogate, self).__init__()
+
+        self.AP_model = AP_model
+        self.settings = dict(
+            repeats=repeats, save_signal=save_signal, abs_tol=abs_tol,
+            rel_tol=rel_tol,
+            bounds=list(bounds), APD_tol=APD_tol, qNet_tol=qNet_tol,
+            max_level=max_level, max_points=max_points,
+            n_validation=n_validation, validation_rounds=validation_rounds)
+        self.parallel = parallel
+        self.directory = directory
+
+        self.levels = None
+        self.indices = None
+        self.values = None
+        self.surpluses = None
+        self.refined = None
+        self.flagged = None
+        self.validation_points = None
+        self.validation_values = None
+
+    def key(self):
+        """
+        Returns the hash identifying the surrogate of the model, protocol and
+        settings.
+        """
+        h = hashlib.sha256()
+        h.update(self.AP_model.model.code().encode())
+        h.update(self.AP_model.protocol.code().encode())
+        settings = dict(self.settings,
+                        method=self.AP_model.steady_state_method)
+        h.update(json.dumps(settings, sort_keys=True).encode())
+
+        return h.hexdigest()
+
+    def ion_scale(self, drug, drug_conc):
+        """
+        Returns the conductance scale of each ion channel at the drug
+        concentration(s), from the Hill curves of the drug in
+        :class:`modelling.BindingParameters`.
+        """
+        Hill_curve = modelling.BindingParameters().Hill_curve[drug]
+        drug_conc = np.asarray(drug_conc, dtype=float)
+
+        ion_scale = {}
+        for current in self.currents:
+            Hill_coef = Hill_curve[current]['Hill_coef']
+            IC50 = Hill_curve[current]['IC50']
+            if Hill_coef == 0:
+                # No block of the channel
+                ion_scale[current] = np.ones(drug_conc.shape)
+            else:
+                ion_scale[current] = 1 / (
+                    1 + np.power(drug_conc / IC50, Hill_coef))
+
+        return ion_scale
+
+    def simulate(self, scales):
+        """
+        Returns the APD90 (the longest over the saved pulses) and the qNet
+        (of the last saved pulse) of the AP model with the conductances
+        scaled by ``scales``, given in the order of :attr:`currents`. Both
+        are computed during the simulation, without logging any trace.
+        """
+        settings = self.settings
+        ion_scale = dict(zip(self.currents, scales))
+
+        accumulators = self.AP_model.accumulators
+        self.AP_model.accumulators = {
+            'qNet': ' + '.join(self.qNet_currents)}  # pA/pF*ms
+        try:
+            biomarkers = self.AP_model.drug_multiion_CS_sim(
+                ion_scale, settings['repeats'],
+                save_signal=settings['save_signal'],
+                abs_tol=settings['abs_tol'], rel_tol=settings['rel_tol'],
+                biomarkers=True)
+            qNet = self.AP_model.accumulated['qNet'][-1] * 1e-3
+        finally:
+            self.AP_model.accumulators = accumulators
+
+        return [float(np.max(biomarkers['APD90'])), float(qNet)]
+
+    def _simulate_batch(self, scales):
+        # Simulates the scales, returning NaN for failed simulations
+        if self.parallel and len(scales) > 1:
+            n_workers = min(len(scales), pints.ParallelEvaluator.cpu_count())
+            evaluator = pints.ParallelEvaluator(_simulate, n_workers=n_workers,
+                                                args=[self])
+        else:
+            evaluator = pints.SequentialEvaluator(_simulate, args=[self])
+
+        return np.array(evaluator.evaluate(list(scales)), dtype=float)
+
+    def _scales(self, ion_scale):
+        # Returns the queried scales as an array with one row per query
+        if isinstance(ion_scale, dict):
+            return np.stack(np.broadcast_arrays(
+                *[np.asarray(ion_scale[c], dtype=float).ravel()
+                  for c in self.currents]), axis=1)
+
+        return np.atleast_2d(np.asarray(ion_scale, dtype=float))
+
+    def _to_scales(self, x):
+        lower, upper = self.settings['bounds']
+        return lower + np.asarray(x) * (upper - lower)
+
+    def _from_scales(self, scales):
+        lower, upper = self.settings['bounds']
+        return (np.asarray(scales, dtype=float) - lower) / (upper - lower)
+
+    def _basis(self, x, levels, indices):
+        """
+        Returns the basis functions of the grid points with the given levels
+        and indices, evaluated at the points ``x`` in the unit hypercube.
+        """
+        x = x[:, None, :]
+        h = 2.0**levels[None]
+        i = indices[None]
+
+        phi = np.maximum(0, 1 - np.abs(h * x - i))
+        # Linear extrapolation towards the boundaries
+        inner = levels[None] > 1
+        phi = np.where(inner & (i == 1), np.maximum(0, 2 - h * x), phi)
+        phi = np.where(inner & (i == h - 1), np.maximum(0, h * x - i + 1),
+                       phi)
+        phi = np.where(levels[None] == 1, 1, phi)
+
+        return np.prod(phi, axis=2)
+
+    def _interpolate(self, x, chunk=256):
+        """
+        Returns the interpolated outputs at the points ``x`` in the unit
+        hypercube, and whether each point lies in the resolved region.
+        """
+        surpluses = np.nan_to_num(self.surpluses)
+        unresolved = self._unresolved()
+
+        values, resolved = [], []
+        for start in range(0, len(x), chunk):
+            phi = self._basis(x[start:start + chunk], self.levels,
+                              self.indices)
+            values.append(phi.dot(surpluses))
+            resolved.append(~np.any(phi[:, unresolved] > 0, axis=1))
+
+        return np.concatenate(values), np.concatenate(resolved)
+
+    def _criterion(self):
+        tol = np.array([self.settings['APD_tol'], self.settings['qNet_tol']])
+        criterion = np.max(np.abs(self.surpluses) / tol, axis=1)
+
+        return np.where(np.isnan(criterion) | self.flagged, np.inf, criterion)
+
+    def _unresolved(self):
+        return (self._criterion() > 1) & ~self.refined
+
+    def _children(self, point, k):
+        levels, indices = point
+        children = []
+        for i in [2 * indices[k] - 1, 2 * indices[k] + 1]:
+            children.append((
+                levels[:k] + (levels[k] + 1,) + levels[k + 1:],
+                indices[:k] + (i,) + indices[k + 1:]))
+
+        return children
+
+    def _parents(self, point):
+        levels, indices = point
+        parents = []
+        for k in range(len(levels)):
+            if levels[k] < 2:
+                continue
+            i = (indices[k] + 1) // 2
+            if i % 2 == 0:
+                i = (indices[k] - 1) // 2
+            parents.append((
+                levels[:k] + (levels[k] - 1,) + levels[k + 1:],
+                indices[:k] + (i,) + indices[k + 1:]))
+
+        return parents
+
+    def _add(self, point, grid, new):
+        # Adds a point to ``new`` after its hierarchical ancestors
+        if point in grid or point in new:
+            return
+        for parent in self._parents(point):
+            self._add(parent, grid, new)
+        new[point] = None
+
+    def _extend(self, new):
+        """
+        Simulates the new points and appends them to the grid with their
+        hierarchical surpluses.
+        """
+        points = sorted(new, key=lambda p: sum(p[0]))
+        levels = np.array([p[0] for p in points])
+        indices = np.array([p[1] for p in points])
+        values = self._simulate_batch(
+            self._to_scales(indices / 2.0**levels))
+
+        # Surpluses of coarser points first; basis functions of points with
+        # the same total level vanish on each other
+        level_sums = levels.sum(axis=1)
+        for level_sum in np.unique(level_sums):
+            group = level_sums == level_sum
+            surpluses = values[group]
+            if self.levels is not None:
+                x = indices[group] / 2.0**levels[group]
+                surpluses = surpluses - self._interpolate(x)[0]
+                self.levels = np.concatenate([self.levels, levels[group]])
+                self.indices = np.concatenate([self.indices,
+                                               indices[group]])
+                self.values = np.concatenate([self.values, values[group]])
+                self.surpluses = np.concatenate([self.surpluses, surpluses])
+                self.refined = np.concatenate([
+                    self.refined, np.zeros(np.sum(group), dtype=bool)])
+                self.flagged = np.concatenate([
+                    self.flagged, np.zeros(np.sum(group), dtype=bool)])
+            else:
+                self.levels, self.indices = levels[group], indices[group]
+                self.values, self.surpluses = values[group], surpluses
+                self.refined = np.zeros(np.sum(group), dtype=bool)
+                self.flagged = np.zeros(np.sum(group), dtype=bool)
+
+    def _refine(self, new):
+        """
+        Simulates the new points (if any) and refines the grid until no
+        point needs refining or ``max_points`` is reached.
+        """
+        n = len(self.currents)
+        while True:
+            if new:
+                self._extend(new)
+            grid = {(tuple(l), tuple(i)): j for j, (l, i) in
+                    enumerate(zip(self.levels, self.indices))}
+
+            # Refine the points with the largest surpluses first
+            new = {}
+            criterion = self._criterion()
+            for j in np.argsort(-criterion):
+                if criterion[j] <= 1 or \
+                        len(grid) + len(new) >= self.settings['max_points']:
+                    break
+                if self.refined[j] or np.isnan(self.surpluses[j]).any():
+                    continue
+                point = (tuple(self.levels[j]), tuple(self.indices[j]))
+                for k in range(n):
+                    if self.levels[j, k] < self.settings['max_level']:
+                        for child in self._children(point, k):
+                            self._add(child, grid, new)
+                self.refined[j] = np.all(
+                    self.levels[j] < self.settings['max_level'])
+            if not new:
+                return
+
+    def _flag(self, x):
+        """
+        Flags the finest unrefined points whose basis functions cover the
+        points ``x``, returning the number of points newly flagged.
+        """
+        flagged = self.flagged.copy()
+        level_sums = self.levels.sum(axis=1)
+        phi = self._basis(x, self.levels, self.indices)
+        for covering in (phi > 0) & ~self.refined:
+            if np.any(covering):
+                finest = np.max(level_sums[covering])
+                flagged |= covering & (level_sums == finest)
+        n_flagged = np.sum(flagged & ~self.flagged)
+        self.flagged = flagged
+
+        return n_flagged
+
+    def build(self):
+        """
+        Loads the surrogate from ``directory`` or builds and validates it.
+        """
+        path = None
+        if self.directory is not None:
+            path = os.path.join(self.directory, self.key() + '.npz')
+            if os.path.isfile(path):
+                with np.load(path) as data:
+                    for name in ['levels', 'indices', 'values', 'surpluses',
+                                 'refined', 'flagged', 'validation_points',
+                                 'validation_values']:
+                        setattr(self, name, data[name])
+                return
+
+        n = len(self.currents)
+        root = ((1,) * n, (1,) * n)
+        new = {}
+        self._add(root, {}, new)
+        for k in range(n):
+            for child in self._children(root, k):
+                self._add(child, {}, new)
+
+        self._refine(new)
+
+        # Compare with simulations at random points of the resolved region,
+        # refining around those that miss the tolerance
+        tol = np.array([self.settings['APD_tol'], self.settings['qNet_tol']])
+        rng = np.random.default_rng(0)
+        points, values = [], []
+        for _ in range(self.settings['validation_rounds']):
+            x = rng.uniform(size=(self.settings['n_validation'], n))
+            predicted, resolved = self._interpolate(x)
+            x, predicted = x[resolved], predicted[resolved]
+            simulated = self._simulate_batch(self._to_scales(x))
+            points.append(x)
+            values.append(simulated)
+
+            failed = np.any(~(np.abs(predicted - simulated) <= tol), axis=1)
+            if not np.any(failed) or self._flag(x[failed]) == 0:
+                break
+            self._refine({})
+        self.validation_points = self._to_scales(np.concatenate(points))
+        self.validation_values = np.concatenate(values)
+
+        if path is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first, so that other processes never
+            # read a partly written surrogate
+            fd, temp_path = tempfile.mkstemp(suffix='.npz',
+                                             dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, levels=self.levels, indices=self.indices,
+                         values=self.values, surpluses=self.surpluses,
+                         refined=self.refined, flagged=self.flagged,
+                         validation_points=self.validation_points,
+                         validation_values=self.validation_values)
+            os.replace(temp_path, path)
+
+    def validation_error(self):
+        """
+        Returns the largest absolute error of each output at the validation
+        points.
+        """
+        if self.levels is None:
+            self.build()
+        predicted, _ = self.predict(self.validation_points)
+
+        return dict(zip(self.outputs, np.nanmax(
+            np.abs(predicted - self.validation_values), axis=0)))
+
+    def predict(self, ion_scale):
+        """
+        Returns the interpolated APD90 and qNet (one row per query) and
+        whether each query lies in the resolved region of the surrogate.
+
+        ``ion_scale`` is either a dictionary of conductance scales (scalars
+        or arrays) for each of :attr:`currents`, or an array with one row of
+        scales per query.
+        """
+        if self.levels is None:
+            self.build()
+
+        x = self._from_scales(self._scales(ion_scale))
+        values, resolved = self._interpolate(x)
+        resolved &= np.all((x >= 0) & (x <= 1), axis=1)
+
+        return values, resolved
+
+    def __call__(self, ion_scale):
+        """
+        Returns a dictionary with the APD90s and qNets at the queries (see
+        :meth:`predict`), simulating the queries outside the resolved region
+        of the surrogate.
+        """
+        values, resolved = self.predict(ion_scale)
+        if not np.all(resolved):
+            scales = self._scales(ion_scale)
+            values[~resolved] = self._simulate_batch(scales[~resolved])
+
+        return dict(zip(self.outputs, values.T))
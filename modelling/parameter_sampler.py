@@ -0,0 +1,238 @@
+#
+# Designs of virtual drugs for parameter space explorations.
+#
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+import modelling
+
+
+class ParameterSampler(object):
+    """
+    Generates designs of virtual drugs as structured arrays, with an integer
+    ``'param_id'`` field and a float field for each parameter in
+    ``param_names`` (Vhalf, Kmax, Ku, N and EC50 by default), one element per
+    virtual drug.
+
+    Only the parameters given to each design are sampled; the others take
+    their value in ``fixed``, or NaN. Kmax, Ku and EC50 are sampled on a
+    log10 scale. The ``param_id`` of the samples count up from ``start_id``
+    in the order the samples are generated, and designs are generated the
+    same way every time for the same arguments and ``seed``, so that the
+    ``param_id`` identify the samples across runs, e.g. to skip completed
+    samples when resuming.
+
+    Designs are built with array operations only, without a dataframe per
+    sample. :meth:`chunks` splits a design into slices for the workers of a
+    :class:`modelling.SweepExecutor`, and :meth:`frame` converts samples to
+    a dataframe where needed.
+    """
+
+    def __init__(self, param_names=None, fixed=None, start_id=0):
+        super(ParameterSampler, self).__init__()
+
+        if param_names is None:
+            param_names = ['Vhalf', 'Kmax', 'Ku', 'N', 'EC50']
+        self.param_names = list(param_names)
+        self.fixed = {} if fixed is None else dict(fixed)
+        self.start_id = start_id
+        self.log_params = ['Kmax', 'Ku', 'EC50']
+
+        self.dtype = np.dtype([('param_id', np.int64)] +
+                              [(p, np.float64) for p in self.param_names])
+
+    def design(self, values, params, start_id=None):
+        """
+        Returns the design of the samples with the given ``values``, an
+        array with one row per sample and one column for each parameter in
+        ``params``.
+        """
+        values = np.asarray(values, dtype=float).reshape(-1, len(params))
+        if start_id is None:
+            start_id = self.start_id
+
+        design = np.empty(len(values), dtype=self.dtype)
+        design['param_id'] = np.arange(start_id, start_id + len(values))
+        for param in self.param_names:
+            design[param] = self.fixed.get(param, np.nan)
+        for i, param in enumerate(params):
+            if param not in self.param_names:
+                raise ValueError('Unknown parameter: ' + str(param))
+            design[param] = values[:, i]
+
+        return design
+
+    def bounds(self, params, bounds=None):
+        """
+        Returns the bounds of each parameter in ``params``, i.e. the range of
+        its values for the synthetic drugs, or the bounds given in the
+        dictionary ``bounds`` instead.
+        """
+        bounds = {} if bounds is None else bounds
+        param_lib = modelling.BindingParameters()
+
+        param_bounds = {}
+        for param in params:
+            if param in bounds:
+                param_bounds[param] = tuple(bounds[param])
+            else:
+                values = [param_lib.binding_parameters[drug][param]
+                          for drug in param_lib.drug_compounds]
+                param_bounds[param] = (min(values), max(values))
+
+        return param_bounds
+
+    def _scale(self, unit, params, bounds):
+        """
+        Returns the points ``unit`` of the unit hypercube mapped to the
+        ``bounds`` of the parameters, on a log10 scale for Kmax, Ku and EC50.
+        """
+        values = np.empty(unit.shape)
+        for i, param in enumerate(params):
+            low, high = bounds[param]
+            if param in self.log_params:
+                low, high = np.log10(low), np.log10(high)
+            values[:, i] = low + unit[:, i] * (high - low)
+            if param in self.log_params:
+                values[:, i] = 10**values[:, i]
+
+        return values
+
+    def factorial(self, ranges, start_id=None):
+        """
+        Returns the full factorial design of the values of each parameter in
+        the dictionary ``ranges``, e.g. ``{'Vhalf': Vhalf_range, 'Kmax':
+        Kmax_range}``, in the order of ``itertools.product`` over the values,
+        with the last parameter varying fastest.
+        """
+        params = list(ranges.keys())
+        grids = np.meshgrid(*[np.asarray(ranges[p], dtype=float)
+                              for p in params], indexing='ij')
+        values = np.stack([grid.ravel() for grid in grids], axis=1)
+
+        return self.design(values, params, start_id=start_id)
+
+    def latin_hypercube(self, n_samples, params, bounds=None, seed=None,
+                        start_id=None):
+        """
+        Returns a Latin hypercube design of ``n_samples`` samples of the
+        parameters ``params`` within their bounds (see :meth:`bounds`).
+        """
+        bounds = self.bounds(params, bounds)
+        unit = scipy.stats.qmc.LatinHypercube(
+            d=len(params), seed=seed).random(n_samples)
+
+        return self.design(self._scale(unit, params, bounds), params,
+                           start_id=start_id)
+
+    def sobol(self, n_samples, params, bounds=None, seed=None,
+              start_id=None):
+        """
+        Returns the first ``n_samples`` points of a scrambled Sobol sequence
+        over the parameters ``params`` within their bounds (see
+        :meth:`bounds`). The sequence is balanced if ``n_samples`` is a power
+        of two.
+        """
+        bounds = self.bounds(params, bounds)
+        m = int(np.ceil(np.log2(max(n_samples, 1))))
+        unit = scipy.stats.qmc.Sobol(
+            d=len(params), seed=seed).random_base2(m)[:n_samples]
+
+        return self.design(self._scale(unit, params, bounds), params,
+                           start_id=start_id)
+
+    def halton(self, n_samples, params, bounds=None, seed=None,
+               start_id=None):
+        """
+        Returns the first ``n_samples`` points of a scrambled Halton sequence
+        over the parameters ``params`` within their bounds (see
+        :meth:`bounds`).
+        """
+        bounds = self.bounds(params, bounds)
+        unit = scipy.stats.qmc.Halton(
+            d=len(params), seed=seed).random(n_samples)
+
+        return self.design(self._scale(unit, params, bounds), params,
+                           start_id=start_id)
+
+    def strata(self, param, bounds):
+        """
+        Returns the bounds of the low, mid and high ranges of ``param``, as
+        divided by :class:`modelling.ParameterCategory`, within ``bounds``.
+        Ranges outside ``bounds`` are left out.
+        """
+        low, high = bounds
+        low_group, high_group = \
+            modelling.ParameterCategory().param_ranges[param]
+        edges = [low] + [e for e in (low_group, high_group)
+                         if low < e < high] + [high]
+
+        return list(zip(edges[:-1], edges[1:]))
+
+    def stratified(self, n_samples, params, bounds=None, seed=None,
+                   start_id=None):
+        """
+        Returns a design with a Latin hypercube of ``n_samples`` samples in
+        each combination of the low, mid and high ranges of the parameters
+        ``params`` (see :meth:`strata`), within their bounds (see
+        :meth:`bounds`). The combinations are in the order of
+        ``itertools.product`` over the ranges of each parameter.
+        """
+        bounds = self.bounds(params, bounds)
+        strata = [self.strata(param, bounds[param]) for param in params]
+        shape = [len(s) for s in strata]
+        n_cells = int(np.prod(shape))
+
+        # One Latin hypercube in the unit cube of each combination, drawn
+        # with its own generator spawned from the seed, mapped to the bounds
+        # of its ranges
+        generators = np.random.SeedSequence(seed).spawn(n_cells)
+        unit = np.concatenate([scipy.stats.qmc.LatinHypercube(
+            d=len(params), seed=np.random.default_rng(g)).random(n_samples)
+            for g in generators]).reshape(-1, len(params))
+        cells = np.repeat(np.stack(np.unravel_index(
+            np.arange(n_cells), shape), axis=1), n_samples, axis=0)
+
+        values = np.empty(unit.shape)
+        for i, param in enumerate(params):
+            edges = np.array(strata[i], dtype=float)
+            if param in self.log_params:
+                edges = np.log10(edges)
+            low, high = edges[cells[:, i], 0], edges[cells[:, i], 1]
+            values[:, i] = low + unit[:, i] * (high - low)
+            if param in self.log_params:
+                values[:, i] = 10**values[:, i]
+
+        return self.design(values, params, start_id=start_id)
+
+    @staticmethod
+    def chunks(design, chunk_size):
+        """
+        Yields consecutive slices of ``design`` with ``chunk_size`` samples
+        each (fewer for the last one). Slices are views of the design.
+        """
+        for start in range(0, len(design), chunk_size):
+            yield design[start:start + chunk_size]
+
+    @staticmethod
+    def frame(samples):
+        """
+        Returns a sample or a design as a dataframe, with one row per sample
+        and a column for the ``param_id`` and for each parameter.
+        """
+        return pd.DataFrame(np.atleast_1d(np.asarray(samples)))
+
+    def from_frame(self, df):
+        """
+        Returns the samples of a dataframe (e.g. from :meth:`frame`) as a
+        design. Parameters missing from the dataframe take their value in
+        ``fixed``, or NaN, and samples are numbered from ``start_id`` if the
+        dataframe has no ``'param_id'``.
+        """
+        params = [p for p in self.param_names if p in df.columns]
+        design = self.design(df[params].values, params)
+        if 'param_id' in df.columns:
+            design['param_id'] = df['param_id'].values
+
+        return design
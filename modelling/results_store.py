@@ -0,0 +1,404 @@
+#
+# Append-only columnar storage of the results of parameter sweeps.
+#
+import json
+import operator
+import os
+import tempfile
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+class ResultsStore(object):
+    """
+    Stores the results of a parameter sweep, i.e. the dataframes returned
+    for each sample (virtual drug) by the evaluation functions of the
+    sensitivity analysis scripts, as columns in ``directory``.
+
+    The schema is fixed: scalar columns for the ``'param_id'`` (if
+    ``param_id``), the Hill curve, the parameter values (``param_names``),
+    the RMSE and the ME, and ragged array columns, one array of any length
+    per sample, for the drug concentrations, the normalised peak currents
+    and the APD90s of the two models.
+
+    Every call to :meth:`append` adds a partition ``name + '_' + number +
+    '.npz'``, which is written to a temporary file and then linked into
+    place, so that existing partitions are never rewritten and other
+    processes never see a partly written one. Partitions keep the minimum
+    and maximum of each scalar column, so that partitions without matching
+    samples are skipped when loading with ``filters``, and only the columns
+    requested are read. Results saved as CSV (``name + '.csv'`` or
+    ``name + '_' + number + '.csv'``) in ``directory`` are read as
+    partitions too, so that earlier results stay part of the sweep.
+
+    If a ``version`` is given, such as the version of the biomarker
+    definition (:attr:`modelling.BiomarkerTracker.version`), it is stored
+    with every partition, and :meth:`append`, :meth:`completed` and
+    :meth:`load` raise a ``ValueError`` if the store has partitions of
+    another version, so that a sweep is not resumed from results computed
+    differently. Partitions
+    saved as CSV or without a version are taken to be version 1.
+
+    Partitions merged by :meth:`compact` record the partitions they replace,
+    which are ignored once all merged partitions are written, so that
+    samples are neither lost nor counted twice if compacting is
+    interrupted.
+    """
+
+    # Comparisons that can be used in filters
+    _operators = {'<': operator.lt, '<=': operator.le, '>': operator.gt,
+                  '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+    def __init__(self, directory, name, param_names, param_id=True,
+                 version=None):
+        super(ResultsStore, self).__init__()
+
+        self.directory = directory
+        self.name = name
+        self.version = version
+
+        self.scalar_columns = \
+            ([('param_id', 'param_id')] if param_id else []) + \
+            [('Hill_curve', 'Hill_coef'), ('Hill_curve', 'IC50')] + \
+            [('param_values', p) for p in param_names] + \
+            [('RMSE', 'RMSE'), ('ME', 'ME')]
+        self.array_columns = ['drug_conc_Hill', 'peak_current',
+                              'drug_conc_AP', 'APD_trapping',
+                              'APD_conductance']
+        # Order of the column groups in the results of a sample
+        self.groups = (['param_id'] if param_id else []) + \
+            ['drug_conc_Hill', 'peak_current', 'Hill_curve', 'param_values',
+             'drug_conc_AP', 'APD_trapping', 'APD_conductance', 'RMSE', 'ME']
+
+    def _member(self, column):
+        if column not in self.scalar_columns:
+            raise ValueError('Unknown scalar column: ' + str(column))
+        return '.'.join(column)
+
+    def _files(self):
+        # Numbers and paths of the partition files, in the order they were
+        # written
+        if not os.path.isdir(self.directory):
+            return []
+
+        partitions = []
+        for f in os.listdir(self.directory):
+            base, ext = os.path.splitext(f)
+            if ext not in ('.npz', '.csv') or not base.startswith(self.name):
+                continue
+            number = base[len(self.name):]
+            if number == '':
+                partitions.append((-1, os.path.join(self.directory, f)))
+            elif number[0] == '_' and number[1:].isdigit():
+                partitions.append((int(number[1:]),
+                                   os.path.join(self.directory, f)))
+
+        return sorted(partitions)
+
+    def _partitions(self):
+        """
+        Returns the numbers and paths of the partitions, without those
+        replaced by a complete set of partitions merged by :meth:`compact`,
+        and without the partitions of an incomplete set.
+        """
+        files = self._files()
+        compactions = {}
+        for number, path in files:
+            if not path.endswith('.npz'):
+                continue
+            with np.load(path) as data:
+                compaction = json.loads(str(data['metadata'])).get(
+                    'compaction')
+            if compaction is not None:
+                numbers, _ = compactions.get(compaction['id'], ([], None))
+                compactions[compaction['id']] = (numbers + [number],
+                                                 compaction)
+
+        ignored = set()
+        for numbers, compaction in compactions.values():
+            if len(numbers) == compaction['parts']:
+                ignored.update(compaction['replaces'])
+            else:
+                ignored.update(numbers)
+
+        return [(number, path) for number, path in files
+                if number not in ignored or not path.endswith('.npz')]
+
+    def partitions(self):
+        """
+        Returns the paths of the partitions of the store, in the order they
+        were written.
+        """
+        return [path for _, path in self._partitions()]
+
+    def _table(self, rows):
+        """
+        Returns the columns of the results of samples, given as series
+        indexed like the dataframes of the evaluation functions.
+        """
+        table = {}
+        for column in self.scalar_columns:
+            table[self._member(column)] = np.array(
+                [row[column] for row in rows], dtype=float)
+        for group in self.array_columns:
+            table[group] = [np.asarray(row[group], dtype=float)
+                            for row in rows]
+
+        return table
+
+    def _read(self, path, members=None):
+        """
+        Returns the given scalar and array columns (all if ``members`` is
+        ``None``) of a partition, its number of samples and its metadata
+        (``None`` for CSV files).
+        """
+        if path.endswith('.csv'):
+            df = pd.read_csv(path, header=[0, 1], index_col=[0],
+                             skipinitialspace=True)
+            table = self._table([df.iloc[i] for i in range(len(df))])
+            if members is not None:
+                table = {k: v for k, v in table.items() if k in members}
+            return table, len(df), None
+
+        table = {}
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            for member in metadata['columns']:
+                if members is not None and member not in members:
+                    continue
+                if member in self.array_columns:
+                    values = data[member + '.values']
+                    offsets = data[member + '.offsets']
+                    table[member] = np.split(values, offsets[1:-1])
+                else:
+                    table[member] = data[member]
+
+        return table, metadata['rows'], metadata
+
+    def _write(self, table, rows, compaction=None):
+        """
+        Writes the columns of ``rows`` samples as a new partition, with the
+        ``compaction`` it is part of, if any, in its metadata.
+        """
+        arrays = {}
+        stats = {}
+        for column in self.scalar_columns:
+            member = self._member(column)
+            arrays[member] = table[member]
+            finite = table[member][~np.isnan(table[member])]
+            if len(finite):
+                stats[member] = [float(np.min(finite)), float(np.max(finite))]
+        for group in self.array_columns:
+            values = table[group]
+            arrays[group + '.values'] = np.concatenate(
+                values) if values else np.empty(0)
+            arrays[group + '.offsets'] = np.cumsum(
+                [0] + [len(v) for v in values])
+        metadata = {'rows': rows, 'stats': stats,
+                    'columns': list(table.keys())}
+        if self.version is not None:
+            metadata['version'] = self.version
+        if compaction is not None:
+            metadata['compaction'] = compaction
+        arrays['metadata'] = np.array(json.dumps(metadata))
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+        # Linking fails instead of overwriting a partition written by another
+        # process in the meantime
+        partitions = self._files()
+        number = partitions[-1][0] + 1 if partitions else 0
+        while True:
+            try:
+                os.link(temp_path, os.path.join(
+                    self.directory, self.name + '_' + str(number) + '.npz'))
+                break
+            except FileExistsError:
+                number += 1
+        os.remove(temp_path)
+
+    def _check_version(self):
+        """
+        Raises a ``ValueError`` if the store has partitions of a version
+        other than :attr:`version`.
+        """
+        if self.version is None:
+            return
+
+        for path in self.partitions():
+            version = 1
+            if path.endswith('.npz'):
+                with np.load(path) as data:
+                    version = json.loads(str(data['metadata'])).get(
+                        'version', 1)
+            if version != self.version:
+                raise ValueError(
+                    'Partition ' + path + ' was computed with version ' +
+                    str(version) + ', not ' + str(self.version) + '. Move '
+                    'or remove the results of other versions to recompute '
+                    'them')
+
+    def append(self, results):
+        """
+        Appends the results of samples, a list of dataframes as returned by
+        the evaluation functions (e.g. by a :class:`pints.Evaluator`), as a
+        new partition.
+        """
+        if len(results) == 0:
+            return
+        self._check_version()
+        rows = [result.iloc[:, 0] for result in results]
+        self._write(self._table(rows), len(rows))
+
+    def completed(self, column=('param_id', 'param_id')):
+        """
+        Returns the values of the scalar ``column`` of all samples in the
+        store, e.g. the ``param_id`` of the samples already run, reading only
+        that column.
+        """
+        self._check_version()
+        member = self._member(column)
+        values = [self._read(path, [member])[0][member]
+                  for path in self.partitions()]
+
+        return np.concatenate(values) if values else np.empty(0)
+
+    def _may_match(self, metadata, filters):
+        """
+        Returns ``False`` if the statistics of a partition show that none of
+        its samples pass the filters.
+        """
+        for column, op, value in filters:
+            if op == '!=':
+                continue
+            stats = metadata['stats'].get(self._member(column))
+            if stats is None:
+                return False
+            low, high = stats
+            if (op in ('<', '<=') and not self._operators[op](low, value)) or \
+                    (op in ('>', '>=') and
+                     not self._operators[op](high, value)) or \
+                    (op == '==' and not low <= value <= high):
+                return False
+
+        return True
+
+    def _load_table(self, groups, filters):
+        """
+        Returns the columns in ``groups`` of the samples passing ``filters``
+        in all partitions, and the number of samples.
+        """
+        for column, op, _ in filters:
+            if op not in self._operators:
+                raise ValueError('Unknown comparison: ' + str(op))
+            self._member(column)
+
+        members = [self._member(c) for c in self.scalar_columns
+                   if c[0] in groups] + \
+            [g for g in self.array_columns if g in groups]
+        read = set(members) | {self._member(c) for c, _, _ in filters}
+
+        parts = []
+        for path in self.partitions():
+            table, rows, metadata = self._read(path, read)
+            if metadata is not None and \
+                    not self._may_match(metadata, filters):
+                continue
+            mask = np.ones(rows, dtype=bool)
+            for column, op, value in filters:
+                mask &= self._operators[op](table[self._member(column)],
+                                            value)
+            parts.append({m: [v for v, keep in zip(table[m], mask) if keep]
+                          if m in self.array_columns else table[m][mask]
+                          for m in members})
+
+        table = {}
+        for m in members:
+            if m in self.array_columns:
+                table[m] = [v for part in parts for v in part[m]]
+            else:
+                table[m] = np.concatenate(
+                    [part[m] for part in parts]) if parts else np.empty(0)
+
+        return table
+
+    def load(self, columns=None, filters=None):
+        """
+        Returns the results of the samples in the store as a dataframe with
+        the same columns as the results of the evaluation functions (only the
+        column groups in ``columns``, e.g. ``['param_values', 'RMSE']``, if
+        given) and one row per sample. Array columns are padded with NaNs to
+        the longest array.
+
+        Only the samples passing all ``filters`` are loaded, given as
+        ``(column, op, value)`` with a scalar column, e.g.
+        ``[(('RMSE', 'RMSE'), '<', 30)]``, and one of ``'<'``, ``'<='``,
+        ``'>'``, ``'>='``, ``'=='`` and ``'!='``.
+        """
+        groups = self.groups if columns is None else list(columns)
+        for group in groups:
+            if group not in self.groups:
+                raise ValueError('Unknown column group: ' + str(group))
+        self._check_version()
+        table = self._load_table(groups, filters or [])
+
+        frame = {}
+        for group in groups:
+            if group in self.array_columns:
+                arrays = table[group]
+                width = max([len(a) for a in arrays], default=0)
+                values = np.full((len(arrays), width), np.nan)
+                for i, a in enumerate(arrays):
+                    values[i, :len(a)] = a
+                for i in range(width):
+                    frame[(group, 'conc_' + str(i))] = values[:, i]
+            else:
+                for column in self.scalar_columns:
+                    if column[0] == group:
+                        frame[column] = table[self._member(column)]
+
+        return pd.DataFrame(frame, columns=pd.MultiIndex.from_tuples(
+            list(frame.keys())))
+
+    def compact(self, rows=1000):
+        """
+        Merges the binary partitions of the store into partitions of up to
+        ``rows`` samples each, keeping the order of the samples. Partitions
+        saved as CSV are left as they are.
+
+        The merged partitions are written first, recording the partitions
+        they replace, and the replaced partitions are removed afterwards.
+        Partitions left by an interrupted call are removed too.
+        """
+        partitions = [(number, path) for number, path in self._partitions()
+                      if path.endswith('.npz')]
+        for path in set(path for _, path in self._files()
+                        if path.endswith('.npz')) - \
+                set(path for _, path in partitions):
+            os.remove(path)
+        if len(partitions) < 2:
+            return
+        paths = [path for _, path in partitions]
+
+        parts = [self._read(path) for path in paths]
+        table = {}
+        for m in parts[0][0].keys():
+            if m in self.array_columns:
+                table[m] = [v for part, _, _ in parts for v in part[m]]
+            else:
+                table[m] = np.concatenate([part[m] for part, _, _ in parts])
+        total = sum(n for _, n, _ in parts)
+
+        compaction = {'id': uuid.uuid4().hex,
+                      'parts': len(range(0, total, rows)),
+                      'replaces': [number for number, _ in partitions]}
+        for start in range(0, total, rows):
+            self._write({m: v[start:start + rows] for m, v in table.items()},
+                        min(rows, total - start), compaction)
+        for path in paths:
+            os.remove(path)
@@ -1,6 +1,12 @@
 import myokit
 import numpy as np
 import pandas as pd
+import scipy.linalg
+import scipy.stats
+from SALib.analyze import morris as morris_analyze
+from SALib.analyze import sobol as sobol_analyze
+from SALib.sample import morris as morris_sample
+from SALib.sample import sobol as sobol_sample
 
 import modelling
 
@@ -14,6 +20,9 @@ class SensitivityAnalysis(object):
         super(SensitivityAnalysis, self).__init__()
 
         self.param_names = ['Vhalf', 'Kmax', 'Ku', 'N', 'EC50']
+        # Ion channels whose conductances are scaled in multi-ion simulations
+        self.ion_currents = ['INa', 'INaL', 'ICaL', 'Ito', 'IKr', 'IKs',
+                             'IK1']
 
     def param_explore_drug(self, drug, param):
 
@@ -173,6 +182,589 @@ class SensitivityAnalysis(object):
 
         return param_range
 
+    def boundary_bounds(self, bounds=None):
+        """
+        Returns the bounds of Vhalf, Kmax and Ku explored by the boundary
+        sampler, i.e. the range of each parameter over the synthetic drugs,
+        or the bounds given in the dictionary ``bounds`` instead.
+        """
+        bounds = {} if bounds is None else bounds
+        return {param: bounds.get(param, (
+            min(self.param_explore_uniform(param, res_points=2)),
+            max(self.param_explore_uniform(param, res_points=2))))
+            for param in ['Vhalf', 'Kmax', 'Ku']}
+
+    def _boundary_coordinates(self, points, bounds, inverse=False):
+        # Maps (Vhalf, Kmax, Ku) to the unit cube, with Kmax and Ku on a log
+        # scale, or back if inverse
+        points = np.array(points, dtype=float, ndmin=2)
+        for i, param in enumerate(['Vhalf', 'Kmax', 'Ku']):
+            low, high = bounds[param]
+            if param != 'Vhalf':
+                low, high = np.log10(low), np.log10(high)
+            if inverse:
+                points[:, i] = low + points[:, i] * (high - low)
+                if param != 'Vhalf':
+                    points[:, i] = 10**points[:, i]
+            else:
+                if param != 'Vhalf':
+                    points[:, i] = np.log10(points[:, i])
+                points[:, i] = (points[:, i] - low) / (high - low)
+
+        return points
+
+    def boundary_initial(self, n_points, bounds=None, seed=None):
+        """
+        Returns ``n_points`` (Vhalf, Kmax, Ku) points of a Latin hypercube
+        design, to start the boundary sampler from.
+        """
+        bounds = self.boundary_bounds(bounds)
+        unit = scipy.stats.qmc.LatinHypercube(d=3, seed=seed).random(n_points)
+
+        return self._boundary_coordinates(unit, bounds, inverse=True)
+
+    def boundary_sampler(self, points, RMSE, batch_size, threshold=30,
+                         bounds=None, n_candidates=5000, seed=None):
+        """
+        Proposes ``batch_size`` new (Vhalf, Kmax, Ku) points where it is most
+        uncertain whether the RMSD between the APD90s of the AP-SD model and
+        the AP-CS model is below ``threshold``, given the RMSD ``RMSE`` at the
+        ``points`` evaluated so far.
+
+        The log RMSD, clipped to a decade around the ``threshold``, is
+        modelled on the unit cube of the parameter ``bounds`` (see
+        :meth:`boundary_bounds`) by a linear trend plus a Gaussian process
+        with a squared exponential kernel. The length scale is chosen by
+        marginal likelihood, down to half the typical spacing of the points.
+        Among ``n_candidates`` random points, those with the highest
+        probability of being misclassified by the model are proposed, at
+        least half a length scale apart. Points with NaN RMSD (failed
+        simulations) are ignored.
+
+        Returns the proposed points and the uncertainty of the boundary,
+        the expected fraction of the parameter space that is misclassified,
+        which can be used to stop sampling.
+        """
+        bounds = self.boundary_bounds(bounds)
+        X = self._boundary_coordinates(points, bounds)
+        RMSE = np.asarray(RMSE, dtype=float)
+        valid = ~np.isnan(RMSE)
+        X = X[valid]
+
+        # Only whether the RMSD is below the threshold matters, so the log
+        # RMSD is clipped to a decade around it, which keeps large jumps in
+        # the RMSD (e.g. at the onset of EADs) away from the boundary from
+        # dominating the fit
+        level = np.log10(threshold)
+        y = np.clip(np.log10(np.maximum(RMSE[valid], 1e-12)),
+                    level - 1, level + 1)
+
+        # Fit the trend, and the Gaussian process to the scaled residuals
+        def design(A):
+            return np.hstack([np.ones((len(A), 1)), A])
+
+        trend = np.linalg.lstsq(design(X), y, rcond=None)[0]
+        residuals = y - design(X) @ trend
+        scale = max(np.std(residuals), 1e-6)
+        residuals = residuals / scale
+
+        def kernel(A, B, length_scale):
+            d2 = np.sum((A[:, None, :] - B[None, :, :])**2, axis=2)
+            return np.exp(-d2 / (2 * length_scale**2))
+
+        # Choose the length scale with the highest marginal likelihood, but
+        # not below half the typical spacing of the points, so that the model
+        # is refined as points are added rather than being certain only close
+        # to them. The simulations are deterministic, so the noise only keeps
+        # the kernel matrix well conditioned
+        noise = 1e-4
+        spacing = len(X)**(-1 / 3)
+        length_scales = [s for s in [0.025, 0.05, 0.1, 0.2, 0.4]
+                         if s >= spacing / 2] or [0.4]
+        best = None
+        for length_scale in length_scales:
+            K = kernel(X, X, length_scale) + noise * np.eye(len(X))
+            L = scipy.linalg.cho_factor(K, lower=True)
+            alpha = scipy.linalg.cho_solve(L, residuals)
+            likelihood = -0.5 * residuals @ alpha - \
+                np.sum(np.log(np.diag(L[0])))
+            if best is None or likelihood > best[0]:
+                best = (likelihood, length_scale, L, alpha)
+        _, length_scale, L, alpha = best
+
+        rng = np.random.default_rng(seed)
+        candidates = rng.random((n_candidates, 3))
+        K_star = kernel(candidates, X, length_scale)
+        mean = design(candidates) @ trend + scale * (K_star @ alpha)
+        v = scipy.linalg.cho_solve(L, K_star.T)
+        std = scale * np.sqrt(np.maximum(
+            1 - np.sum(K_star.T * v, axis=0), 1e-12))
+        misclassified = scipy.stats.norm.cdf(-np.abs(mean - level) / std)
+        uncertainty = np.mean(misclassified)
+
+        # Spread the batch over the most uncertain parts of the boundary
+        order = np.argsort(-misclassified)
+        distance = np.full(n_candidates, np.inf)
+        chosen = []
+        for i in order:
+            if distance[i] >= length_scale / 2:
+                chosen.append(i)
+                distance = np.minimum(distance, np.linalg.norm(
+                    candidates - candidates[i], axis=1))
+            if len(chosen) == batch_size:
+                break
+        chosen += [i for i in order if i not in chosen][
+            :batch_size - len(chosen)]
+
+        return self._boundary_coordinates(candidates[chosen], bounds,
+                                          inverse=True), uncertainty
+
+    def _boundary_step(self, line, low, high, tol):
+        """
+        Returns the log Ku values to evaluate next on a line of the boundary
+        tracer, or an empty list once its root is found.
+        """
+        xs = sorted(line['samples'])
+        fs = [line['samples'][x] for x in xs]
+        if np.any(np.isnan(fs)):
+            # A failed simulation leaves the crossing undetermined
+            line['root'] = np.nan
+            return []
+
+        brackets = [(a, b) for a, b, fa, fb in zip(xs, xs[1:], fs, fs[1:])
+                    if np.sign(fa) != np.sign(fb)]
+        if brackets:
+            # Follow the crossing closest to the initial guess
+            centre = line['centre']
+            if centre is None:
+                centre = (low + high) / 2
+            a, b = min(brackets, key=lambda ab: abs((ab[0] + ab[1]) / 2 -
+                                                    centre))
+            if b - a > tol:
+                return [(a + b) / 2]
+            fa, fb = line['samples'][a], line['samples'][b]
+            line['root'] = a + fa / (fa - fb) * (b - a)
+            return []
+
+        # Widen the bracket until the RMSD crosses the threshold
+        if xs[0] <= low and xs[-1] >= high:
+            line['root'] = np.nan
+            return []
+        line['step'] *= 2
+        return [x for x in (max(low, xs[0] - line['step']),
+                            min(high, xs[-1] + line['step']))
+                if x not in line['samples']]
+
+    def boundary_trace(self, evaluate, Vhalf_range, Kmax_range,
+                       Ku_bounds=None, threshold=30, tol=0.05, width=0.5):
+        """
+        Traces the boundary surface where the RMSD between the APD90s of the
+        AP-SD model and the AP-CS model crosses ``threshold``, by finding for
+        each (Vhalf, Kmax) the Ku at which it does, to within ``tol`` decades.
+
+        ``evaluate`` is called with a list of (Vhalf, Kmax, Ku) points and
+        returns their RMSD; the points of all lines with the same Vhalf are
+        given at once, so that they can be evaluated in parallel. Each line
+        is bracketed and then bisected on log Ku, starting from the whole
+        range ``Ku_bounds`` (see :meth:`boundary_bounds`) for the first
+        Vhalf, and from ``width`` decades around the root of the previous
+        Vhalf for the others, widened until the RMSD crosses the threshold.
+        If there is more than one crossing, the one closest to the previous
+        root (or the middle of the range) is followed.
+
+        Returns the boundary surface as a mesh: arrays of Vhalf, Kmax and Ku
+        with one row per Vhalf and one column per Kmax. Ku is NaN where the
+        RMSD does not cross the threshold or a simulation failed.
+        """
+        if Ku_bounds is None:
+            Ku_bounds = self.boundary_bounds()['Ku']
+        low, high = np.log10(Ku_bounds)
+        level = np.log10(threshold)
+
+        roots = np.full((len(Vhalf_range), len(Kmax_range)), np.nan)
+        for i, Vhalf in enumerate(Vhalf_range):
+            lines = []
+            for j, Kmax in enumerate(Kmax_range):
+                centre = None if i == 0 or np.isnan(roots[i - 1, j]) \
+                    else roots[i - 1, j]
+                if centre is None:
+                    todo = [low, high]
+                else:
+                    todo = [max(low, centre - width),
+                            min(high, centre + width)]
+                lines.append({'Kmax': Kmax, 'samples': {}, 'todo': todo,
+                              'centre': centre, 'step': width})
+
+            while any(line['todo'] for line in lines):
+                requests = [(line, x) for line in lines for x in line['todo']]
+                RMSE = evaluate([(Vhalf, line['Kmax'], 10**x)
+                                 for line, x in requests])
+                for (line, x), value in zip(requests, RMSE):
+                    line['samples'][x] = np.log10(max(value, 1e-12)) - level \
+                        if not np.isnan(value) else np.nan
+                for line in lines:
+                    line['todo'] = self._boundary_step(line, low, high, tol)
+
+            roots[i] = [line['root'] for line in lines]
+
+        Vhalf_mesh, Kmax_mesh = np.meshgrid(Vhalf_range, Kmax_range,
+                                            indexing='ij')
+
+        return Vhalf_mesh, Kmax_mesh, 10**roots
+
+    def sobol_problem(self, bounds=None):
+        """
+        Returns the SALib problem of a global sensitivity analysis over all
+        parameters (``param_names``), with Kmax, Ku and EC50 on a log10
+        scale. Each parameter ranges over its values for the synthetic
+        drugs, or over the bounds given in the dictionary ``bounds``.
+        """
+        bounds = {} if bounds is None else bounds
+        problem_bounds = []
+        for param in self.param_names:
+            low, high = bounds.get(param, (
+                min(self.param_explore_uniform(param, res_points=2)),
+                max(self.param_explore_uniform(param, res_points=2))))
+            if param in ['Kmax', 'Ku', 'EC50']:
+                low, high = np.log10(low), np.log10(high)
+            problem_bounds.append([float(low), float(high)])
+
+        return {'num_vars': len(self.param_names),
+                'names': list(self.param_names),
+                'bounds': problem_bounds}
+
+    def sobol_samples(self, problem, n_base, calc_second_order=False,
+                      seed=None):
+        """
+        Returns the Saltelli samples of ``problem`` (see
+        :meth:`sobol_problem`) for ``n_base`` base samples, as a dataframe
+        with a ``'param_id'`` and the parameter values of each distinct
+        sample, and the ``param_id`` of every row of the Saltelli design.
+        Repeated rows of the design share a ``param_id``, so that they are
+        only evaluated once.
+        """
+        design = sobol_sample.sample(problem, n_base,
+                                     calc_second_order=calc_second_order,
+                                     seed=seed)
+
+        # Number the distinct rows in the order they first appear
+        _, first, inverse = np.unique(design, axis=0, return_index=True,
+                                      return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        ids = rank[np.ravel(inverse)]
+
+        samples = self._problem_values(problem, design[first[order]])
+        samples = pd.DataFrame(samples, columns=problem['names'])
+        samples.insert(0, 'param_id', np.arange(len(samples)))
+
+        return samples, ids
+
+    def sobol_indices(self, problem, ids, outputs, calc_second_order=False,
+                      num_resamples=100, conf_level=0.95, seed=None):
+        """
+        Returns the first-order (``'S1'``) and total-order (``'ST'``) Sobol
+        indices of each parameter, with the half-widths of their bootstrap
+        confidence intervals (``'S1_conf'`` and ``'ST_conf'``), and the number
+        of base samples used.
+
+        ``outputs`` maps the ``param_id`` of the samples evaluated so far to
+        their output (e.g. a series of the RMSD indexed by ``param_id``), and
+        ``ids`` is the ``param_id`` of every row of the Saltelli design (see
+        :meth:`sobol_samples`). Only the base samples whose rows have all
+        been evaluated, without failed (NaN) simulations, are used, so that
+        the indices can be computed while samples are still running.
+        Returns ``None`` for the indices if fewer than two base samples are
+        complete.
+        """
+        D = problem['num_vars']
+        block = 2 * D + 2 if calc_second_order else D + 2
+        values = pd.Series(outputs, dtype=float).reindex(
+            np.ravel(ids)).values.reshape(-1, block)
+        complete = ~np.any(np.isnan(values), axis=1)
+        if np.sum(complete) < 2:
+            return None, int(np.sum(complete))
+
+        Si = sobol_analyze.analyze(
+            problem, values[complete].ravel(),
+            calc_second_order=calc_second_order, num_resamples=num_resamples,
+            conf_level=conf_level, seed=seed)
+        indices = pd.DataFrame({key: Si[key] for key in
+                                ['S1', 'S1_conf', 'ST', 'ST_conf']},
+                               index=problem['names'])
+
+        return indices, int(np.sum(complete))
+
+    def _problem_values(self, problem, design):
+        # Returns the parameter values of the rows of a design, undoing the
+        # log10 scale of Kmax, Ku and EC50
+        values = np.array(design, dtype=float)
+        for i, param in enumerate(problem['names']):
+            if param in ['Kmax', 'Ku', 'EC50']:
+                values[:, i] = 10**values[:, i]
+
+        return values
+
+    def morris_problem(self, bounds=None, scale_bounds=(0.5, 1.5)):
+        """
+        Returns the SALib problem of a Morris screening over the binding
+        parameters (``param_names``, see :meth:`sobol_problem`) and the
+        conductance scales of the ion channels (``ion_currents``), which
+        range over ``scale_bounds``.
+        """
+        problem = self.sobol_problem(bounds=bounds)
+        problem['num_vars'] += len(self.ion_currents)
+        problem['names'] += list(self.ion_currents)
+        problem['bounds'] += [[float(scale_bounds[0]), float(scale_bounds[1])]
+                              for _ in self.ion_currents]
+
+        return problem
+
+    def morris_samples(self, problem, n_trajectories, num_levels=4,
+                       seed=None):
+        """
+        Returns the Morris trajectories of ``problem`` (see
+        :meth:`morris_problem`), as a list of ``n_trajectories`` dataframes
+        with the parameter values of the ``num_vars + 1`` points of each
+        trajectory, in order, and the Morris design they come from.
+        Consecutive points of a trajectory differ in one parameter only.
+        """
+        design = morris_sample.sample(problem, n_trajectories,
+                                      num_levels=num_levels, seed=seed)
+        samples = self._problem_values(problem, design)
+
+        block = problem['num_vars'] + 1
+        trajectories = [pd.DataFrame(samples[i:i + block],
+                                     columns=problem['names'])
+                        for i in range(0, len(samples), block)]
+
+        return trajectories, design
+
+    def morris_trajectory(self, trajectory, AP_model, drug_conc, repeats,
+                          qNet_currents, RMSD=None, save_signal=1,
+                          abs_tol=1e-6, rel_tol=1e-4):
+        """
+        Returns the APD90 (the longest over the saved pulses), the qNet (of
+        the last saved pulse) and the RMSD of each point of a Morris
+        trajectory (see :meth:`morris_samples`), as a dataframe.
+
+        The AP model is simulated with the binding parameters and the ion
+        channel scales of each point at ``drug_conc``, and with the sum of
+        ``qNet_currents`` accumulated. Points are simulated in order, each
+        starting from the steady state of the previous point, which differs
+        in one parameter only, so that pre-pacing converges in fewer pulses.
+        ``RMSD`` is a function of a dataframe of the binding parameters, e.g.
+        comparing the APD90s of the AP-SD model and the AP-CS model, which
+        is only called when the binding parameters change. Failed
+        simulations give NaN.
+        """
+        accumulators = AP_model.accumulators
+        AP_model.accumulators = {'qNet': ' + '.join(qNet_currents)}
+
+        outputs = []
+        state = None
+        RMSD_values = {}
+        try:
+            for i in range(len(trajectory.index)):
+                param_values = trajectory.iloc[[i]][
+                    self.param_names].reset_index(drop=True)
+                ion_scale = {current: trajectory[current].values[i]
+                             for current in self.ion_currents}
+
+                try:
+                    biomarkers = AP_model.custom_simulation(
+                        param_values, drug_conc, repeats,
+                        save_signal=save_signal, abs_tol=abs_tol,
+                        rel_tol=rel_tol, set_state=state, biomarkers=True,
+                        ion_scale=ion_scale)
+                    APD90 = float(np.max(biomarkers['APD90']))
+                    qNet = float(AP_model.accumulated['qNet'][-1] * 1e-3)
+                    state = AP_model.prepace_state
+                except myokit.SimulationError:
+                    APD90 = qNet = float('nan')
+                    state = None
+
+                key = tuple(param_values.values[0])
+                if RMSD is not None and key not in RMSD_values:
+                    RMSD_values[key] = RMSD(param_values)
+
+                outputs.append([APD90, qNet,
+                                RMSD_values.get(key, float('nan'))])
+        finally:
+            AP_model.accumulators = accumulators
+
+        return pd.DataFrame(outputs, columns=['APD90', 'qNet', 'RMSD'])
+
+    def morris_indices(self, problem, design, outputs, num_levels=4,
+                       num_resamples=100, conf_level=0.95, seed=None):
+        """
+        Returns the mean of the absolute elementary effects (``'mu_star'``)
+        of each parameter, the half-width of its bootstrap confidence
+        interval (``'mu_star_conf'``) and the standard deviation of the
+        elementary effects (``'sigma'``), sorted by ``'mu_star'`` so that
+        the most influential parameters come first, and the number of
+        trajectories used.
+
+        ``outputs`` has the output of every row of the Morris ``design`` (see
+        :meth:`morris_samples`), NaN for points not evaluated yet or failed.
+        Only the trajectories without NaNs are used. Returns ``None`` for the
+        indices if fewer than two trajectories are complete.
+        """
+        block = problem['num_vars'] + 1
+        values = np.asarray(outputs, dtype=float).reshape(-1, block)
+        complete = ~np.any(np.isnan(values), axis=1)
+        if np.sum(complete) < 2:
+            return None, int(np.sum(complete))
+
+        X = np.asarray(design).reshape(-1, block, problem['num_vars'])
+        Si = morris_analyze.analyze(
+            problem, X[complete].reshape(-1, problem['num_vars']),
+            values[complete].ravel(), num_resamples=num_resamples,
+            conf_level=conf_level, num_levels=num_levels, seed=seed)
+        indices = pd.DataFrame({key: Si[key] for key in
+                                ['mu_star', 'mu_star_conf', 'sigma']},
+                               index=problem['names'])
+
+        return indices.sort_values('mu_star', ascending=False), \
+            int(np.sum(complete))
+
+    def comparison_models(self, model_dir='../math_model/',
+                          data_dir='../simulation_data/'):
+        """
+        Returns the models used to compare the AP-SD model and the AP-CS
+        model for virtual drugs: the IKr model under Milnes' protocol (with
+        the 'expm' engine), the AP model paced every 1000 ms and the
+        :class:`modelling.APDTable` of the AP-CS model, built if needed.
+
+        Models are compiled once per machine with a
+        :class:`modelling.ModelCache`, and the steady states of the AP model
+        are reused from ``data_dir + 'steady_states.db'``. Workers forked
+        afterwards (e.g. by a :class:`modelling.SweepExecutor`) share the
+        models and the table.
+        """
+        model_cache = modelling.ModelCache()
+
+        # Load current model and set Milnes' protocol
+        model = model_cache.load(model_dir + 'ohara-cipa-v1-2017-IKr-opt.mmt')
+        current_model = modelling.BindingKinetics(model, engine='expm')
+        current_model.protocol = modelling.ProtocolParameters(
+        ).protocol_parameters['Milnes']['function']
+
+        # Load AP model and set current protocol
+        APmodel = model_cache.load(model_dir + 'ohara-cipa-v1-2017-opt.mmt')
+        AP_model = modelling.BindingKinetics(APmodel, current_head='ikr',
+                                             steady_state_method='shooting',
+                                             model_cache=model_cache)
+        AP_model.protocol = modelling.ProtocolLibrary().current_impulse(1000)
+        AP_model.steady_state_cache = modelling.SteadyStateCache(
+            data_dir + 'steady_states.db')
+
+        # Look up the APD90s of the AP-CS model instead of simulating them
+        APD_table = modelling.APDTable(AP_model,
+                                       directory=data_dir + 'APD_tables/')
+        APD_table.build()
+
+        return current_model, AP_model, APD_table
+
+    def sample_evaluation(self, param_values, current_model, AP_model,
+                          APD_table=None, APD_points=20):
+        """
+        Returns the results of a virtual drug, given as a dataframe with one
+        row of the parameters ``param_names`` and optionally a
+        ``'param_id'`` (or as a sample of a
+        :class:`modelling.ParameterSampler` design), as a dataframe with one
+        column indexed like the columns of a :class:`modelling.ResultsStore`.
+
+        The Hill curve of the drug is fitted to the peak IKr of
+        ``current_model``, with drug concentrations normalised by the EC50,
+        and the APD90s of the AP-SD model and the AP-CS model (looked up in
+        ``APD_table`` if given) are compared at ``APD_points``
+        concentrations over the same range. Failed fits and simulations give
+        NaN.
+        """
+        if not isinstance(param_values, pd.DataFrame):
+            param_values = modelling.ParameterSampler.frame(param_values)
+
+        # Define parameter values of virtual drug
+        param_id = param_values['param_id'].values[0] \
+            if 'param_id' in param_values.columns else float('nan')
+        param_values = param_values[self.param_names].reset_index(drop=True)
+        orig_half_effect_conc = param_values['EC50'][0]
+        param_values.loc[0, 'EC50'] = 1
+        ComparisonController = modelling.ModelComparison(param_values)
+
+        # Calculate the normalising constant
+        Hill_n = param_values['N'][0]
+        norm_constant = np.power(orig_half_effect_conc, 1 / Hill_n)
+
+        # Compute Hill curve of the virtual drug with the SD model
+        Hill_curve_coefs, drug_conc_Hill, peaks_norm = \
+            ComparisonController.compute_Hill(current_model,
+                                              norm_constant=norm_constant,
+                                              parallel=False,
+                                              Hill_method='least_squares')
+        # parameters of Hill curve are based on normalised drug concentration
+        # Hill coefficient remains the same but IC50 -> IC50/EC50
+
+        # Define drug concentration range similar to the drug concentration
+        # used to infer Hill curve
+        drug_conc_AP = 10**np.linspace(np.log10(drug_conc_Hill[1]),
+                                       np.log10(max(drug_conc_Hill)),
+                                       APD_points)
+
+        if isinstance(Hill_curve_coefs, str):
+            Hill_curve_coefs = [float("nan")] * 2
+            APD_trapping = [float("Nan")] * APD_points
+            APD_conductance = [float("Nan")] * APD_points
+            RMSError = float("Nan")
+            MAError = float("Nan")
+        else:
+            try:
+                # Simulate APs and APD90s of the AP-SD model and the AP-CS
+                # model
+                APD_trapping, APD_conductance, drug_conc_AP = \
+                    ComparisonController.APD_sim(
+                        AP_model, Hill_curve_coefs, drug_conc=drug_conc_AP,
+                        EAD=True, APD_table=APD_table)
+
+                # Calculate RMSD and MD of simulated APD90 of the two models
+                RMSError = ComparisonController.compute_RMSE(APD_trapping,
+                                                             APD_conductance)
+                MAError = ComparisonController.compute_ME(APD_trapping,
+                                                          APD_conductance)
+            except myokit.SimulationError:
+                APD_trapping = [float("Nan")] * APD_points
+                APD_conductance = [float("Nan")] * APD_points
+                RMSError = float("Nan")
+                MAError = float("Nan")
+
+        # Create dataframe to save results
+        conc_Hill_ind = ['conc_' + str(i) for i, _ in
+                         enumerate(drug_conc_Hill)]
+        conc_AP_ind = ['conc_' + str(i) for i, _ in enumerate(drug_conc_AP)]
+        index_dict = {'param_id': ['param_id'],
+                      'drug_conc_Hill': conc_Hill_ind,
+                      'peak_current': conc_Hill_ind,
+                      'Hill_curve': ['Hill_coef', 'IC50'],
+                      'param_values': self.param_names,
+                      'drug_conc_AP': conc_AP_ind,
+                      'APD_trapping': conc_AP_ind,
+                      'APD_conductance': conc_AP_ind, 'RMSE': ['RMSE'],
+                      'ME': ['ME']}
+        all_index = [(i, j) for i in index_dict.keys()
+                     for j in index_dict[i]]
+        index = pd.MultiIndex.from_tuples(all_index)
+
+        param_values.loc[0, 'EC50'] = orig_half_effect_conc
+        big_df = pd.DataFrame(
+            [param_id] + list(drug_conc_Hill) + list(peaks_norm) +
+            list(Hill_curve_coefs) + list(param_values.values[0]) +
+            list(drug_conc_AP) + list(APD_trapping) + list(APD_conductance) +
+            [RMSError] + [MAError], index=index)
+
+        return big_df
+
     def comparison_evaluation(self, param_values, hERG_model, AP_model,
                               log_transform=True, APD_points=20):
 
@@ -187,7 +779,8 @@ class SensitivityAnalysis(object):
 
         ComparisonController = modelling.ModelComparison(orig_param_values)
         Hill_curve_coefs, drug_conc_Hill, _ = \
-            ComparisonController.compute_Hill(hERG_model)
+            ComparisonController.compute_Hill(hERG_model,
+                                              Hill_method='least_squares')
 
         drug_conc_range = (np.log10(drug_conc_Hill[1]),
                            np.log10(drug_conc_Hill[-1]))
@@ -0,0 +1,98 @@
+#
+# Pool of compiled simulations, reused between runs.
+#
+import myokit
+
+import modelling
+
+
+class SimulationPool(object):
+    """
+    Keeps simulations alive between runs, so that each model is only
+    compiled once for every protocol, tolerance and engine.
+
+    Simulations are handed out by :meth:`simulation`, reset to the model's
+    initial state with all constants at the model's values except those
+    given. The model must not be changed while its simulations are pooled;
+    per-run changes such as the drug concentration should be made on the
+    simulation (e.g. with ``set_state``) instead.
+
+    If a :class:`modelling.ModelCache` is given, new CVODE simulations are
+    loaded from its compiled models rather than compiled again.
+    """
+
+    def __init__(self, model_cache=None):
+        super(SimulationPool, self).__init__()
+
+        self.model_cache = model_cache
+        self._simulations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model, protocol, abs_tol, rel_tol, engine):
+        """
+        Returns the key identifying the simulations of a model and protocol.
+        """
+        protocol = None if protocol is None else protocol.code()
+
+        return (id(model), protocol, abs_tol, rel_tol, engine)
+
+    def simulation(self, model, protocol=None, constants=None, abs_tol=1e-6,
+                   rel_tol=1e-4, engine='cvode'):
+        """
+        Returns a reset simulation of ``model`` and ``protocol``, with the
+        ``constants`` (a dictionary mapping variables or their names to
+        values) applied.
+
+        ``engine`` is either 'cvode' for :class:`myokit.Simulation` or
+        'expm' for :class:`modelling.ExpmSimulation`.
+        """
+        key = self.key(model, protocol, abs_tol, rel_tol, engine)
+        if key in self._simulations:
+            self.hits += 1
+            sim, default_state, changed = self._simulations[key]
+        else:
+            self.misses += 1
+            if engine == 'expm':
+                sim = modelling.ExpmSimulation(model, protocol)
+            elif self.model_cache is not None:
+                sim = self.model_cache.simulation(model, protocol)
+            else:
+                sim = myokit.Simulation(model, protocol)
+            sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
+            default_state, changed = sim.default_state(), set()
+
+        if constants is None:
+            constants = {}
+        constants = {
+            var if isinstance(var, str) else var.qname(): value
+            for var, value in constants.items()}
+
+        # Restore the constants changed by the previous run
+        for var in changed - set(constants):
+            sim.set_constant(var, model.get(var).eval())
+        for var, value in constants.items():
+            sim.set_constant(var, value)
+
+        sim.set_default_state(default_state)
+        sim.reset()
+        self._simulations[key] = (sim, default_state, set(constants))
+
+        return sim
+
+    def hit_rate(self):
+        """
+        Returns the fraction of requests served by an existing simulation.
+        """
+        total = self.hits + self.misses
+
+        return self.hits / total if total else 0
+
+    def clear(self):
+        """
+        Removes all simulations from the pool.
+        """
+        self._simulations = {}
+
+    def __len__(self):
+        return len(self._simulations)
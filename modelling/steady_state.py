@@ -0,0 +1,341 @@
+#
+# Periodic steady states of paced simulations.
+#
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import myokit
+import numpy as np
+
+
+class PeriodicSteadyState(object):
+    """
+    Finds the periodic steady state (limit cycle) of a simulation that is
+    paced with a periodic protocol.
+
+    One protocol period is treated as a map ``x -> F(x)`` on the state
+    vector, evaluated by running the simulation for one period with
+    :meth:`myokit.Simulation.pre`. The simulation is left in the steady
+    state that was found, which is also set as its default state.
+    """
+
+    def __init__(self, simulation, period):
+        super(PeriodicSteadyState, self).__init__()
+
+        self.sim = simulation
+        self.period = period
+
+    def beat(self, state):
+        """
+        Returns the state after one period, starting from ``state``.
+        """
+        self.sim.set_state(list(state))
+        self.sim.pre(self.period)
+
+        return np.array(self.sim.state())
+
+    def pace(self, beats):
+        """
+        Paces the simulation for ``beats`` periods from its current state.
+        """
+        if beats > 0:
+            self.sim.pre(self.period * beats)
+
+        return np.array(self.sim.state())
+
+    def _checked_beat(self, log_var, log_interval):
+        """
+        Paces one period and returns the state, and the trace of
+        ``log_var`` during the period if given.
+        """
+        if log_var is None:
+            return self.pace(1), None
+
+        time = self.sim.time()
+        log = self.sim.run(self.period, log=[log_var],
+                           log_interval=log_interval)
+        self.sim.set_time(time)
+
+        return np.array(self.sim.state()), np.array(log[log_var])
+
+    def _orbit_period(self, states, traces, rtol, atol):
+        """
+        Returns the period (1 or 2) of the orbit the last beats have
+        reached, or ``None``.
+        """
+        scale = rtol * np.abs(states[-1]) + atol
+        for p in [1, 2]:
+            if len(states) < p + 2:
+                continue
+            d_new = (states[-1] - states[-1 - p]) / scale
+            d_old = (states[-2] - states[-2 - p]) / scale
+            if np.max(np.abs(d_new)) >= 1:
+                continue
+            rho = np.linalg.norm(d_new) / max(np.linalg.norm(d_old), 1e-300)
+            if rho < 1 and np.max(np.abs(d_new)) / (1 - rho) >= 1:
+                continue
+            if traces[-1] is not None:
+                if len(traces[-1]) != len(traces[-1 - p]):
+                    continue
+                tol = rtol * np.max(np.abs(traces[-1])) + atol
+                if np.max(np.abs(traces[-1] - traces[-1 - p])) >= tol:
+                    continue
+            return p
+
+        return None
+
+    def converge(self, max_beats=1000, rtol=1e-5, atol=1e-6, chunk=10,
+                 log_var=None, log_interval=1):
+        """
+        Paces the simulation in chunks of ``chunk`` beats, checking the last
+        beats of every chunk, until a period-1 or period-2 orbit is reached
+        or ``max_beats`` have been paced.
+
+        An orbit of period ``p`` is reached when the change of every state
+        over ``p`` beats is within ``rtol * |x| + atol``, also after
+        extrapolating the geometric decay of that change over the last
+        beats, so that slowly drifting states do not stop pacing early. If
+        ``log_var`` is given, its trace over the checked beats (logged every
+        ``log_interval``) has to repeat with the same tolerance.
+
+        Returns the number of beats used.
+        """
+        beats = 0
+        states, traces = [], []
+        while beats < max_beats:
+            n = min(chunk, max_beats - beats)
+            if n > 4:
+                self.pace(n - 4)
+                beats += n - 4
+                states, traces = [], []
+            for _ in range(min(n, 4)):
+                x, trace = self._checked_beat(log_var, log_interval)
+                states, traces = states[-3:] + [x], traces[-3:] + [trace]
+                beats += 1
+
+            p = self._orbit_period(states, traces, rtol, atol)
+            if p is not None:
+                # Keep the phase of a period-2 orbit that pacing for all
+                # beats would end in
+                if p == 2 and (max_beats - beats) % 2:
+                    self.pace(1)
+                    beats += 1
+                break
+        self._finish(np.array(self.sim.state()))
+
+        return beats
+
+    def _finish(self, state):
+        self.sim.set_state(list(state))
+        self.sim.set_default_state(list(state))
+
+    def shooting(self, max_beats=1000, rtol=1e-5, atol=1e-6, warmup=10,
+                 memory=5, max_iterations=50):
+        """
+        Finds the fixed point of the beat map with Anderson acceleration.
+
+        The simulation is first paced for ``warmup`` beats, and left to
+        brute-force pacing if these already show alternans. Anderson
+        acceleration with ``memory`` previous iterates is then applied to
+        the beat map, in coordinates scaled by ``rtol * |x| + atol``, until
+        the change of every state over one beat is within that scale.
+        Proposed states that give a simulation error or change the sign of
+        a state are replaced by a plain beat.
+
+        If the iteration does not converge within ``max_iterations`` beats,
+        or stagnates in a period-2 orbit (alternans), the simulation falls
+        back to brute-force pacing for the remainder of ``max_beats``.
+
+        Returns the number of beats used, which is ``max_beats`` if the
+        iteration did not converge.
+        """
+        # The warm-up needs two beats to compare, so smaller budgets are
+        # only paced
+        if max_beats < 2:
+            x = self.pace(max_beats)
+            self._finish(x)
+            return max(max_beats, 0)
+
+        beats = min(max(warmup, 2), max_beats)
+        x_prev = self.pace(beats - 2)
+        x = self.pace(1)
+        x_safe = self.pace(1)
+        scale = rtol * np.abs(x_safe) + atol
+
+        # Period-2 orbits (alternans), settled or still growing, are left to
+        # brute-force pacing, as the iteration below would find the unstable
+        # period-1 orbit
+        d1, d2 = (x - x_prev) / scale, (x_safe - x) / scale
+        r1 = np.max(np.abs(d2))
+        r2 = np.max(np.abs(d1 + d2))
+        growing = np.dot(d1, d2) < 0 and \
+            np.linalg.norm(d2) >= np.linalg.norm(d1)
+        if r1 > 1 and (r2 < 0.1 * r1 or growing):
+            x = self.pace(max_beats - beats)
+            self._finish(x)
+            return max_beats
+        x = x_safe
+
+        dX, dG = [], []
+        y_prev = g_prev = None
+        residuals = []
+        while beats < max_beats and len(residuals) < max_iterations:
+            try:
+                fx = self.beat(x)
+            except myokit.SimulationError:
+                # Restart from the last state reached by plain pacing
+                x = x_safe
+                dX, dG = [], []
+                y_prev = g_prev = None
+                beats += 1
+                continue
+            beats += 1
+            x_safe = fx
+
+            y, fy = x / scale, fx / scale
+            g = fy - y
+            residuals.append(np.max(np.abs(g)))
+            if residuals[-1] < 1:
+                self._finish(fx)
+                return beats
+
+            # Check for alternans when the residual stagnates
+            if len(residuals) > memory and beats < max_beats and \
+                    residuals[-1] > 0.5 * residuals[-1 - memory]:
+                x = x_safe = self.beat(fx)
+                beats += 1
+                if np.max(np.abs(x / scale - y)) < 0.1 * residuals[-1]:
+                    break
+                dX, dG = [], []
+                y_prev = g_prev = None
+                continue
+
+            # Anderson (type II) update
+            if g_prev is not None:
+                dX.append(y - y_prev)
+                dG.append(g - g_prev)
+                dX, dG = dX[-memory:], dG[-memory:]
+            y_prev, g_prev = y, g
+            y_next = fy
+            if dG:
+                G = np.array(dG).T
+                gamma = np.linalg.lstsq(G, g, rcond=None)[0]
+                y_next = fy - (np.array(dX).T + G).dot(gamma)
+            x = y_next * scale
+            if not np.all(np.isfinite(x)) or \
+                    np.any(np.sign(x) * np.sign(fx) < 0):
+                x = fx
+                dX, dG = [], []
+                y_prev = g_prev = None
+
+        # Fall back to brute-force pacing
+        self.sim.set_state(list(x_safe))
+        x = self.pace(max_beats - beats)
+        self._finish(x)
+
+        return max_beats
+
+
+class SteadyStateCache(object):
+    """
+    A persistent store of pre-paced states, shared between processes.
+
+    Entries are kept in an SQLite database at ``path`` and addressed by a
+    hash of everything that determines the pre-paced state (see
+    :meth:`key`). At most ``max_entries`` entries are kept, evicting the
+    least recently used ones first. Concurrent access from several worker
+    processes is handled by SQLite's locking.
+    """
+
+    def __init__(self, path, max_entries=100000, timeout=60):
+        super(SteadyStateCache, self).__init__()
+
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('CREATE TABLE IF NOT EXISTS states ('
+                        'key TEXT PRIMARY KEY, state TEXT, beats INTEGER, '
+                        'accessed REAL)')
+            con.execute('CREATE INDEX IF NOT EXISTS states_accessed '
+                        'ON states (accessed)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Commits on success and always closes the connection
+        con = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def key(self, model, protocol, **kwargs):
+        """
+        Returns the key of a pre-paced state, hashing the code of the
+        :class:`myokit.Model` and :class:`myokit.Protocol` together with the
+        remaining keyword arguments (e.g. the starting state, the constants
+        set on the simulation, the number of beats and the tolerances),
+        which must be serialisable to JSON.
+        """
+        h = hashlib.sha256()
+        h.update(model.code().encode())
+        h.update(b'' if protocol is None else protocol.code().encode())
+        h.update(json.dumps(kwargs, sort_keys=True).encode())
+
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the state and number of beats stored under ``key``, or
+        ``None``.
+        """
+        with self._connect() as con:
+            row = con.execute('SELECT state, beats FROM states WHERE key = ?',
+                              (key,)).fetchone()
+            if row is not None:
+                con.execute('UPDATE states SET accessed = ? WHERE key = ?',
+                            (time.time(), key))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, state, beats):
+        """
+        Stores a state and the number of beats it took under ``key``,
+        evicting the least recently used entries beyond ``max_entries``.
+        """
+        with self._connect() as con:
+            con.execute('INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?)',
+                        (key, json.dumps([float(x) for x in state]),
+                         int(beats), time.time()))
+            n = con.execute('SELECT COUNT(*) FROM states').fetchone()[0]
+            if n > self.max_entries:
+                con.execute('DELETE FROM states WHERE key IN (SELECT key '
+                            'FROM states ORDER BY accessed LIMIT ?)',
+                            (n - self.max_entries,))
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._connect() as con:
+            con.execute('DELETE FROM states')
+
+    def __len__(self):
+        with self._connect() as con:
+            return con.execute('SELECT COUNT(*) FROM states').fetchone()[0]
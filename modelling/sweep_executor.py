@@ -0,0 +1,183 @@
+#
+# Pool of long-lived workers evaluating the samples of parameter sweeps.
+#
+import multiprocessing
+import queue
+import traceback
+
+import numpy as np
+import pints
+
+
+def _worker(function, args, tasks, results):
+    """
+    Evaluates chunks of tasks from the ``tasks`` queue until it receives
+    ``None``, putting the results of each chunk on the ``results`` queue.
+    Chunks are given as the number of the call to
+    :meth:`SweepExecutor.imap` they belong to, the index of their first task
+    and a slice of the tasks, and results are put with the number of the
+    call.
+    """
+    while True:
+        chunk = tasks.get()
+        if chunk is None:
+            break
+        call, start, chunk = chunk
+        try:
+            results.put((call, True, [(start + i, function(task, *args))
+                                      for i, task in enumerate(chunk)]))
+        except Exception:
+            results.put((call, False, traceback.format_exc()))
+
+
+class SweepExecutor(object):
+    """
+    Evaluates ``function(task, *args)`` for every task (sample) of a
+    parameter sweep with ``n_workers`` worker processes, which are started
+    once and kept until :meth:`close` is called.
+
+    Unlike :class:`pints.ParallelEvaluator`, which starts new processes for
+    every call and waits for the slowest task of each batch, workers take
+    the next ``chunk_size`` tasks from a shared queue as soon as they finish,
+    and results are returned in the order they complete. Workers are forked
+    from the current process, so that the models, compiled simulations and
+    caches set up before :meth:`start` (e.g. the simulation pool of a
+    :class:`modelling.BindingKinetics`) are shared by all of them and kept
+    between tasks. Where processes cannot be forked, or if ``n_workers`` is
+    1, tasks are evaluated in the current process.
+
+    Can be used as a context manager, which closes the workers on exit.
+    """
+
+    def __init__(self, function, n_workers=None, chunk_size=1, args=None):
+        super(SweepExecutor, self).__init__()
+
+        self.function = function
+        if n_workers is None:
+            n_workers = pints.ParallelEvaluator.cpu_count()
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.args = [] if args is None else list(args)
+
+        self._workers = []
+        self._tasks = None
+        self._results = None
+        # Number of calls to imap, so that results of an earlier call that
+        # was stopped early are told apart
+        self._call = 0
+
+    def parallel(self):
+        """
+        Returns ``True`` if tasks are evaluated by worker processes.
+        """
+        return self.n_workers > 1 and \
+            'fork' in multiprocessing.get_all_start_methods()
+
+    def start(self):
+        """
+        Starts the worker processes, if not already running.
+        """
+        if self._workers or not self.parallel():
+            return
+
+        context = multiprocessing.get_context('fork')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        for _ in range(self.n_workers):
+            worker = context.Process(
+                target=_worker, daemon=True,
+                args=(self.function, self.args, self._tasks, self._results))
+            worker.start()
+            self._workers.append(worker)
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def _abort(self, message):
+        # Stop the workers without waiting for their current tasks
+        for worker in self._workers:
+            worker.terminate()
+        self._workers = []
+        raise RuntimeError(message)
+
+    def imap(self, tasks):
+        """
+        Yields ``(index, result)`` for each of the ``tasks``, in the order
+        the tasks are completed, where ``index`` is the position of the task
+        in ``tasks``.
+
+        ``tasks`` can be an array, such as a design of a
+        :class:`modelling.ParameterSampler`, in which case the workers are
+        sent slices of the array and evaluate its rows.
+
+        If a call is stopped before all its results are yielded, the results
+        of its remaining tasks are discarded by later calls.
+        """
+        if not isinstance(tasks, (list, tuple, np.ndarray)):
+            tasks = list(tasks)
+        if not self.parallel():
+            for index, task in enumerate(tasks):
+                yield index, self.function(task, *self.args)
+            return
+
+        self.start()
+        self._call += 1
+        call = self._call
+        starts = range(0, len(tasks), self.chunk_size)
+        for start in starts:
+            self._tasks.put((call, start,
+                             tasks[start:start + self.chunk_size]))
+
+        for _ in range(len(starts)):
+            while True:
+                try:
+                    result_call, success, results = \
+                        self._results.get(timeout=1)
+                    if result_call == call:
+                        break
+                except queue.Empty:
+                    if not all(w.is_alive() for w in self._workers):
+                        self._abort('A worker process stopped unexpectedly.')
+            if not success:
+                self._abort('Exception in worker process:\n' + results)
+            for index, result in results:
+                yield index, result
+
+    def run(self, tasks, store, save_every=None):
+        """
+        Evaluates all ``tasks`` and appends their results to ``store`` (e.g.
+        a :class:`modelling.ResultsStore`) as they complete, ``save_every``
+        results at a time (``n_workers`` by default).
+        """
+        if save_every is None:
+            save_every = self.n_workers
+
+        results = []
+        for _, result in self.imap(tasks):
+            results.append(result)
+            if len(results) >= save_every:
+                store.append(results)
+                results = []
+        if results:
+            store.append(results)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for worker in self._workers:
+                worker.terminate()
+            self._workers = []
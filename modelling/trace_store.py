@@ -0,0 +1,160 @@
+#
+# Binary storage of simulated traces.
+#
+import json
+import os
+import struct
+import tempfile
+import zipfile
+
+import myokit
+import numpy as np
+
+
+class TraceStore(object):
+    """
+    Stores simulation logs (:class:`myokit.DataLog`, e.g. folded into
+    pulses) in ``directory`` as binary arrays instead of CSV text.
+
+    Each log is saved under a name as one ``.npz`` file, with one array for
+    every variable and pulse (``'0.membrane.V'``, ``'1.membrane.V'``, ...)
+    and the metadata given when saving, such as the drug, the concentration,
+    the model variant and the protocol. Arrays are compressed individually
+    if ``compress``, and only those requested are read when loading. Arrays
+    of uncompressed stores are memory-mapped instead of read.
+
+    Logs saved as CSV (with :meth:`myokit.DataLog.save_csv`) under the same
+    name in ``directory`` are loaded if no binary log exists, so that
+    scripts can read older results through the store.
+    """
+
+    def __init__(self, directory, compress=True):
+        super(TraceStore, self).__init__()
+
+        self.directory = directory
+        self.compress = compress
+
+    def path(self, name):
+        """
+        Returns the path of the log saved under ``name``.
+        """
+        return os.path.join(self.directory, name + '.npz')
+
+    def _split(self, key):
+        # Returns the pulse and variable of a key of a folded log
+        pulse, _, var = key.partition('.')
+        if pulse.isdigit() and var:
+            return int(pulse), var
+        return None, key
+
+    def save(self, name, log, **metadata):
+        """
+        Saves a :class:`myokit.DataLog` under ``name``, with the keyword
+        arguments as metadata (e.g. ``drug='dofetilide', drug_conc=10,
+        model='SD', protocol='Milnes'``). The number of pulses is added to
+        the metadata.
+        """
+        pulses = {self._split(key)[0] for key in log.keys()} - {None}
+        metadata = dict(metadata, time_key=log.time_key(),
+                        pulses=len(pulses))
+        arrays = {key: np.asarray(value) for key, value in log.items()}
+        arrays['metadata'] = np.array(json.dumps(metadata))
+
+        # Write to a temporary file first, so that other processes never
+        # read a partly written log
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            if self.compress:
+                np.savez_compressed(f, **arrays)
+            else:
+                np.savez(f, **arrays)
+        os.replace(temp_path, self.path(name))
+
+    def metadata(self, name):
+        """
+        Returns the metadata of the log saved under ``name``.
+        """
+        with np.load(self.path(name)) as data:
+            return json.loads(str(data['metadata']))
+
+    def names(self, prefix=''):
+        """
+        Returns the names of the logs in the store starting with ``prefix``,
+        including CSV files.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+
+        return sorted({f[:-4] for f in os.listdir(self.directory)
+                       if f.startswith(prefix) and
+                       (f.endswith('.npz') or f.endswith('.csv'))})
+
+    def _memmap(self, path, member):
+        """
+        Returns a member of an uncompressed ``.npz`` file as an array mapped
+        from the file, or ``None`` if it is compressed.
+        """
+        with zipfile.ZipFile(path) as z:
+            info = z.getinfo(member)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+
+        with open(path, 'rb') as f:
+            # Skip the local file header, then the header of the .npy file
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(name_length + extra_length, 1)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            offset = f.tell()
+
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                         shape=shape, order='F' if fortran_order else 'C')
+
+    def _select(self, key, time_key, pulses, variables):
+        if key == time_key:
+            return True
+        pulse, var = self._split(key)
+
+        return (variables is None or var in variables) and \
+            (pulses is None or pulse is None or pulse in pulses)
+
+    def load(self, name, pulses=None, variables=None):
+        """
+        Returns the log saved under ``name`` as a :class:`myokit.DataLog`,
+        with only the given ``pulses`` and ``variables`` if given. Pulses
+        keep their index, so that ``log['membrane.V', 5]`` is pulse 5 even if
+        only some pulses are loaded.
+        """
+        if pulses is not None:
+            pulses = set(pulses)
+        path = self.path(name)
+        log = myokit.DataLog()
+
+        if not os.path.isfile(path):
+            csv = myokit.DataLog.load_csv(
+                os.path.join(self.directory, name + '.csv')).npview()
+            log.set_time_key(csv.time_key())
+            for key, value in csv.items():
+                if self._select(key, csv.time_key(), pulses, variables):
+                    log[key] = value
+            return log
+
+        with np.load(path) as data:
+            time_key = json.loads(str(data['metadata']))['time_key']
+            log.set_time_key(time_key)
+            for key in data.files:
+                if key == 'metadata' or \
+                        not self._select(key, time_key, pulses, variables):
+                    continue
+                value = None
+                if not self.compress:
+                    value = self._memmap(path, key + '.npy')
+                log[key] = data[key] if value is None else value
+
+        return log
@@ -32,6 +32,7 @@ data_dir = root_dir + drug + '/' + protocol_name + '/'
 if not os.path.isdir(data_dir):
     os.makedirs(data_dir)
 result_filename = 'Hill_curve.txt'
+trace_store = modelling.TraceStore(data_dir)
 
 # Load IKr model
 model = '../math_model/ohara-cipa-v1-2017-IKr-opt.mmt'
@@ -48,6 +49,9 @@ AP_model = modelling.BindingKinetics(APmodel, current_head='ikr')
 # Set up current protocol
 pulse_time = 1000
 AP_model.protocol = modelling.ProtocolLibrary().current_impulse(pulse_time)
+# Reuse steady states computed by previous runs and other scripts
+AP_model.steady_state_cache = modelling.SteadyStateCache(
+    '../simulation_data/steady_states.db')
 base_conductance = APmodel.get('ikr.gKr').value()
 
 # Load Hill curve parameters or compute them if not previously done
@@ -69,13 +73,11 @@ offset = 50
 repeats = 7
 save_signal = repeats
 
-# Get steady state AP for control condition
-if not os.path.isfile(root_dir + 'steady_state_control.csv'):
-    control_log = AP_model.drug_simulation(drug, 0, 1000)
-    control_log.save_csv(root_dir + 'steady_state_control.csv')
-else:
-    control_log = myokit.DataLog.load_csv(root_dir +
-                                          'steady_state_control.csv')
+# Get steady state AP for control condition, pre-paced from the cache
+control_log = AP_model.drug_simulation(drug, 0, 1000)
+modelling.TraceStore(root_dir).save(
+    'steady_state_control', control_log, drug=drug, drug_conc=0,
+    model='AP-SD', protocol='current_impulse')
 
 # Simulate AP after adding drugs for both the AP-SD model and the AP-CS model
 # Repeated for 7 pulses
@@ -88,8 +90,10 @@ for i in range(len(drug_conc)):
         drug, drug_conc[i], repeats, save_signal=save_signal,
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'],
         set_state=control_log)
-    log.save_csv(data_dir + 'SD_AP_transient_pulses' + str(repeats) +
-                 '_conc' + str(drug_conc[i]) + '_paced.csv')
+    trace_store.save('SD_AP_transient_pulses' + str(repeats) + '_conc' +
+                     str(drug_conc[i]) + '_paced', log, drug=drug,
+                     drug_conc=drug_conc[i], model='AP-SD',
+                     protocol=protocol_name)
 
     reduction_scale = Hill_model.simulate(estimates[:2], drug_conc[i])
     d2 = AP_model.conductance_simulation(
@@ -97,8 +101,10 @@ for i in range(len(drug_conc)):
         save_signal=save_signal,
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'],
         set_state=control_log)
-    d2.save_csv(data_dir + 'CS_AP_transient_pulses' + str(repeats) +
-                '_conc' + str(drug_conc[i]) + '_paced.csv')
+    trace_store.save('CS_AP_transient_pulses' + str(repeats) + '_conc' +
+                     str(drug_conc[i]) + '_paced', d2, drug=drug,
+                     drug_conc=drug_conc[i], model='AP-CS',
+                     protocol=protocol_name)
 
 # Remove drug free condition
 drug_conc = drug_conc[1:]
@@ -118,10 +124,8 @@ for i in range(len(drug_conc)):
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'],
         set_state=control_log)
 
-    APD_trapping_pulse = []
-    for pulse in range(save_signal):
-        apd90 = AP_model.APD90(log['membrane.V', pulse], offset, 0.1)
-        APD_trapping_pulse.append(apd90)
+    APD_trapping_pulse = list(AP_model.APD90(
+        modelling.pulse_array(log, 'membrane.V'), offset, 0.1))
 
     APD_trapping.append(APD_trapping_pulse)
 
@@ -132,11 +136,8 @@ for i in range(len(drug_conc)):
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'],
         set_state=control_log)
 
-    APD_conductance_pulse = []
-
-    for pulse in range(save_signal):
-        apd90 = AP_model.APD90(d2['membrane.V', pulse], offset, 0.1)
-        APD_conductance_pulse.append(apd90)
+    APD_conductance_pulse = list(AP_model.APD90(
+        modelling.pulse_array(d2, 'membrane.V'), offset, 0.1))
 
     APD_conductance.append(APD_conductance_pulse)
 
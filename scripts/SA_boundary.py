@@ -0,0 +1,101 @@
+#
+# Trace the boundary surface where the RMSD between the APD90s of the AP-SD
+# model and the AP-CS model crosses 30 ms, by finding the Ku at which it does
+# for each combination of the drug-related parameters Vhalf and Kmax.
+#
+
+import numpy as np
+import os
+import pandas as pd
+import time
+
+import modelling
+
+# Define directory to save simulation data
+data_dir = '../simulation_data/parameter_space_exploration/SA_boundary/'
+
+# Define constants for simulations
+APD_points = 20
+error_range = 30
+n_workers = 8
+
+# Get name of parameters
+SA_model = modelling.SensitivityAnalysis()
+param_names = SA_model.param_names
+
+
+def evaluate(points, executor, results, done_RMSE, sampler):
+    # Evaluate the RMSD of the virtual drugs at the given points in parallel,
+    # reusing the RMSD of the points evaluated before
+    points = [tuple(p) for p in points]
+    new_points = [p for p in dict.fromkeys(points) if p not in done_RMSE]
+    param_space = sampler.design(new_points, ['Vhalf', 'Kmax', 'Ku'])
+    sampler.start_id += len(param_space)
+
+    big_df = []
+    for _, result in executor.imap(param_space):
+        values = result.loc['param_values']
+        done_RMSE[(values.loc['Vhalf'].values[0], values.loc['Kmax'].values[0],
+                   values.loc['Ku'].values[0])] = \
+            result.loc[('RMSE', 'RMSE')].values[0]
+        big_df.append(result)
+    results.append(big_df)
+
+    return [done_RMSE[p] for p in points]
+
+
+if __name__ == '__main__':
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    # Set up the models and the APD90s of the AP-CS model before starting
+    # the workers, which share them
+    current_model, AP_model, APD_table = SA_model.comparison_models()
+
+    # Define the (Vhalf, Kmax) grid over which the boundary surface is
+    # traced, and the range of Ku searched
+    Vhalf_fullrange = SA_model.param_explore_uniform('Vhalf')
+    Kmax_fullrange = SA_model.param_explore_uniform('Kmax')
+    Ku_fullrange = np.log10(sorted(SA_model.param_explore_uniform('Ku')))
+    Ku_gap = Ku_fullrange[1] - Ku_fullrange[0]
+    Ku_bounds = (10**(Ku_fullrange[0] - 2 * Ku_gap), 10**Ku_fullrange[-1])
+
+    # Assuming drug concentration are all normalised, the EC50 value in the
+    # model becomes 1.
+    # Since Hill coefficient, N, does not affect APD difference behaviour, it
+    # can be fixed at any value.
+    # For simplicity, let N = 1.
+
+    # Save the results of every virtual drug evaluated while tracing, and
+    # reuse those of previous runs, as the same points are traced again
+    results = modelling.ResultsStore(
+        data_dir, 'SA_boundary', param_names,
+        version=modelling.BiomarkerTracker.version)
+    done_df = results.load(columns=['param_id', 'param_values', 'RMSE'])
+    done_RMSE = dict(zip(
+        map(tuple, done_df['param_values'][['Vhalf', 'Kmax', 'Ku']].values),
+        done_df['RMSE']['RMSE'].values))
+    sampler = modelling.ParameterSampler(
+        param_names, fixed={'N': 1, 'EC50': 1},
+        start_id=int(done_df['param_id']['param_id'].max()) + 1
+        if len(done_df) else 20000)
+
+    current_time = time.strftime("%H:%M:%S", time.localtime())
+    print('Starting time: ', current_time)
+    with modelling.SweepExecutor(
+            SA_model.sample_evaluation, n_workers=n_workers,
+            args=[current_model, AP_model, APD_table,
+                  APD_points]) as executor:
+        Vhalf_mesh, Kmax_mesh, Ku_mesh = SA_model.boundary_trace(
+            lambda points: evaluate(points, executor, results, done_RMSE,
+                                    sampler),
+            Vhalf_fullrange, Kmax_fullrange, Ku_bounds=Ku_bounds,
+            threshold=error_range)
+    results.compact()
+
+    # Save the boundary surface
+    boundary_df = pd.DataFrame({'Vhalf': Vhalf_mesh.ravel(),
+                                'Kmax': Kmax_mesh.ravel(),
+                                'Ku': Ku_mesh.ravel()})
+    boundary_df.to_csv(data_dir + 'boundary_surface.csv')
+    print('Evaluated ', len(done_RMSE), ' virtual drugs')
@@ -25,11 +25,17 @@ drug_model.protocol = protocol
 # Load AP model and set current protocol
 APmodel = '../math_model/ohara-cipa-v1-2017-opt.mmt'
 APmodel, _, x = myokit.load(APmodel)
-AP_model = modelling.BindingKinetics(APmodel, current_head='ikr')
+AP_model = modelling.BindingKinetics(APmodel, current_head='ikr',
+                                     steady_state_method='shooting')
 pulse_time = 1000
 AP_model.protocol = modelling.ProtocolLibrary().current_impulse(pulse_time)
 base_conductance = APmodel.get('ikr.gKr').value()
 
+# Look up the APD90s of the AP-CS model instead of simulating them
+APD_table = modelling.APDTable(AP_model,
+                               directory='../simulation_data/APD_tables/')
+APD_table.build()
+
 # Define constants for simulations
 offset = 50
 save_signal = 2
@@ -61,7 +67,8 @@ def param_evaluation(param_values, drug):
     Hill_curve_coefs, drug_conc_Hill, peaks_norm = \
         ComparisonController.compute_Hill(drug_model,
                                           norm_constant=norm_constant,
-                                          parallel=False)
+                                          parallel=False,
+                                          Hill_method='least_squares')
     # The parameters of Hill curve are based on the normalised drug
     # concentration.
     # Hill coefficient remains the same but IC50 -> IC50/EC50
@@ -83,7 +90,7 @@ def param_evaluation(param_values, drug):
         APD_trapping, APD_conductance, drug_conc_AP = \
             ComparisonController.APD_sim(
                 AP_model, Hill_curve_coefs, drug_conc=drug_conc_AP,
-                EAD=True)
+                EAD=True, parallel=True, APD_table=APD_table)
 
         # Calculate RMSD and MD of simulated APD90 of the two models
         RMSError = ComparisonController.compute_RMSE(APD_trapping,
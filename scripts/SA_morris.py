@@ -0,0 +1,134 @@
+#
+# Morris screening of the APD90 and the qNet of the AP-SD model with the
+# conductances of several ion channels scaled, and of the RMSD between the
+# APD90s of the AP-SD model and the AP-CS model, over the drug-related
+# parameters (Vhalf, Kmax, Ku, N and EC50) and the conductance scales of the
+# ion channels.
+#
+
+import numpy as np
+import os
+import pandas as pd
+import time
+
+import modelling
+
+# Define directory to save simulation data
+data_dir = '../simulation_data/parameter_space_exploration/SA_morris/'
+
+# Define constants for simulations
+save_signal = 2
+repeats = 1000
+APD_points = 20
+qNet_currents = ['inal.INaL', 'ical.ICaL', 'ikr.IKr', 'iks.IKs', 'ik1.IK1',
+                 'ito.Ito']
+n_workers = 8
+
+# Define the parameter space, with Kmax, Ku and EC50 on a log scale and the
+# conductances of the ion channels scaled between half and one and a half,
+# and the number of trajectories
+SA_model = modelling.SensitivityAnalysis()
+param_names = SA_model.param_names
+problem = SA_model.morris_problem()
+n_trajectories = 64
+num_levels = 4
+outputs = ['APD90', 'qNet', 'RMSD']
+
+# The APD90 and qNet are computed at the geometric mean of the range of EC50
+EC50_bounds = problem['bounds'][problem['names'].index('EC50')]
+drug_conc = 10**np.mean(EC50_bounds)
+
+
+def trajectory_evaluation(task, current_model, AP_model, APD_table):
+
+    # Compute the RMSD between the APD90s of the AP-SD model and the AP-CS
+    # model of the binding parameters of a point
+    def RMSD_evaluation(param_values):
+        result = SA_model.sample_evaluation(
+            param_values, current_model, AP_model, APD_table=APD_table,
+            APD_points=APD_points)
+        return result.loc[('RMSE', 'RMSE')].values[0]
+
+    # Simulate the points of a trajectory in order, each starting from the
+    # steady state of the previous one
+    trajectory_id, trajectory = task
+    result = SA_model.morris_trajectory(
+        trajectory, AP_model, drug_conc, repeats, qNet_currents,
+        RMSD=RMSD_evaluation, save_signal=save_signal)
+    result.insert(0, 'point', np.arange(len(result.index)))
+    result.insert(0, 'trajectory_id', trajectory_id)
+
+    return pd.concat([result, trajectory.reset_index(drop=True)], axis=1)
+
+
+def save_indices(results, design):
+    # Compute the Morris indices from the trajectories completed so far
+    values = results.set_index(['trajectory_id', 'point']).reindex(
+        pd.MultiIndex.from_product([range(n_trajectories),
+                                    range(problem['num_vars'] + 1)]))
+    for output in outputs:
+        indices, n_complete = SA_model.morris_indices(
+            problem, design, values[output].values, num_levels=num_levels,
+            seed=0)
+        print(output, ': ', n_complete, ' of ', n_trajectories,
+              ' trajectories')
+        if indices is not None:
+            print(indices)
+            indices.to_csv(data_dir + 'Morris_indices_' + output + '.csv')
+
+
+if __name__ == '__main__':
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    # Set up the models and the APD90s of the AP-CS model before starting
+    # the workers, which share them
+    current_model, AP_model, APD_table = SA_model.comparison_models()
+
+    # Save the Morris trajectories or load previously saved trajectories, so
+    # that the same design is completed when resuming
+    sample_filepath = data_dir + 'Morris_samples.csv'
+    design_filepath = data_dir + 'Morris_design.csv'
+    if os.path.exists(sample_filepath):
+        samples_df = pd.read_csv(sample_filepath, index_col=[0])
+        trajectories = [samples_df.loc[samples_df['trajectory_id'] == i,
+                                       problem['names']]
+                        for i in range(n_trajectories)]
+        design = pd.read_csv(design_filepath, index_col=[0]).values
+    else:
+        trajectories, design = SA_model.morris_samples(
+            problem, n_trajectories, num_levels=num_levels, seed=0)
+        samples_df = pd.concat(trajectories, keys=range(n_trajectories),
+                               names=['trajectory_id', 'point']).reset_index(
+            level='trajectory_id').reset_index(drop=True)
+        samples_df.to_csv(sample_filepath)
+        pd.DataFrame(design, columns=problem['names']).to_csv(
+            design_filepath)
+
+    # Determine completed trajectories so that they are not repeated
+    results_filepath = data_dir + 'Morris_results.csv'
+    if os.path.exists(results_filepath):
+        results = pd.read_csv(results_filepath, index_col=[0])
+    else:
+        results = pd.DataFrame()
+    completed = set(results['trajectory_id']) if len(results.index) \
+        else set()
+    tasks = [(i, trajectories[i]) for i in range(n_trajectories)
+             if i not in completed]
+
+    # Evaluate the trajectories with long-lived workers, one trajectory per
+    # task so that the warm starts are kept, saving the results and updating
+    # the Morris indices as they arrive
+    print('Running ', len(tasks), ' trajectories')
+    current_time = time.strftime("%H:%M:%S", time.localtime())
+    print('Starting time: ', current_time)
+    with modelling.SweepExecutor(
+            trajectory_evaluation, n_workers=n_workers,
+            args=[current_model, AP_model, APD_table]) as executor:
+        for _, result in executor.imap(tasks):
+            results = pd.concat([results, result], ignore_index=True)
+            results.to_csv(results_filepath)
+            save_indices(results, design)
+
+    current_time = time.strftime("%H:%M:%S", time.localtime())
+    print('Ending time: ', current_time)
@@ -0,0 +1,95 @@
+#
+# Global sensitivity analysis of the RMSD and the MD between the APD90s of the
+# AP-SD model and the AP-CS model to the drug-related parameters (Vhalf, Kmax,
+# Ku, N and EC50), with Sobol indices estimated from Saltelli samples.
+#
+
+import os
+import pandas as pd
+import time
+
+import modelling
+
+# Define directory to save simulation data
+data_dir = '../simulation_data/parameter_space_exploration/SA_sobol/'
+
+# Define constants for simulations
+APD_points = 20
+n_workers = 8
+save_every = 64
+
+# Get name of parameters
+SA_model = modelling.SensitivityAnalysis()
+param_names = SA_model.param_names
+
+# Define the parameter space, with Kmax, Ku and EC50 on a log scale, and the
+# number of base samples of the Saltelli design
+problem = SA_model.sobol_problem()
+n_base = 256
+
+
+def save_indices(results, design_ids):
+    # Compute the Sobol indices from the samples completed so far
+    done_df = results.load(columns=['param_id', 'RMSE', 'ME'])
+    for output in ['RMSE', 'ME']:
+        outputs = pd.Series(done_df[output][output].values,
+                            index=done_df['param_id']['param_id'].values)
+        indices, n_complete = SA_model.sobol_indices(problem, design_ids,
+                                                     outputs, seed=0)
+        print(output, ': ', n_complete, ' of ', n_base, ' base samples')
+        if indices is not None:
+            print(indices)
+            indices.to_csv(data_dir + 'Sobol_indices_' + output + '.csv')
+
+
+if __name__ == '__main__':
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    # Set up the models and the APD90s of the AP-CS model before starting
+    # the workers, which share them
+    current_model, AP_model, APD_table = SA_model.comparison_models()
+
+    # Save the Saltelli samples or load previously saved samples, so that
+    # the same design is completed when resuming
+    sample_filepath = data_dir + 'Sobol_samples.csv'
+    design_filepath = data_dir + 'Sobol_design.csv'
+    if os.path.exists(sample_filepath):
+        samples_df = pd.read_csv(sample_filepath, index_col=[0])
+        design_ids = pd.read_csv(design_filepath, index_col=[0])[
+            'param_id'].values
+    else:
+        samples_df, design_ids = SA_model.sobol_samples(problem, n_base,
+                                                        seed=0)
+        samples_df.to_csv(sample_filepath)
+        pd.DataFrame({'param_id': design_ids}).to_csv(design_filepath)
+
+    # Determine completed simulations so that they are not repeated.
+    # Repeated samples of the design are only evaluated once
+    results = modelling.ResultsStore(
+        data_dir, 'SA_sobol', param_names,
+        version=modelling.BiomarkerTracker.version)
+    completed = set(results.completed())
+    samples_df = samples_df.loc[~samples_df['param_id'].isin(completed)]
+    param_space = [samples_df.iloc[[i]].reset_index(drop=True)
+                   for i in range(len(samples_df.index))]
+
+    # Evaluate the samples with long-lived workers, saving the results and
+    # updating the Sobol indices as they arrive
+    print('Running ', len(param_space), ' samples')
+    current_time = time.strftime("%H:%M:%S", time.localtime())
+    print('Starting time: ', current_time)
+    big_df = []
+    with modelling.SweepExecutor(
+            SA_model.sample_evaluation, n_workers=n_workers,
+            args=[current_model, AP_model, APD_table,
+                  APD_points]) as executor:
+        for _, result in executor.imap(param_space):
+            big_df.append(result)
+            if len(big_df) == save_every:
+                results.append(big_df)
+                big_df = []
+                save_indices(results, design_ids)
+    results.append(big_df)
+    results.compact()
+    save_indices(results, design_ids)
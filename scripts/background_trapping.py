@@ -14,6 +14,7 @@ short_label = ['drug_free', 'dofetilide', 'verapamil']
 data_dir = '../simulation_data/background/'
 if not os.path.isdir(data_dir):
     os.makedirs(data_dir)
+trace_store = modelling.TraceStore(data_dir)
 
 # Simulating the SD model with Milnes' protocol for 10 pulses after addition
 # of example drug T (dofetilide-like drug) and example drug N (verapamil-like
@@ -38,7 +39,8 @@ rel_tol = 1e-8
 control_log = current_model.drug_simulation(drugs[0], 0, 1000, save_signal=10,
                                             abs_tol=abs_tol, rel_tol=rel_tol,
                                             protocol_period=pulse_time)
-control_log.save_csv(data_dir + 'control_Milnes_current_pulses10.csv')
+trace_store.save('control_Milnes_current_pulses10', control_log,
+                 drug=drugs[0], drug_conc=0, model='SD', protocol='Milnes')
 
 # Simulate 10 pulses from steady state for control condition
 control_log_single = current_model.drug_simulation(
@@ -53,7 +55,9 @@ for i, conc_i in enumerate(drug_concs):
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'],
         set_state=control_log_single, abs_tol=abs_tol, rel_tol=rel_tol,
         protocol_period=pulse_time)
-    log.save_csv(data_dir + drugs[i] + '_Milnes_current_pulses10.csv')
+    trace_store.save(drugs[i] + '_Milnes_current_pulses10', log,
+                     drug=drugs[i], drug_conc=conc_i, model='SD',
+                     protocol='Milnes')
 
 # Simulating the SD model with Milnes' protocol for 1000 pulses till steady
 # state under drug free, addition of example drug T and example drug N
@@ -63,13 +67,16 @@ for i, conc_i in enumerate(drug_concs):
 repeats = 1000
 log_control = current_model.drug_simulation(drugs[0], 0, repeats,
                                             abs_tol=abs_tol, rel_tol=rel_tol)
-log_control.save_csv(data_dir + short_label[0] + '_Milnes_current.csv')
+trace_store.save(short_label[0] + '_Milnes_current', log_control,
+                 drug=drugs[0], drug_conc=0, model='SD', protocol='Milnes')
 
 # Simulate the SD model under addition of drugs
 for d in range(len(drugs)):
     log = current_model.drug_simulation(drugs[d], drug_concs[d], repeats,
                                         abs_tol=abs_tol, rel_tol=rel_tol)
-    log.save_csv(data_dir + short_label[d + 1] + '_Milnes_current.csv')
+    trace_store.save(short_label[d + 1] + '_Milnes_current', log,
+                     drug=drugs[d], drug_conc=drug_concs[d], model='SD',
+                     protocol='Milnes')
 
 # Simulating the SD model with AP clamp protocol for 1000 pulses till steady
 # state under drug free, addition of example drug T and example drug N
@@ -88,7 +95,8 @@ AP_model.protocol = protocol
 # Simulate AP for AP clamp protocol
 APclamp = AP_model.drug_simulation(drugs[1], drug_concs[1], repeats,
                                    abs_tol=abs_tol, rel_tol=rel_tol)
-APclamp.save_csv(data_dir + 'APclamp.csv')
+trace_store.save('APclamp', APclamp, drug=drugs[1], drug_conc=drug_concs[1],
+                 model='AP-SD', protocol='current_impulse')
 
 # Set up AP clamp protocol
 times = APclamp['engine.time']
@@ -99,11 +107,14 @@ tmax = times[-1] + 1
 log_control = current_model.drug_APclamp(drugs[0], 0, times, voltages,
                                          tmax, repeats, abs_tol=abs_tol,
                                          rel_tol=rel_tol)
-log_control.save_csv(data_dir + short_label[0] + '_APclamp_current.csv')
+trace_store.save(short_label[0] + '_APclamp_current', log_control,
+                 drug=drugs[0], drug_conc=0, model='SD', protocol='APclamp')
 
 # Simulate the SD model under addition of drugs
 for d in range(len(drugs)):
     log = current_model.drug_APclamp(drugs[d], drug_concs[d], times,
                                      voltages, tmax, repeats, abs_tol=abs_tol,
                                      rel_tol=rel_tol)
-    log.save_csv(data_dir + short_label[d + 1] + '_APclamp_current.csv')
+    trace_store.save(short_label[d + 1] + '_APclamp_current', log,
+                     drug=drugs[d], drug_conc=drug_concs[d], model='SD',
+                     protocol='APclamp')
@@ -39,6 +39,7 @@ data_dir = '../simulation_data/model_comparison/' + \
 if not os.path.isdir(data_dir):
     os.makedirs(data_dir)
 result_filename = 'Hill_curve.txt'
+trace_store = modelling.TraceStore(data_dir)
 
 # Load IKr model
 model = '../math_model/ohara-cipa-v1-2017-IKr-opt.mmt'
@@ -62,7 +63,9 @@ for i in range(len(drug_conc)):
     peak, _ = current_model.extract_peak(log, 'ikr.IKr')
     peaks.append(peak[-1])
 
-    log.save_csv(data_dir + 'SD_current_' + str(drug_conc[i]) + '.csv')
+    trace_store.save('SD_current_' + str(drug_conc[i]), log, drug=drug,
+                     drug_conc=drug_conc[i], model='SD',
+                     protocol=protocol_name)
 
 # Normalise drug response (peak current)
 peaks = (peaks - min(peaks)) / (max(peaks) - min(peaks))
@@ -90,7 +93,9 @@ for i in range(len(drug_conc)):
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'],
         abs_tol=abs_tol, rel_tol=rel_tol)
 
-    d2.save_csv(data_dir + 'CS_current_' + str(drug_conc[i]) + '.csv')
+    trace_store.save('CS_current_' + str(drug_conc[i]), d2, drug=drug,
+                     drug_conc=drug_conc[i], model='CS',
+                     protocol=protocol_name)
 
 #
 # Propagate to action potential
@@ -99,11 +104,15 @@ for i in range(len(drug_conc)):
 # Set AP model
 APmodel = '../math_model/ohara-cipa-v1-2017-opt.mmt'
 APmodel, _, x = myokit.load(APmodel)
-AP_model = modelling.BindingKinetics(APmodel, current_head='ikr')
+AP_model = modelling.BindingKinetics(APmodel, current_head='ikr',
+                                     steady_state_method='converge')
 
 # Define current protocol
 pulse_time = 1000
 AP_model.protocol = modelling.ProtocolLibrary().current_impulse(pulse_time)
+# Reuse steady states computed by previous runs and other scripts
+AP_model.steady_state_cache = modelling.SteadyStateCache(
+    '../simulation_data/steady_states.db')
 base_conductance = APmodel.get('ikr.gKr').value()
 
 offset = 50
@@ -123,19 +132,25 @@ APD_conductance = []
 APD_trapping = []
 
 # Simulate AP of the AP-SD model and the AP-CS model
+# Each concentration starts from the steady state of the previous one
 # Compute APD90
+state_SD = state_CS = None
+start_states_SD = []
+start_states_CS = []
 for i in range(len(drug_conc)):
     print('simulating concentration: ' + str(drug_conc[i]))
     log = AP_model.drug_simulation(
         drug, drug_conc[i], repeats_SD, save_signal=save_signal,
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'], abs_tol=abs_tol,
-        rel_tol=rel_tol)
-    log.save_csv(data_dir + 'SD_AP_' + str(drug_conc[i]) + '.csv')
+        rel_tol=rel_tol, set_state=state_SD)
+    state_SD = AP_model.prepace_state
+    start_states_SD.append(AP_model.start_state)
+    trace_store.save('SD_AP_' + str(drug_conc[i]), log, drug=drug,
+                     drug_conc=drug_conc[i], model='AP-SD',
+                     protocol=protocol_name)
 
-    APD_trapping_pulse = []
-    for pulse in range(save_signal):
-        apd90 = AP_model.APD90(log['membrane.V', pulse], offset, 0.1)
-        APD_trapping_pulse.append(apd90)
+    APD_trapping_pulse = list(AP_model.APD90(
+        modelling.pulse_array(log, 'membrane.V'), offset, 0.1))
 
     AP_trapping.append(log)
     APD_trapping.append(APD_trapping_pulse)
@@ -145,13 +160,15 @@ for i in range(len(drug_conc)):
         base_conductance * reduction_scale, repeats_CS,
         save_signal=save_signal,
         log_var=['engine.time', 'membrane.V', 'ikr.IKr'], abs_tol=abs_tol,
-        rel_tol=rel_tol)
-    d2.save_csv(data_dir + 'CS_AP_' + str(drug_conc[i]) + '.csv')
+        rel_tol=rel_tol, set_state=state_CS)
+    state_CS = AP_model.prepace_state
+    start_states_CS.append(AP_model.start_state)
+    trace_store.save('CS_AP_' + str(drug_conc[i]), d2, drug=drug,
+                     drug_conc=drug_conc[i], model='AP-CS',
+                     protocol=protocol_name)
 
-    APD_conductance_pulse = []
-    for pulse in range(save_signal):
-        apd90 = AP_model.APD90(d2['membrane.V', pulse], offset, 0.1)
-        APD_conductance_pulse.append(apd90)
+    APD_conductance_pulse = list(AP_model.APD90(
+        modelling.pulse_array(d2, 'membrane.V'), offset, 0.1))
 
     AP_conductance.append(d2)
     APD_conductance.append(APD_conductance_pulse)
@@ -169,6 +186,14 @@ APD_conductance_df['drug concentration'] = drug_conc
 APD_conductance_df.to_csv(data_dir + 'CS_APD_pulses' +
                           str(int(save_signal)) + '.csv')
 
+# Save the starting state of each simulation
+start_states_df = pd.DataFrame(start_states_SD)
+start_states_df['drug concentration'] = drug_conc
+start_states_df.to_csv(data_dir + 'SD_start_states.csv')
+start_states_df = pd.DataFrame(start_states_CS)
+start_states_df['drug concentration'] = drug_conc
+start_states_df.to_csv(data_dir + 'CS_start_states.csv')
+
 # Define drug concentration range for steady state APD90 comparison between
 # models
 drug_conc = drug_conc_lib.drug_concentrations[drug]['fine']
@@ -178,38 +203,32 @@ save_signal = 2
 APD_conductance = []
 APD_trapping = []
 
+# Look up the APD90s of the AP-CS model instead of simulating them
+APD_table = modelling.APDTable(
+    AP_model, steady_state_pulse=repeats, save_signal=save_signal,
+    abs_tol=abs_tol, rel_tol=rel_tol,
+    directory='../simulation_data/APD_tables/')
+
+state_SD = None
+start_states_SD = []
 for i in range(len(drug_conc)):
     print('simulating concentration: ' + str(drug_conc[i]))
 
-    # Run simulation for the AP-SD model till steady state
-    log = AP_model.drug_simulation(
+    # Run simulation for the AP-SD model till steady state, starting from
+    # the steady state of the previous concentration, tracking the APD90s
+    # during the simulation
+    biomarkers = AP_model.drug_simulation(
         drug, drug_conc[i], repeats, save_signal=save_signal,
-        log_var=['engine.time', 'membrane.V', 'ikr.IKr'], abs_tol=abs_tol,
-        rel_tol=rel_tol)
+        abs_tol=abs_tol, rel_tol=rel_tol, set_state=state_SD,
+        biomarkers=True)
+    state_SD = AP_model.prepace_state
+    start_states_SD.append(AP_model.start_state)
 
-    # Compute APD90 of simulated AP
-    APD_trapping_pulse = []
-    for pulse in range(save_signal):
-        apd90 = AP_model.APD90(log['membrane.V', pulse], offset, 0.1)
-        APD_trapping_pulse.append(apd90)
-
-    APD_trapping.append(APD_trapping_pulse)
+    APD_trapping.append(list(biomarkers['APD90']))
 
-    # Run simulation for the AP-CS model till steady state
+    # Compute APD90 of the AP-CS model at steady state from the APD table
     reduction_scale = Hill_model.simulate(estimates[:2], drug_conc[i])
-    d2 = AP_model.conductance_simulation(
-        base_conductance * reduction_scale, repeats,
-        save_signal=save_signal,
-        log_var=['engine.time', 'membrane.V', 'ikr.IKr'], abs_tol=abs_tol,
-        rel_tol=rel_tol)
-
-    # Compute APD90 of simulated AP
-    APD_conductance_pulse = []
-    for pulse in range(save_signal):
-        apd90 = AP_model.APD90(d2['membrane.V', pulse], offset, 0.1)
-        APD_conductance_pulse.append(apd90)
-
-    APD_conductance.append(APD_conductance_pulse)
+    APD_conductance.append(list(APD_table(reduction_scale)))
 
     print('done concentration: ' + str(drug_conc[i]))
 
@@ -224,3 +243,6 @@ APD_trapping_df.to_csv(data_dir + 'SD_APD_fine.csv')
 APD_conductance_df = pd.DataFrame(np.array(APD_conductance), columns=['APD'])
 APD_conductance_df['drug concentration'] = drug_conc
 APD_conductance_df.to_csv(data_dir + 'CS_APD_fine.csv')
+start_states_df = pd.DataFrame(start_states_SD)
+start_states_df['drug concentration'] = drug_conc
+start_states_df.to_csv(data_dir + 'SD_start_states_fine.csv')
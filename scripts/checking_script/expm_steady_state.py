@@ -0,0 +1,58 @@
+#
+# Checks the direct periodic steady state of the IKr model under Milnes'
+# protocol for all synthetic drugs, at their EC50: the solver must not
+# overflow, the number of pulses must be finite, and pacing for that many
+# pulses (and a hundred times more) must stay on the steady state.
+#
+
+import numpy as np
+import warnings
+
+import myokit
+
+import modelling
+
+# Turn overflow and invalid-value warnings into errors
+warnings.simplefilter('error', RuntimeWarning)
+
+# Load the hERG model with the matrix exponential engine
+model = myokit.load_model('../../math_model/ohara-cipa-v1-2017-IKr-opt.mmt')
+current_model = modelling.BindingKinetics(model, engine='expm')
+protocol_params = modelling.ProtocolParameters()
+current_model.protocol = \
+    protocol_params.protocol_parameters['Milnes']['function']
+
+tol = 1e-8
+param_lib = modelling.BindingParameters()
+param_names = ['Vhalf', 'Kmax', 'Ku', 'N', 'EC50']
+failed = []
+for drug in param_lib.drug_compounds:
+    params = param_lib.binding_parameters[drug]
+    drug_conc = np.power(params['EC50'], 1 / params['N'])
+
+    state, beats = current_model.steady_state(drug, drug_conc, tol=tol)
+
+    # Pace the model from the same initial state
+    sim = current_model.simulation(current_model._drug_constants(
+        *[params[p] for p in param_names]),
+        protocol=current_model.protocol)
+    initial = sim.state()
+    initial[model.get('ikr.D').index()] = drug_conc
+    sim.set_state(initial)
+    period = sim.protocol_period()
+    errors = []
+    if np.isfinite(beats):
+        paced = 0
+        for n in [beats, 100 * max(beats, 1)]:
+            sim.pre(period * (n - paced))
+            paced = n
+            errors.append(np.max(np.abs(np.array(sim.state()) -
+                                        np.array(state))))
+
+    print(drug, ': ', beats, ' pulses, errors after pacing ', errors)
+    if not np.isfinite(beats) or max(errors) > tol:
+        failed.append(drug)
+
+if failed:
+    raise RuntimeError('Steady state check failed for ' + ', '.join(failed))
+print('Steady states of all drugs are consistent with pacing')
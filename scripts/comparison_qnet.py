@@ -17,11 +17,15 @@ current_list = ['inal.INaL', 'ical.ICaL', 'ikr.IKr', 'iks.IKs', 'ik1.IK1',
 # Set up AP model
 APmodel = '../math_model/ohara-cipa-v1-2017-opt.mmt'
 APmodel, _, x = myokit.load(APmodel)
-AP_model = modelling.BindingKinetics(APmodel, current_head='ikr')
+AP_model = modelling.BindingKinetics(APmodel, current_head='ikr',
+                                     steady_state_method='converge')
 
 # Define current protocol
 pulse_time = 2000
 AP_model.protocol = myokit.pacing.blocktrain(pulse_time, 0.5)
+# Reuse steady states computed by previous runs and other scripts
+AP_model.steady_state_cache = modelling.SteadyStateCache(
+    '../simulation_data/steady_states.db')
 base_conductance = APmodel.get('ikr.gKr').value()
 prepace = 1000
 
@@ -35,6 +39,9 @@ control_log = AP_model.conductance_simulation(
     base_conductance, prepace, timestep=0.01, abs_tol=abs_tol,
     rel_tol=rel_tol)
 
+# Integrate I_net over the simulated pulse with the solver itself
+AP_model.accumulators = {'qNet': ' + '.join(current_list)}
+
 # Define drugs
 param_lib = modelling.BindingParameters()
 drug_list = param_lib.drug_compounds[:-1]
@@ -60,35 +67,33 @@ for drug in drug_list:
     # Simulate AP after addition of example drugs for the AP-SD model and
     # AP-CS model
     # Compute I_net and qNet for each condition
+    # Each concentration starts from the steady state of the previous one
     qNet_SD_arr = []
     qNet_CS_arr = []
+    state_SD = state_CS = control_log
+    start_states_SD = []
+    start_states_CS = []
     for i in range(len(drug_conc)):
         print('simulating concentration: ' + str(drug_conc[i]))
-        log = AP_model.drug_simulation(
+        AP_model.drug_simulation(
             drug, drug_conc[i], prepace + save_signal,
-            log_var=['engine.time', 'membrane.V'] + current_list,
-            timestep=0.01, abs_tol=abs_tol, rel_tol=rel_tol,
-            set_state=control_log)
-
-        inet = 0
-        for c in current_list:
-            inet += log[c]  # pA/pF
+            log_var=myokit.LOG_NONE, abs_tol=abs_tol, rel_tol=rel_tol,
+            set_state=state_SD)
+        state_SD = AP_model.prepace_state
+        start_states_SD.append(AP_model.start_state)
 
-        qNet = np.trapz(inet, x=log.time()) * 1e-3  # pA/pF*s
+        qNet = AP_model.accumulated['qNet'][-1] * 1e-3  # pA/pF*s
         qNet_SD_arr.append(qNet)
 
         reduction_scale = Hill_model.simulate(Hill_coefs[:2], drug_conc[i])
-        d2 = AP_model.conductance_simulation(
+        AP_model.conductance_simulation(
             base_conductance * reduction_scale, prepace + save_signal,
-            save_signal=save_signal, timestep=0.01,
-            log_var=['engine.time', 'membrane.V'] + current_list,
-            abs_tol=abs_tol, rel_tol=rel_tol, set_state=control_log)
-
-        inet = 0
-        for c in current_list:
-            inet += d2[c]  # pA/pF
+            save_signal=save_signal, log_var=myokit.LOG_NONE,
+            abs_tol=abs_tol, rel_tol=rel_tol, set_state=state_CS)
+        state_CS = AP_model.prepace_state
+        start_states_CS.append(AP_model.start_state)
 
-        qNet = np.trapz(inet, x=d2.time()) * 1e-3  # pA/pF*s
+        qNet = AP_model.accumulated['qNet'][-1] * 1e-3  # pA/pF*s
         qNet_CS_arr.append(qNet)
 
         print('done concentration: ' + str(drug_conc[i]))
@@ -97,3 +102,9 @@ for drug in drug_list:
     qNet_data = {'drug_conc': drug_conc, 'SD': qNet_SD_arr, 'CS': qNet_CS_arr}
     qNet_df = pd.DataFrame(data=qNet_data)
     qNet_df.to_csv(data_dir + 'qNets.csv')
+    start_states_df = pd.DataFrame(start_states_SD)
+    start_states_df['drug concentration'] = drug_conc
+    start_states_df.to_csv(data_dir + 'qNet_SD_start_states.csv')
+    start_states_df = pd.DataFrame(start_states_CS)
+    start_states_df['drug concentration'] = drug_conc
+    start_states_df.to_csv(data_dir + 'qNet_CS_start_states.csv')
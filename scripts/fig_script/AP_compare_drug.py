@@ -7,7 +7,6 @@
 #
 
 import matplotlib
-import myokit
 import numpy as np
 import os
 import pandas as pd
@@ -51,16 +50,15 @@ axs = [[[fig.fig.add_subplot(subgs[k][i, j]) for j in range(
 panel2 = axs[2]
 
 # Read files name of action potential data
-SD_data_files = [f for f in os.listdir(data_dir) if
-                 f.startswith('SD_AP_') and not
-                 f.startswith('SD_AP_tran')]
-CS_data_files = [f for f in os.listdir(data_dir) if
-                 f.startswith('CS_AP_') and not
-                 f.startswith('CS_AP_tran')]
-conc_label_SD = [fname[6:-4] for fname in SD_data_files]
-drug_conc_SD = [float(fname[6:-4]) for fname in SD_data_files]
-conc_label_CS = [fname[6:-4] for fname in CS_data_files]
-drug_conc_CS = [float(fname[6:-4]) for fname in CS_data_files]
+trace_store = modelling.TraceStore(data_dir)
+SD_data_files = [f for f in trace_store.names('SD_AP_') if
+                 not f.startswith('SD_AP_tran')]
+CS_data_files = [f for f in trace_store.names('CS_AP_') if
+                 not f.startswith('CS_AP_tran')]
+conc_label_SD = [fname[6:] for fname in SD_data_files]
+drug_conc_SD = [float(fname[6:]) for fname in SD_data_files]
+conc_label_CS = [fname[6:] for fname in CS_data_files]
+drug_conc_CS = [float(fname[6:]) for fname in CS_data_files]
 
 # Sort in increasing order of drug concentration
 sort_ind = [i[0] for i in sorted(enumerate(drug_conc_SD), key=lambda x:x[1])]
@@ -82,10 +80,8 @@ plotting_pulse_time = 1000 * 2
 trapping_AP_log = []
 conductance_AP_log = []
 for i in range(len(trapping_data_files)):
-    trapping_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + trapping_data_files[i]))
-    conductance_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + conductance_data_files[i]))
+    trapping_AP_log.append(trace_store.load(trapping_data_files[i]))
+    conductance_AP_log.append(trace_store.load(conductance_data_files[i]))
 
 APD_trapping = pd.read_csv(data_dir + 'SD_APD_pulses2.csv')
 APD_conductance = pd.read_csv(data_dir + 'CS_APD_pulses2.csv')
@@ -135,12 +131,10 @@ fig.sharey(['Voltage (mV)', 'Current (A/F)'],
 panel1 = axs[0]
 
 # Read files name of IKr data
-SD_data_files = [f for f in os.listdir(data_dir) if
-                 f.startswith('SD_current_')]
-CS_data_files = [f for f in os.listdir(data_dir) if
-                 f.startswith('CS_current_')]
-drug_conc_SD = [float(fname[11:-4]) for fname in SD_data_files]
-drug_conc_CS = [float(fname[11:-4]) for fname in CS_data_files]
+SD_data_files = trace_store.names('SD_current_')
+CS_data_files = trace_store.names('CS_current_')
+drug_conc_SD = [float(fname[11:]) for fname in SD_data_files]
+drug_conc_CS = [float(fname[11:]) for fname in CS_data_files]
 
 # Sort in increasing order of drug concentration
 sort_ind = [i[0] for i in sorted(enumerate(drug_conc_SD), key=lambda x:x[1])]
@@ -153,10 +147,8 @@ conductance_data_files = [CS_data_files[i] for i in sort_ind_CS]
 trapping_hERG_log = []
 conductance_hERG_log = []
 for i in range(len(trapping_data_files)):
-    trapping_hERG_log.append(myokit.DataLog.load_csv(
-        data_dir + trapping_data_files[i]))
-    conductance_hERG_log.append(myokit.DataLog.load_csv(
-        data_dir + conductance_data_files[i]))
+    trapping_hERG_log.append(trace_store.load(trapping_data_files[i]))
+    conductance_hERG_log.append(trace_store.load(conductance_data_files[i]))
 
 hERG_trapping_plot = [e for i, e in enumerate(trapping_hERG_log)
                       if i not in chosen_conc_ind]
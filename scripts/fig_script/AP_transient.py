@@ -7,9 +7,7 @@
 #
 
 import matplotlib
-import myokit
 import numpy as np
-import os
 import pandas as pd
 
 import modelling
@@ -34,7 +32,7 @@ axs = [[[fig.fig.add_subplot(subgs[k][i, j]) for j in range(
     subgridspecs[k][1])] for i in range(subgridspecs[k][0])] for
     k in range(len(subgs))]
 
-control_log = myokit.DataLog.load_csv(root_dir + 'steady_state_control.csv')
+control_log = modelling.TraceStore(root_dir).load('steady_state_control')
 
 # Read file names of action potential data for both AP models with
 # addition of example drug T
@@ -45,12 +43,11 @@ data_dir = root_dir + drug + '/' + protocol_name + '/'
 
 SD_fileprefix = 'SD_AP_transient_pulses7_conc'
 CS_fileprefix = 'CS_AP_transient_pulses7_conc'
-trapping_data_files = [f for f in os.listdir(data_dir) if
-                       f.startswith(SD_fileprefix)]
-conductance_data_files = [f for f in os.listdir(data_dir) if
-                          f.startswith(CS_fileprefix)]
-conc_label = [fname[len(SD_fileprefix):-10] for fname in trapping_data_files]
-drug_conc = [float(fname[len(SD_fileprefix):-10])
+trace_store = modelling.TraceStore(data_dir)
+trapping_data_files = trace_store.names(SD_fileprefix)
+conductance_data_files = trace_store.names(CS_fileprefix)
+conc_label = [fname[len(SD_fileprefix):-6] for fname in trapping_data_files]
+drug_conc = [float(fname[len(SD_fileprefix):-6])
              for fname in trapping_data_files]
 
 # Sort drug concentrations in increasing order
@@ -64,10 +61,8 @@ conc_label = [conc_label[i] for i in sort_ind]
 trapping_AP_log = []
 conductance_AP_log = []
 for i in range(len(trapping_data_files)):
-    trapping_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + trapping_data_files[i]))
-    conductance_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + conductance_data_files[i]))
+    trapping_AP_log.append(trace_store.load(trapping_data_files[i]))
+    conductance_AP_log.append(trace_store.load(conductance_data_files[i]))
 
 # Initiate constants and variables
 labels = [i + ' nM' for i in conc_label]
@@ -197,12 +192,11 @@ drug = 'verapamil'
 drug_label = 'N'
 data_dir = root_dir + drug + '/' + protocol_name + '/'
 
-trapping_data_files = [f for f in os.listdir(data_dir) if
-                       f.startswith(SD_fileprefix)]
-conductance_data_files = [f for f in os.listdir(data_dir) if
-                          f.startswith(CS_fileprefix)]
-conc_label = [fname[len(SD_fileprefix):-10] for fname in trapping_data_files]
-drug_conc = [float(fname[len(SD_fileprefix):-10])
+trace_store = modelling.TraceStore(data_dir)
+trapping_data_files = trace_store.names(SD_fileprefix)
+conductance_data_files = trace_store.names(CS_fileprefix)
+conc_label = [fname[len(SD_fileprefix):-6] for fname in trapping_data_files]
+drug_conc = [float(fname[len(SD_fileprefix):-6])
              for fname in trapping_data_files]
 
 # Sort drug concentration in increasing order
@@ -218,10 +212,8 @@ conc_label = [r"$10^{:d}$".format(int(np.log10(float(i)))) if float(i) >= 1e4
 trapping_AP_log = []
 conductance_AP_log = []
 for i in range(len(trapping_data_files)):
-    trapping_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + trapping_data_files[i]))
-    conductance_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + conductance_data_files[i]))
+    trapping_AP_log.append(trace_store.load(trapping_data_files[i]))
+    conductance_AP_log.append(trace_store.load(conductance_data_files[i]))
 
 # Initiate constants and variables
 labels = [i + ' nM' for i in conc_label]
@@ -50,30 +50,18 @@ Error_drug = np.array(RMSError_drug) * np.array(MError_drug) / \
 
 # Read simulated data of virtual drugs in the parameter space
 data_dir = root_dir + 'parameter_space_exploration/SA_space/'
-file_prefix = 'SA_allparam'
-result_files = [data_dir + f for f in os.listdir(data_dir)
-                if f.startswith(file_prefix)]
+results = modelling.ResultsStore(data_dir, 'SA_allparam', param_names)
 
 # Define the range where the RMSD between the APD90s of the two models are
 # small
 error_range = 30
+small_error = [(('RMSE', 'RMSE'), '<', error_range)]
 
 # Load results and extract points where the RMSD value is within the defined
 # range
-first_iter = True
-for file in result_files:
-    df = pd.read_csv(file,
-                     header=[0, 1], index_col=[0],
-                     skipinitialspace=True)
-    chosen_df = df.loc[df['RMSE']['RMSE'] < error_range]
-
-    if first_iter:
-        combined_df = df
-        combined_chosen_df = chosen_df
-        first_iter = False
-    else:
-        combined_chosen_df = pd.concat([combined_chosen_df, chosen_df])
-        combined_df = pd.concat([combined_df, df])
+combined_df = results.load(columns=['param_values', 'RMSE', 'ME'])
+combined_chosen_df = results.load(columns=['param_values'],
+                                  filters=small_error)
 
 Vhalf_range = combined_df['param_values']['Vhalf'].values
 Kmax_range = combined_df['param_values']['Kmax'].values
@@ -106,25 +94,12 @@ Ku_chosen = combined_chosen_df['param_values']['Ku'].values
 # Read simulated data of virtual drugs in the parameter space around the
 # surface where the RMSD value is small
 data_dir = data_dir + '../SA_curve/'
-file_prefix = 'SA_curve'
-result_files2 = [data_dir + f for f in os.listdir(data_dir)
-                 if f.startswith(file_prefix)]
+results = modelling.ResultsStore(data_dir, 'SA_curve', param_names)
 
 min_Ku = min(Ku_range)
 
 # Load results where the RMSD value is within the defined range
-first_iter = True
-for file in result_files2:
-    df = pd.read_csv(file,
-                     header=[0, 1], index_col=[0],
-                     skipinitialspace=True)
-    chosen_df = df.loc[df['RMSE']['RMSE'] < error_range]
-
-    if first_iter:
-        curve_chosen_df = chosen_df
-        first_iter = False
-    else:
-        curve_chosen_df = pd.concat([curve_chosen_df, chosen_df])
+curve_chosen_df = results.load(columns=['param_values'], filters=small_error)
 
 Vhalf_curve = curve_chosen_df['param_values']['Vhalf'].values
 Kmax_curve = curve_chosen_df['param_values']['Kmax'].values
@@ -23,6 +23,7 @@ if not os.path.isdir(fig_dir):
 
 expdata_dir = '../../exp_data/'
 data_dir = '../../simulation_data/background/'
+trace_store = modelling.TraceStore(data_dir)
 
 # Set up structure of the figure
 fig = modelling.figures.FigureStructure(figsize=(12, 8), gridspec=(2, 2),
@@ -49,8 +50,7 @@ panel2 = axs[0]
 pulse_time = 25e3
 repeats = 10
 
-control_log = myokit.DataLog.load_csv(data_dir +
-                                      'control_Milnes_current_pulses10.csv')
+control_log = trace_store.load('control_Milnes_current_pulses10')
 
 for i, drug in enumerate(drugs):
 
@@ -61,8 +61,7 @@ for i, drug in enumerate(drugs):
     current = df.loc[df['conc'] == drug_conc[i]]
 
     # Load simulated data
-    log = myokit.DataLog.load_csv(
-        data_dir + drug + '_Milnes_current_pulses10.csv')
+    log = trace_store.load(drug + '_Milnes_current_pulses10')
 
     max_sweeps = max(current['sweep'].values)
     for sweep in range(1, max_sweeps + 1):
@@ -128,12 +127,9 @@ panel3 = axs[1]
 
 # Load steady state IKr data for drug free, addition of dofetilide
 # and verapamil conditions (Milnes' protocol)
-drug_free_log = myokit.DataLog.load_csv(
-    data_dir + 'drug_free_Milnes_current.csv')
-trapped_log = myokit.DataLog.load_csv(
-    data_dir + 'dofetilide_Milnes_current.csv')
-nontrapped_log = myokit.DataLog.load_csv(
-    data_dir + 'verapamil_Milnes_current.csv')
+drug_free_log = trace_store.load('drug_free_Milnes_current')
+trapped_log = trace_store.load('dofetilide_Milnes_current')
+nontrapped_log = trace_store.load('verapamil_Milnes_current')
 log_all = [drug_free_log, trapped_log, nontrapped_log]
 
 # Load hERG channel model
@@ -181,12 +177,9 @@ panel4 = axs[2]
 
 # Load steady state IKr data for drug free, addition of a dofetilide-like drug
 # and a verapamil-like drug conditions (AP clamp protocol)
-drug_free_log = myokit.DataLog.load_csv(
-    data_dir + 'drug_free_APclamp_current.csv')
-trapped_log = myokit.DataLog.load_csv(
-    data_dir + 'dofetilide_APclamp_current.csv')
-nontrapped_log = myokit.DataLog.load_csv(
-    data_dir + 'verapamil_APclamp_current.csv')
+drug_free_log = trace_store.load('drug_free_APclamp_current')
+trapped_log = trace_store.load('dofetilide_APclamp_current')
+nontrapped_log = trace_store.load('verapamil_APclamp_current')
 log_all = [drug_free_log, trapped_log, nontrapped_log]
 
 # Load AP model
@@ -4,7 +4,6 @@
 #
 
 import matplotlib
-import myokit
 import numpy as np
 import os
 import pandas as pd
@@ -47,13 +46,12 @@ panel2 = axs[3]
 # Load hERG current data
 SD_fileprefix = 'SD_current_'
 CS_fileprefix = 'CS_current_'
-SD_data_files = [f for f in os.listdir(data_dir) if
-                 f.startswith(SD_fileprefix)]
-CS_data_files = [f for f in os.listdir(data_dir) if
-                 f.startswith(CS_fileprefix)]
-drug_conc = [float(fname[len(SD_fileprefix):-4]) for fname in
+trace_store = modelling.TraceStore(data_dir)
+SD_data_files = trace_store.names(SD_fileprefix)
+CS_data_files = trace_store.names(CS_fileprefix)
+drug_conc = [float(fname[len(SD_fileprefix):]) for fname in
              SD_data_files]
-drug_conc_CS = [float(fname[len(CS_fileprefix):-4]) for fname in
+drug_conc_CS = [float(fname[len(CS_fileprefix):]) for fname in
                 CS_data_files]
 
 # Sort in increasing order of drug concentration
@@ -67,10 +65,8 @@ conductance_data_files = [CS_data_files[i] for i in sort_ind_CS]
 trapping_hERG_log = []
 conductance_hERG_log = []
 for i in range(len(trapping_data_files)):
-    trapping_hERG_log.append(myokit.DataLog.load_csv(
-        data_dir + trapping_data_files[i]))
-    conductance_hERG_log.append(myokit.DataLog.load_csv(
-        data_dir + conductance_data_files[i]))
+    trapping_hERG_log.append(trace_store.load(trapping_data_files[i]))
+    conductance_hERG_log.append(trace_store.load(conductance_data_files[i]))
 
 # Initiate constants and variables
 pulse_time = 25e3
@@ -147,10 +143,9 @@ panel5 = axs[2]
 
 # Load AP data
 CS_AP_prefix = 'CS_AP_'
-conductance_data_files = [f for f in os.listdir(data_dir) if
-                          f.startswith(CS_AP_prefix) and not
-                          f.startswith('CS_AP_transient')]
-drug_conc = [float(fname[len(CS_AP_prefix):-4]) for fname in
+conductance_data_files = [f for f in trace_store.names(CS_AP_prefix) if
+                          not f.startswith('CS_AP_transient')]
+drug_conc = [float(fname[len(CS_AP_prefix):]) for fname in
              conductance_data_files]
 
 # Sort in increasing order of drug concentration
@@ -160,8 +155,7 @@ conductance_data_files = [conductance_data_files[i] for i in sort_ind]
 
 conductance_AP_log = []
 for i in range(len(conductance_data_files)):
-    conductance_AP_log.append(myokit.DataLog.load_csv(
-        data_dir + conductance_data_files[i]))
+    conductance_AP_log.append(trace_store.load(conductance_data_files[i]))
 
 # Initiate constants and variables
 plotting_pulse_time = 1000 * 2
@@ -6,8 +6,6 @@
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
-import os
-import pandas as pd
 
 import modelling
 
@@ -20,21 +18,14 @@ SA_model = modelling.SensitivityAnalysis()
 
 # Define directory to load simulated results and save figures
 data_dir = '../../simulation_data/parameter_space_exploration/SA_space/'
-file_prefix = 'SA_allparam'
-result_files = [data_dir + f for f in os.listdir(data_dir)
-                if f.startswith(file_prefix)]
+results = modelling.ResultsStore(data_dir, 'SA_allparam',
+                                 SA_model.param_names)
 fig_dir = '../../figures/supp_mat/'
 
 # Load all data
-first_iter = True
-for file in result_files:
-    df = pd.read_csv(file, header=[0, 1], index_col=[0],
-                     skipinitialspace=True)
-    if first_iter:
-        combined_df = df
-        first_iter = False
-    else:
-        combined_df = pd.concat([combined_df, df])
+combined_df = results.load(columns=['param_values', 'drug_conc_AP',
+                                    'APD_trapping', 'APD_conductance',
+                                    'RMSE'])
 
 # Sort dataframe in decreasing Ku, increasing Kmax and increasing Vhalf-trap
 combined_df = combined_df.sort_values(by=[('param_values', 'Ku'),
@@ -125,19 +116,7 @@ fig.savefig(fig_dir + 'FigS_APD_Vhalf.pdf')
 #
 
 # Load APD90 data
-data_dir = '../../simulation_data/parameter_space_exploration/SA_space/'
-file_prefix = 'SA_allparam'
-result_files = [data_dir + f for f in os.listdir(data_dir)
-                if f.startswith(file_prefix)]
-first_iter = True
-for file in result_files:
-    df = pd.read_csv(file, header=[0, 1], index_col=[0],
-                     skipinitialspace=True)
-    if first_iter:
-        combined_df = df
-        first_iter = False
-    else:
-        combined_df = pd.concat([combined_df, df])
+combined_df = results.load(columns=['param_values', 'RMSE', 'ME'])
 
 RMSError = combined_df['RMSE']['RMSE'].values
 MError = combined_df['ME']['ME'].values
@@ -160,10 +139,12 @@ scale_map = matplotlib.cm.ScalarMappable(norm=cmap_norm, cmap=cmap)
 # Choose three Vhalf-trap values and extract data from the dataframe
 chosen_Vhalf_value = [-199.5, -84.66, -1.147]
 for i in range(3):
-    # Extract from the dataframe with Vhalf-trap values close to the chosen
-    # value
-    chosen_Vhalf_df = combined_df[np.abs(combined_df[('param_values', 'Vhalf')]
-                                  - chosen_Vhalf_value[i]) < 0.01]
+    # Load the results with Vhalf-trap values close to the chosen value
+    Vhalf = ('param_values', 'Vhalf')
+    chosen_Vhalf_df = results.load(
+        columns=['param_values', 'RMSE', 'ME'],
+        filters=[(Vhalf, '>', chosen_Vhalf_value[i] - 0.01),
+                 (Vhalf, '<', chosen_Vhalf_value[i] + 0.01)])
     chosen_Vhalf_df = chosen_Vhalf_df.sort_values(by=[('param_values', 'Kmax'),
                                                       ('param_values', 'Ku')],
                                                   ascending=[True, True])
@@ -10,6 +10,8 @@ import numpy as np
 import os
 import pandas as pd
 
+import modelling
+
 # Read APD90 differences for all synthetic drug
 data_dir = '../../simulation_data/'
 filename = 'SA_alldrugs.csv'
@@ -21,6 +23,7 @@ drug_list = drug_list[:-1]
 
 # Define directories and variables
 data_dir = '../../simulation_data/supp_mat/APD90diff_N/'
+param_names = modelling.SensitivityAnalysis().param_names
 percentage_diff_filename = 'N_percentage_diff.csv'
 first_iter = True
 RMSD_boxplot = []
@@ -28,10 +31,9 @@ delta_RMSD_boxplot = []
 
 for drug in drug_list:
     # Read RMSD of each synthetic drug when the Hill coefficient varies
-    filepath = data_dir + 'SA_' + drug + '_N.csv'
-    df = pd.read_csv(filepath,
-                     header=[0, 1], index_col=[0],
-                     skipinitialspace=True)
+    results = modelling.ResultsStore(data_dir, 'SA_' + drug + '_N',
+                                     param_names, param_id=False)
+    df = results.load()
 
     N_range = np.array(df['param_values']['N'].values)
     RMSD_arr = np.array(df['RMSE']['RMSE'].values)
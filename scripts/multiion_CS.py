@@ -0,0 +1,61 @@
+#
+# Compute the APD90 and qNet of the AP-CS model with the conductances of
+# several ion channels scaled by the Hill curves of each drug, interpolated
+# from a sparse-grid surrogate of the AP model instead of simulated at every
+# drug concentration.
+#
+
+import os
+import pandas as pd
+
+import modelling
+
+# Define directories of the surrogate and of the simulated data
+surrogate_dir = '../simulation_data/multiion_surrogate/'
+data_dir = '../simulation_data/model_comparison/'
+
+# Define drugs with Hill curves of all ion channels
+param_lib = modelling.BindingParameters()
+drug_list = list(param_lib.Hill_curve.keys())
+drug_conc_lib = modelling.DrugConcentrations()
+
+if __name__ == '__main__':
+    # Set up AP model
+    model_cache = modelling.ModelCache()
+    APmodel = model_cache.load('../math_model/ohara-cipa-v1-2017-opt.mmt')
+    AP_model = modelling.BindingKinetics(APmodel, current_head='ikr',
+                                         steady_state_method='shooting',
+                                         model_cache=model_cache)
+    pulse_time = 1000
+    AP_model.protocol = modelling.ProtocolLibrary().current_impulse(
+        pulse_time)
+    # Reuse steady states computed by previous runs and other scripts
+    AP_model.steady_state_cache = modelling.SteadyStateCache(
+        '../simulation_data/steady_states.db')
+
+    # Build the surrogate of the steady-state APD90 and qNet over the
+    # conductance scales, or load a previously built one
+    surrogate = modelling.MultiIonSurrogate(AP_model,
+                                            directory=surrogate_dir)
+    surrogate.build()
+    print('Validation error of the surrogate: ',
+          surrogate.validation_error())
+
+    for drug in drug_list:
+        # Scale the conductances with the Hill curves of the drug at each
+        # concentration, simulating the scales outside the resolved region
+        # of the surrogate
+        drug_conc = drug_conc_lib.drug_concentrations[drug]['fine']
+        ion_scale = surrogate.ion_scale(drug, drug_conc)
+        biomarkers = surrogate(ion_scale)
+
+        # Save APD90 and qNet of the multi-ion AP-CS model
+        drug_dir = data_dir + drug + '/'
+        if not os.path.isdir(drug_dir):
+            os.makedirs(drug_dir)
+        CS_df = pd.DataFrame(ion_scale)
+        CS_df['APD90'] = biomarkers['APD90']
+        CS_df['qNet'] = biomarkers['qNet']
+        CS_df['drug concentration'] = drug_conc
+        CS_df.to_csv(drug_dir + 'multiion_CS.csv')
+        print('done ', drug)
@@ -79,13 +79,11 @@ AP_model = modelling.BindingKinetics(APmodel, current_head='ikr')
 # Set current protocol
 pulse_time = 1000
 AP_model.protocol = modelling.ProtocolLibrary().current_impulse(pulse_time)
-base_conductance = APmodel.get('ikr.gKr').value()
 
 # Define constants and variables for APD90 simulation of AP-CS model
 drug = 'verapamil'
 repeats = 1000
 save_signal = 2
-offset = 50
 drug_conc = drug_conc_lib.drug_concentrations[drug]['fine']
 
 # Define directories to save data
@@ -93,6 +91,12 @@ prot_dir = '../simulation_data/model_comparison/' + drug + '/protocols/'
 if not os.path.isdir(prot_dir):
     os.makedirs(prot_dir)
 
+# Look up the APD90s of the AP-CS model instead of simulating them
+APD_table = modelling.APDTable(
+    AP_model, steady_state_pulse=repeats, save_signal=save_signal,
+    abs_tol=abs_tol, rel_tol=rel_tol,
+    directory='../simulation_data/APD_tables/')
+
 # Simulate APD90 of AP-CS model whose ionic conductance is calibrated with
 # different protocols
 for p in protocol_name:
@@ -102,22 +106,10 @@ for p in protocol_name:
     Hill_eq = Hill_coef_df.loc[Hill_coef_df['protocol'] == p]
     Hill_eq = Hill_eq.values.tolist()[0][:-1]
 
-    # Simulate AP and calculate APD90
+    # Compute APD90 of each pulse from the APD table
     for i in range(len(drug_conc)):
-        print('simulating for drug concentration: ' + str(drug_conc[i]))
-
         reduction_scale = Hill_model.simulate(Hill_eq, drug_conc[i])
-        d2 = AP_model.conductance_simulation(
-            base_conductance * reduction_scale, repeats, timestep=0.01,
-            save_signal=save_signal, abs_tol=abs_tol, rel_tol=rel_tol,
-            log_var=['engine.time', 'membrane.V'])
-
-        APD_conductance_pulse = []
-        for pulse in range(save_signal):
-            apd90 = AP_model.APD90(d2['membrane.V', pulse], offset, 0.01)
-            APD_conductance_pulse.append(apd90)
-
-        APD_conductance.append(APD_conductance_pulse)
+        APD_conductance.append(list(APD_table(reduction_scale)))
 
     # Save APD90s
     column_name = ['pulse ' + str(i) for i in range(save_signal)]
@@ -91,43 +91,30 @@ for drug in drug_list:
     AP_model.protocol = modelling.ProtocolLibrary().current_impulse(pulse_time)
 
     # Define constants
-    base_conductance = APmodel.get('ikr.gKr').value()
-    offset = 50
     save_signal = 2
     drug_conc = drug_conc_lib.drug_concentrations[drug]['fine']
 
+    # Look up the APD90s of the AP-CS model instead of simulating them
+    APD_table = modelling.APDTable(
+        AP_model, steady_state_pulse=repeats, save_signal=save_signal,
+        abs_tol=abs_tol, rel_tol=rel_tol,
+        directory='../simulation_data/APD_tables/')
+
     APD_conductance = []
     APD_trapping = []
 
     for i, conc in enumerate(drug_conc):
-        # Simulate AP of the AP-SD model
-        log = AP_model.drug_simulation(
+        # Simulate AP of the AP-SD model, tracking the APD90s during the
+        # simulation
+        biomarkers = AP_model.drug_simulation(
             drug, conc, repeats, save_signal=save_signal,
-            abs_tol=abs_tol, rel_tol=rel_tol,
-            log_var=['engine.time', 'membrane.V'])
-
-        # Calculate the APD90
-        APD_trapping_pulse = []
-        for pulse in range(save_signal):
-            apd90 = AP_model.APD90(log['membrane.V', pulse], offset, 0.1)
-            APD_trapping_pulse.append(apd90)
+            abs_tol=abs_tol, rel_tol=rel_tol, biomarkers=True)
 
-        APD_trapping.append(APD_trapping_pulse)
+        APD_trapping.append(list(biomarkers['APD90']))
 
-        # Simulate AP of the AP-CS model
+        # Compute APD90 of the AP-CS model from the APD table
         reduction_scale = Hill_model.simulate(Hill_eq, conc)
-        d2 = AP_model.conductance_simulation(
-            base_conductance * reduction_scale, repeats,
-            save_signal=save_signal, abs_tol=abs_tol, rel_tol=rel_tol,
-            log_var=['engine.time', 'membrane.V'])
-
-        # Calculate the APD90
-        APD_conductance_pulse = []
-        for pulse in range(save_signal):
-            apd90 = AP_model.APD90(d2['membrane.V', pulse], offset, 0.1)
-            APD_conductance_pulse.append(apd90)
-
-        APD_conductance.append(APD_conductance_pulse)
+        APD_conductance.append(list(APD_table(reduction_scale)))
 
     # Save APD of the two models
     data_dir = data_dir + protocol_list[0] + '/'